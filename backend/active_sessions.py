@@ -0,0 +1,138 @@
+"""
+In-memory stage results of active assessment sessions
+
+Used by server.py so complete_assessment can fuse a session's stage
+results without reading the database back.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+# Fields complete_assessment reads from a stored stage entry, in either format
+STAGE_SUMMARY_FIELDS = ('prediction', 'probability', 'confidence')
+
+def stage_summary(result):
+    """The parts of a stage result (or stored stage entry) that complete_assessment fuses"""
+    result = result.get('result', result)
+    return {field: result[field] for field in STAGE_SUMMARY_FIELDS}
+
+def newer_than_stored(written_at, entry):
+    """Whether a stage result written at written_at is newer than the stored entry (None if not stored)"""
+    stored_at = (entry or {}).get('timestamp')
+    return not isinstance(stored_at, datetime) or written_at > stored_at
+
+def merge_stored(summaries, written, stored):
+    """Stage summaries of a partial in-memory session merged with the stored stage entries
+    
+    summaries and written are what SessionStore.get returned; stored maps
+    stages to their stored entries. A stage this process wrote after the
+    stored one (its write still buffered or failing) wins.
+    """
+    return {
+        **{stage: stage_summary(entry) for stage, entry in stored.items()},
+        **{stage: summary for stage, summary in summaries.items()
+           if newer_than_stored(written[stage], stored.get(stage))}
+    }
+
+def approximate_size(value):
+    """Rough deep size in bytes of JSON-like values"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(approximate_size(v) for v in value)
+    return size
+
+class SessionStore:
+    """In-process stage results of active sessions, bounded by count and TTL
+    
+    Holds the per-stage summaries complete_assessment fuses, with the time
+    each stage was written, so finishing a session needs no database read.
+    Entries expire ttl_seconds after their last stage write and the least
+    recently written session is evicted beyond max_sessions. A session is
+    whole (a hit) only when this process wrote every one of its stages;
+    with other workers behind the same database, callers merge a partial
+    session with the session document. Used from the event loop only.
+    """
+    
+    def __init__(self, stages, max_sessions=10000, ttl_seconds=1800):
+        self.stages = tuple(stages)
+        self.max_sessions = max_sessions  # 0 disables the store
+        self.ttl = ttl_seconds
+        # session_id -> {'stages', 'written', 'expires', 'bytes'}, least recently written first
+        self._sessions = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.partial = 0
+        self.expired = 0
+        self.evictions = 0
+    
+    def put(self, session_id, stage, summary, written_at):
+        """Record a stage result written (stored) at written_at"""
+        if not self.max_sessions:
+            return
+        now = time.monotonic()
+        self._purge_expired(now)
+        entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            entry = {'stages': {}, 'written': {}, 'bytes': 0}
+        self.bytes -= entry['bytes']
+        entry['stages'][stage] = summary
+        entry['written'][stage] = written_at
+        entry['expires'] = now + self.ttl
+        entry['bytes'] = approximate_size(entry['stages'])
+        self.bytes += entry['bytes']
+        self._sessions[session_id] = entry
+        while len(self._sessions) > self.max_sessions:
+            self._drop(next(iter(self._sessions)))
+            self.evictions += 1
+    
+    def get(self, session_id):
+        """({stage: summary}, {stage: written_at}) known in this process, empty if none"""
+        entry = self._sessions.get(session_id)
+        if entry is not None and entry['expires'] <= time.monotonic():
+            self._drop(session_id)
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return {}, {}
+        if self.is_whole(entry['stages']):
+            self.hits += 1
+        else:
+            self.partial += 1
+        return entry['stages'], entry['written']
+    
+    def is_whole(self, summaries):
+        return all(stage in summaries for stage in self.stages)
+    
+    def _purge_expired(self, now):
+        # Write order is expiry order, so expired sessions are at the front
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if entry['expires'] > now:
+                break
+            self._drop(session_id)
+            self.expired += 1
+    
+    def _drop(self, session_id):
+        entry = self._sessions.pop(session_id)
+        self.bytes -= entry['bytes']
+    
+    def stats(self):
+        lookups = self.hits + self.misses + self.partial
+        return {
+            'sessions': len(self._sessions),
+            'max_sessions': self.max_sessions,
+            'ttl_seconds': self.ttl,
+            'approx_bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'partial': self.partial,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'expired': self.expired,
+            'evictions': self.evictions
+        }
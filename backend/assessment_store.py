@@ -0,0 +1,463 @@
+"""
+Assessment persistence backends
+
+server.py stores stage results and sessions through an AssessmentRepository
+and never talks to a database driver directly. Two backends implement it:
+
+    MongoRepository   MongoDB through Motor (the default)
+    SQLiteRepository  a local SQLite database in WAL mode, for single-node
+                      deployments and for running without any external service
+
+Documents look the same on both: standalone stage documents in
+'assessments' and one document per session in 'sessions', with the stage
+results under stages.<stage> and the fused result under final_result.
+
+Usage:
+    python assessment_store.py benchmark [--backend sqlite mongo] [--sessions 2000]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bson import ObjectId
+
+class PartialWriteError(Exception):
+    """Some items of a write were not stored; unwritten holds them, in order"""
+
+    def __init__(self, message, unwritten):
+        super().__init__(message)
+        self.unwritten = unwritten
+
+class AssessmentRepository:
+    """Interface of the assessment persistence backends
+
+    The write methods either store every item, raise PartialWriteError with
+    the items that were not stored, or raise any other exception when
+    nothing was stored.
+    """
+
+    name = None
+
+    async def insert_assessments(self, documents):
+        """Store standalone stage documents"""
+        raise NotImplementedError
+
+    async def update_sessions(self, updates):
+        """Apply (session_id, fields) upserts in order
+
+        fields maps dotted paths ('stages.behavioral', 'final_result', ...) to
+        the values to set; a new session document also gets created_at.
+        """
+        raise NotImplementedError
+
+    async def get_session(self, session_id, fields=None):
+        """The session document, optionally only the given (dotted) fields, or None"""
+        raise NotImplementedError
+
+    async def latest_stage_documents(self, session_id, stages):
+        """Most recent standalone document per stage for a session, keyed by stage
+
+        Only sessions stored before the per-session documents are found here.
+        """
+        raise NotImplementedError
+
+    async def recent_stage_results(self, stages, limit):
+        """Newest stored {stage, data, result, model_version, timestamp} entries"""
+        raise NotImplementedError
+
+    async def ensure_indexes(self):
+        pass
+
+    async def start(self):
+        """Start background work, from the running event loop"""
+        pass
+
+    async def close(self):
+        pass
+
+    def stats(self):
+        return {'backend': self.name}
+
+# Stage entry fields the cache warm-up needs, in the full or the compact format
+RECENT_RESULT_FIELDS = ('stage', 'data', 'result', 'packed', 'prediction', 'probability', 'confidence',
+                        'model_version', 'timestamp')
+
+def merge_recent_results(documents, sessions, stages, limit):
+    """Newest first stage results from standalone documents and session documents"""
+    results = [doc for doc in documents if doc.get('stage') in stages and 'model_version' in doc]
+    for session in sessions:
+        for stage, entry in session.get('stages', {}).items():
+            if stage in stages and 'model_version' in entry:
+                results.append({'stage': stage, **entry})
+    return sorted(results, key=lambda doc: doc['timestamp'], reverse=True)[:limit]
+
+class MongoRepository(AssessmentRepository):
+    """Assessments and sessions collections of a Motor database"""
+
+    name = 'mongo'
+
+    def __init__(self, db):
+        self.db = db
+
+    async def insert_assessments(self, documents):
+        from pymongo.errors import BulkWriteError
+        try:
+            await self.db.assessments.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Duplicate keys were written by an earlier attempt
+            failed = {err['index'] for err in e.details.get('writeErrors', []) if err.get('code') != 11000}
+            if failed:
+                raise PartialWriteError(str(e), [doc for i, doc in enumerate(documents) if i in failed])
+
+    async def update_sessions(self, updates):
+        from pymongo import UpdateOne
+        from pymongo.errors import BulkWriteError
+        now = datetime.now()
+        try:
+            await self.db.sessions.bulk_write([
+                UpdateOne({'_id': session_id}, {'$set': fields, '$setOnInsert': {'created_at': now}}, upsert=True)
+                for session_id, fields in updates
+            ], ordered=True)
+        except BulkWriteError as e:
+            # An ordered write stops at its first error; a duplicate key on an
+            # upsert is a lost race and is retried like any other failure
+            errors = e.details.get('writeErrors', [])
+            first = min((err['index'] for err in errors), default=0)
+            raise PartialWriteError(str(e), updates[first:])
+
+    async def get_session(self, session_id, fields=None):
+        projection = {field: 1 for field in fields} if fields else None
+        return await self.db.sessions.find_one({'_id': session_id}, projection)
+
+    async def latest_stage_documents(self, session_id, stages):
+        docs = await self.db.assessments.find(
+            {'session_id': session_id, 'stage': {'$in': list(stages)}},
+            {'stage': 1, 'result': 1, 'timestamp': 1}
+        ).sort('timestamp', -1).to_list(length=None)
+
+        latest = {}
+        for doc in docs:
+            latest.setdefault(doc['stage'], doc)
+        return latest
+
+    async def recent_stage_results(self, stages, limit):
+        docs = await self.db.assessments.find(
+            {'stage': {'$in': list(stages)}, 'model_version': {'$exists': True}},
+            {field: 1 for field in RECENT_RESULT_FIELDS}
+        ).sort('timestamp', -1).limit(limit).to_list(length=limit)
+        sessions = await self.db.sessions.find({}, {'stages': 1}).sort('updated_at', -1).limit(limit).to_list(length=limit)
+        return merge_recent_results(docs, sessions, stages, limit)
+
+    async def ensure_indexes(self):
+        # Session lookups for sessions stored as per-stage documents
+        await self.db.assessments.create_index([('session_id', 1), ('stage', 1)])
+        # Latest-per-stage reads and the response cache warm-up
+        await self.db.assessments.create_index([('stage', 1), ('timestamp', -1)])
+        # Most recent sessions for the response cache warm-up
+        await self.db.sessions.create_index([('updated_at', -1)])
+
+    async def close(self):
+        self.db.client.close()
+
+def encode_document(value):
+    """JSON text of a document; datetimes, bytes and ObjectIds round-trip as {'$date'}/{'$binary'}/{'$oid'}"""
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {'$date': obj.isoformat()}
+        if isinstance(obj, ObjectId):
+            return {'$oid': str(obj)}
+        if isinstance(obj, bytes):
+            return {'$binary': base64.b64encode(obj).decode()}
+        if hasattr(obj, 'tolist'):  # NumPy scalars and arrays
+            return obj.tolist()
+        return str(obj)
+    return json.dumps(value, default=default, separators=(',', ':'))
+
+def _decode_object(obj):
+    if len(obj) == 1 and '$date' in obj:
+        return datetime.fromisoformat(obj['$date'])
+    if len(obj) == 1 and '$binary' in obj:
+        return base64.b64decode(obj['$binary'])
+    if len(obj) == 1 and '$oid' in obj:
+        return ObjectId(obj['$oid'])
+    return obj
+
+def decode_document(text):
+    return json.loads(text, object_hook=_decode_object)
+
+def _set_path(document, path, value):
+    """Set a dotted path like Mongo's $set, creating intermediate documents"""
+    *parents, key = path.split('.')
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    document[key] = value
+
+def _project(document, fields):
+    """Copy of document with only the given dotted fields (and _id), like a Mongo projection"""
+    projected = {'_id': document['_id']}
+    for field in fields:
+        *parents, key = field.split('.')
+        source = document
+        for parent in parents:
+            source = source.get(parent) if isinstance(source, dict) else None
+        if not isinstance(source, dict) or key not in source:
+            continue
+        target = projected
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[key] = source[key]
+    return projected
+
+def _sort_key(timestamp):
+    return timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS assessments (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT,
+    stage TEXT NOT NULL,
+    timestamp TEXT,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assessments_session_stage ON assessments (session_id, stage);
+CREATE INDEX IF NOT EXISTS assessments_stage_timestamp ON assessments (stage, timestamp DESC);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    updated_at TEXT,
+    document TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at DESC);
+"""
+
+class SQLiteRepository(AssessmentRepository):
+    """Both collections in one local SQLite database in WAL mode
+
+    Documents are stored as JSON text next to the columns they are looked up
+    by. All statements run on one dedicated thread, so the event loop never
+    blocks on disk and every write method is a single transaction.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-store')
+        self._connection = self._executor.submit(self._connect).result()
+
+    def _connect(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # WAL + NORMAL stays consistent on a crash and only fsyncs at checkpoints
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SQLITE_SCHEMA)
+        return connection
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _transaction(self, function, *args):
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = function(connection, *args)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    async def insert_assessments(self, documents):
+        rows = [(doc.get('session_id'), doc['stage'], _sort_key(doc.get('timestamp')), encode_document(doc))
+                for doc in documents]
+        await self._run(self._transaction, lambda connection: connection.executemany(
+            'INSERT INTO assessments (session_id, stage, timestamp, document) VALUES (?, ?, ?, ?)', rows))
+
+    def _update_sessions(self, connection, updates):
+        now = datetime.now()
+        for session_id, fields in updates:
+            row = connection.execute('SELECT document FROM sessions WHERE session_id = ?', (session_id,)).fetchone()
+            document = decode_document(row[0]) if row else {'_id': session_id, 'created_at': now}
+            for path, value in fields.items():
+                _set_path(document, path, value)
+            connection.execute(
+                'INSERT OR REPLACE INTO sessions (session_id, updated_at, document) VALUES (?, ?, ?)',
+                (session_id, _sort_key(document.get('updated_at', document['created_at'])), encode_document(document)))
+
+    async def update_sessions(self, updates):
+        await self._run(self._transaction, self._update_sessions, updates)
+
+    async def get_session(self, session_id, fields=None):
+        row = await self._run(lambda: self._connection.execute(
+            'SELECT document FROM sessions WHERE session_id = ?', (session_id,)).fetchone())
+        if row is None:
+            return None
+        document = decode_document(row[0])
+        return _project(document, fields) if fields else document
+
+    async def latest_stage_documents(self, session_id, stages):
+        stages = list(stages)
+        rows = await self._run(lambda: self._connection.execute(
+            f'SELECT document FROM assessments WHERE session_id = ? AND stage IN ({", ".join("?" * len(stages))}) '
+            'ORDER BY timestamp DESC', (session_id, *stages)).fetchall())
+
+        latest = {}
+        for (text,) in rows:
+            doc = decode_document(text)
+            latest.setdefault(doc['stage'], doc)
+        return latest
+
+    async def recent_stage_results(self, stages, limit):
+        stages = list(stages)
+
+        def read():
+            documents = self._connection.execute(
+                f'SELECT document FROM assessments WHERE stage IN ({", ".join("?" * len(stages))}) '
+                'ORDER BY timestamp DESC LIMIT ?', (*stages, limit)).fetchall()
+            sessions = self._connection.execute(
+                'SELECT document FROM sessions ORDER BY updated_at DESC LIMIT ?', (limit,)).fetchall()
+            return documents, sessions
+
+        documents, sessions = await self._run(read)
+        return merge_recent_results([decode_document(text) for (text,) in documents],
+                                    [decode_document(text) for (text,) in sessions], stages, limit)
+
+    async def close(self):
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=True)
+
+def create_repository(backend, mongo_url=None, database='asd_detection', sqlite_path=None, mongo_options=None):
+    """Repository for a STORAGE_BACKEND name ('mongo' or 'sqlite')
+
+    mongo_options are passed to the Motor client, e.g. serverSelectionTimeoutMS.
+    """
+    if backend == 'mongo':
+        import motor.motor_asyncio
+        return MongoRepository(motor.motor_asyncio.AsyncIOMotorClient(mongo_url, **(mongo_options or {}))[database])
+    if backend == 'sqlite':
+        return SQLiteRepository(sqlite_path)
+    raise ValueError(f"Unknown storage backend '{backend}', expected 'mongo' or 'sqlite'")
+
+BENCHMARK_STAGES = ('behavioral', 'eye_tracking', 'facial_analysis')
+
+def benchmark_entry(i, stage, timestamp):
+    """A stage entry shaped and sized like the ones the server stores"""
+    data = {f'A{q}_Score': float((i + q) % 3) / 2 for q in range(1, 11)}
+    data.update({'age': float(20 + i % 40), 'gender': 'm' if i % 2 else 'f'})
+    probability = (i % 100) / 100
+    result = {
+        'prediction': int(probability > 0.5),
+        'probability': probability,
+        'confidence': abs(probability - 0.5) * 2,
+        'model_results': {'random_forest': {'probability': probability}, 'svm': {'probability': probability}},
+        'explanation': {
+            'summary': f"{stage} assessment {'indicates' if probability > 0.5 else 'does not indicate'} ASD patterns",
+            'top_features': {name: {'importance': 0.1, 'value': value} for name, value in list(data.items())[:5]},
+            'recommendations': ["Consult with a specialist for comprehensive evaluation"] * 3
+        },
+        'stage': stage
+    }
+    return {'data': data, 'result': result, 'model_version': 'benchmark', 'timestamp': timestamp}
+
+async def run_benchmark(repository, n_sessions, batch_size=500):
+    """Insert, upsert and read back n_sessions sessions; returns {metric: ops/s}
+
+    Raises RuntimeError if anything read back differs from what was written.
+    """
+    rates = {}
+
+    # Standalone stage documents, in write-behind sized batches
+    documents = [{'session_id': f'legacy-{i}', 'stage': stage, **benchmark_entry(i, stage, datetime.now())}
+                 for i in range(n_sessions) for stage in BENCHMARK_STAGES]
+    start = time.perf_counter()
+    for offset in range(0, len(documents), batch_size):
+        await repository.insert_assessments(documents[offset:offset + batch_size])
+    rates['inserts/s'] = len(documents) / (time.perf_counter() - start)
+
+    # One upsert per stage per session, then the fused result
+    updates = []
+    for stage in BENCHMARK_STAGES:
+        for i in range(n_sessions):
+            now = datetime.now()
+            updates.append((f'session-{i}', {f'stages.{stage}': benchmark_entry(i, stage, now), 'updated_at': now}))
+    updates += [(f'session-{i}', {'final_result': {'final_probability': (i % 100) / 100}, 'completed_at': datetime.now()})
+                for i in range(n_sessions)]
+    start = time.perf_counter()
+    for offset in range(0, len(updates), batch_size):
+        await repository.update_sessions(updates[offset:offset + batch_size])
+    rates['session upserts/s'] = len(updates) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(n_sessions):
+        session = await repository.get_session(f'session-{i}', ['stages'])
+        if session is None or sorted(session['stages']) != sorted(BENCHMARK_STAGES):
+            raise RuntimeError(f"session-{i} read back incomplete: {session}")
+        if session['stages']['behavioral']['result'] != benchmark_entry(i, 'behavioral', None)['result']:
+            raise RuntimeError(f"session-{i} read back with a different behavioral result")
+    rates['session reads/s'] = n_sessions / (time.perf_counter() - start)
+
+    session = await repository.get_session('session-0')
+    if session.get('final_result', {}).get('final_probability') != 0.0 or 'created_at' not in session:
+        raise RuntimeError(f"session-0 is missing its final result: {session}")
+    latest = await repository.latest_stage_documents('legacy-1', BENCHMARK_STAGES)
+    if sorted(latest) != sorted(BENCHMARK_STAGES):
+        raise RuntimeError(f"legacy-1 stage documents not found: {sorted(latest)}")
+    recent = await repository.recent_stage_results(BENCHMARK_STAGES, 100)
+    if len(recent) != 100 or any(a['timestamp'] < b['timestamp'] for a, b in zip(recent, recent[1:])):
+        raise RuntimeError("recent stage results are not the newest 100 in order")
+    return rates
+
+async def benchmark_backend(backend, n_sessions, mongo_url):
+    if backend == 'mongo':
+        database = 'asd_detection_benchmark'
+        repository = create_repository('mongo', mongo_url, database)
+        await repository.db.client.drop_database(database)
+        try:
+            await repository.ensure_indexes()
+            return await run_benchmark(repository, n_sessions)
+        finally:
+            await repository.db.client.drop_database(database)
+
+    with tempfile.TemporaryDirectory() as directory:
+        repository = create_repository('sqlite', sqlite_path=os.path.join(directory, 'benchmark.sqlite3'))
+        try:
+            await repository.ensure_indexes()
+            return await run_benchmark(repository, n_sessions)
+        finally:
+            await repository.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the persistence benchmark suite against storage backends")
+    parser.add_argument('command', choices=['benchmark'])
+    parser.add_argument('--backend', nargs='+', choices=['sqlite', 'mongo'], default=['sqlite'])
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--mongo-url', default=os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'backend':>8} {'inserts/s':>12} {'session upserts/s':>18} {'session reads/s':>16}")
+    for backend in args.backend:
+        try:
+            rates = asyncio.run(benchmark_backend(backend, args.sessions, args.mongo_url))
+        except Exception as e:
+            print(f"{backend:>8} failed: {e}")
+            failed = True
+            continue
+        print(f"{backend:>8} {rates['inserts/s']:>12,.0f} {rates['session upserts/s']:>18,.0f} "
+              f"{rates['session reads/s']:>16,.0f}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Offline multi-process batch scoring
+
+Scores a behavioral or eye tracking CSV without the HTTP server, using the
+same model loading (load_model_artifacts) and feature assembly / validation
+(score_upload_chunk) as server.py, from scoring.py. The file is read in chunks that fan out to
+a process pool whose workers load the models once at startup; results are
+written in input order as CSV or NDJSON, with the same columns as the
+upload endpoints.
+
+Usage:
+    python batch_score.py behavioral autism_behavioral.csv predictions.csv
+    python batch_score.py eye_tracking processed_features.csv out.ndjson --workers 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+def _init_worker():
+    """Pool initializer: load the models once per worker process"""
+    import scoring
+    scoring.load_model_artifacts()
+
+def _score_chunk(stage, chunk):
+    import scoring
+    return scoring.score_upload_chunk(stage, chunk)
+
+def count_data_lines(path):
+    """Lines after the header, the progress total (quoted newlines make it an estimate)"""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    # A last line without a trailing newline still holds a row
+    lines += last != b'\n'
+    return max(lines - 1, 0)
+
+def _progress(rows, start, total_rows):
+    elapsed = time.perf_counter() - start
+    done = f"{min(rows / total_rows, 1.0):6.1%}" if total_rows else "   n/a"
+    sys.stderr.write(f"\r{done}  {rows:,} rows  {rows / elapsed if elapsed else 0:,.0f} rows/s  {elapsed:.1f}s")
+    sys.stderr.flush()
+
+def score_file(stage, input_path, output_path, output_format, workers, chunk_rows):
+    """Score input_path chunk by chunk on a process pool and write the results in order"""
+    import pandas as pd
+    import scoring
+
+    required_columns = scoring.BEHAVIORAL_FEATURE_NAMES if stage == 'behavioral' else scoring.EYE_TRACKING_FEATURE_NAMES
+    # pandas reads ahead of the chunk it returns, so the file position says
+    # little about progress; count rows against the file's line count instead
+    total_rows = count_data_lines(input_path)
+    rows = scored = 0
+    start = time.perf_counter()
+
+    with open(input_path, 'rb') as input_file, open(output_path, 'w', newline='') as output, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                initializer=_init_worker) as pool:
+        # Keep a few chunks per worker in flight, bounded so memory stays flat
+        pending = deque()
+        header = True
+
+        def write_next():
+            nonlocal header, rows, scored
+            chunk, offset, future = pending.popleft()
+            errors, valid_rows, _, results = future.result()
+            output.write(scoring.format_upload_rows(
+                scoring.upload_result_rows(chunk, offset, errors, valid_rows, results), output_format, header))
+            header = False
+            rows += len(chunk)
+            scored += len(results)
+            _progress(rows, start, total_rows)
+
+        offset = 0
+        for chunk in pd.read_csv(input_file, chunksize=chunk_rows):
+            if offset == 0:
+                missing = [c for c in required_columns if c not in chunk.columns]
+                if missing:
+                    raise ValueError(f"Missing columns: {', '.join(missing)}")
+            pending.append((chunk, offset, pool.submit(_score_chunk, stage, chunk)))
+            offset += len(chunk)
+            if len(pending) >= 2 * workers:
+                write_next()
+        while pending:
+            write_next()
+
+    elapsed = time.perf_counter() - start
+    sys.stderr.write(f"\nScored {scored:,} of {rows:,} rows ({rows - scored:,} invalid) in {elapsed:.1f}s "
+                     f"({rows / elapsed if elapsed else 0:,.0f} rows/s) -> {output_path}\n")
+    return scored, rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a behavioral or eye tracking CSV offline")
+    parser.add_argument('stage', choices=['behavioral', 'eye_tracking'])
+    parser.add_argument('input', help="CSV shaped like autism_behavioral.csv / processed_features.csv")
+    parser.add_argument('output', help="output file, .csv or .ndjson")
+    parser.add_argument('--format', choices=['csv', 'ndjson'],
+                        help="output format (default: from the output file extension)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-rows', type=int, default=5000)
+    parser.add_argument('--model-dir', help="model directory (default: MODEL_DIR or the repo's models/)")
+    args = parser.parse_args()
+
+    if args.model_dir:
+        # Read by scoring.py on import, in this process and in the workers
+        os.environ['MODEL_DIR'] = os.path.abspath(args.model_dir)
+    output_format = args.format or ('ndjson' if args.output.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+    try:
+        score_file(args.stage, args.input, args.output, output_format, max(1, args.workers), args.chunk_rows)
+    except Exception as e:
+        print(f"\nBatch scoring failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Precomputed lookup table for the behavioral questionnaire
+
+A1-A10 only take the values 0, 0.5 and 1 and gender is binary, so for one age
+the whole input space is 3^10 x 2 = 118,098 points. The build step scores every
+point with the RandomForest and SVM for each configured age and stores the
+probabilities in a memory-mapped .npy array indexed by
+
+    [age, gender, base-3 code of (2 * A1, ..., 2 * A10)]
+
+with A1 as the most significant digit. Rows whose age is not in the table fall
+back to live inference.
+
+Usage:
+    python behavioral_table.py build [--model-dir models] [--ages 17-65]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from forest_engine import file_fingerprint
+
+# Bump when the .npy/.json layout changes
+TABLE_FORMAT_VERSION = 1
+
+TABLE_FILE = 'behavioral_lookup.npy'
+META_FILE = 'behavioral_lookup.json'
+
+N_QUESTIONS = 10
+N_CODES = 3 ** N_QUESTIONS
+
+# Place value of each question's digit, A1 first
+DIGIT_WEIGHTS = 3 ** np.arange(N_QUESTIONS - 1, -1, -1)
+
+# Model files the table is derived from; a changed file makes it stale
+SOURCE_FILES = {
+    'random_forest': 'behavioral_rf_model.joblib',
+    'svm': 'behavioral_svm_model.joblib',
+    'scaler': 'behavioral_scaler.joblib'
+}
+
+def parse_ages(spec):
+    """Parse an age list like '17-65' or '3,5,10-18' into sorted unique ages"""
+    ages = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            low, high = (float(v) for v in part.split('-', 1))
+            ages.update(float(a) for a in np.arange(low, high + 1))
+        else:
+            ages.add(float(part))
+    if not ages:
+        raise ValueError(f"No ages in '{spec}'")
+    return sorted(ages)
+
+def score_codes(codes):
+    """A1-A10 values for base-3 codes, shape (len(codes), 10)"""
+    digits = (np.asarray(codes)[:, np.newaxis] // DIGIT_WEIGHTS) % 3
+    return digits / 2.0
+
+class BehavioralLookupTable:
+    """Memory-mapped RF/SVM probabilities for every questionnaire input"""
+
+    def __init__(self, probabilities, ages, sources=None):
+        # probabilities: (n_ages, 2, N_CODES, 2) float64, last axis [rf, svm]
+        self.probabilities = probabilities
+        self.ages = np.asarray(ages, dtype=np.float64)
+        self.sources = sources or {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, features):
+        """Find rows of an (n, 12) behavioral feature matrix in the table
+
+        Returns (hit, rf_probs, svm_probs) where hit is a boolean mask and the
+        probability arrays hold the values for the hit rows, in order.
+        """
+        features = np.asarray(features, dtype=np.float64)
+        digits = features[:, :N_QUESTIONS] * 2
+        gender = features[:, N_QUESTIONS + 1]
+        age_index = np.minimum(np.searchsorted(self.ages, features[:, N_QUESTIONS]), len(self.ages) - 1)
+
+        hit = (
+            np.isin(digits, (0, 1, 2)).all(axis=1)
+            & np.isin(gender, (0, 1))
+            & (self.ages[age_index] == features[:, N_QUESTIONS])
+        )
+        codes = digits[hit].astype(np.intp) @ DIGIT_WEIGHTS
+        values = self.probabilities[age_index[hit], gender[hit].astype(np.intp), codes]
+
+        n_hit = int(hit.sum())
+        self.hits += n_hit
+        self.misses += len(hit) - n_hit
+        return hit, values[:, 0], values[:, 1]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'ages': len(self.ages),
+            'age_range': [float(self.ages[0]), float(self.ages[-1])],
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0
+        }
+
+    @classmethod
+    def load(cls, model_dir):
+        """Memory-map the table in model_dir, or None if missing or stale"""
+        table_path = os.path.join(model_dir, TABLE_FILE)
+        meta_path = os.path.join(model_dir, META_FILE)
+        if not (os.path.exists(table_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('format_version') != TABLE_FORMAT_VERSION:
+            return None
+        for name, filename in SOURCE_FILES.items():
+            if meta['sources'].get(name) != file_fingerprint(os.path.join(model_dir, filename)):
+                return None
+
+        probabilities = np.load(table_path, mmap_mode='r')
+        if probabilities.shape != (len(meta['ages']), 2, N_CODES, 2):
+            return None
+        return cls(probabilities, meta['ages'], meta['sources'])
+
+def build_table(model_dir, ages):
+    """Score the whole questionnaire space for each age and write the table"""
+    import joblib
+
+    rf = joblib.load(os.path.join(model_dir, SOURCE_FILES['random_forest']))
+    svm = joblib.load(os.path.join(model_dir, SOURCE_FILES['svm']))
+    scaler = joblib.load(os.path.join(model_dir, SOURCE_FILES['scaler']))
+
+    table_path = os.path.join(model_dir, TABLE_FILE)
+    probabilities = np.lib.format.open_memmap(
+        table_path, mode='w+', dtype=np.float64, shape=(len(ages), 2, N_CODES, 2))
+
+    scores = score_codes(np.arange(N_CODES))
+    start = time.perf_counter()
+    for a, age in enumerate(ages):
+        for gender in (0, 1):
+            features = np.column_stack([scores, np.full(N_CODES, age), np.full(N_CODES, gender)])
+            # Same path as the live endpoint: scale, then both base models
+            features_scaled = scaler.transform(features)
+            probabilities[a, gender, :, 0] = rf.predict_proba(features_scaled)[:, 1]
+            probabilities[a, gender, :, 1] = svm.predict_proba(features_scaled)[:, 1]
+        elapsed = time.perf_counter() - start
+        print(f"age {age:g}: {a + 1}/{len(ages)} done, {(a + 1) * 2 * N_CODES / elapsed:,.0f} rows/s")
+    probabilities.flush()
+    del probabilities
+
+    meta = {
+        'format_version': TABLE_FORMAT_VERSION,
+        'ages': ages,
+        'sources': {name: file_fingerprint(os.path.join(model_dir, filename))
+                    for name, filename in SOURCE_FILES.items()}
+    }
+    with open(os.path.join(model_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"Wrote {table_path} ({len(ages)} ages, {os.path.getsize(table_path) / 2 ** 20:.0f} MB)")
+    return table_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the behavioral questionnaire lookup table")
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--model-dir', default=os.environ.get(
+        'MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models')))
+    parser.add_argument('--ages', default='17-65',
+                        help="ages to precompute, e.g. '17-65' or '3,5,10-18' (default: 17-65)")
+    args = parser.parse_args()
+
+    build_table(args.model_dir, parse_ages(args.ages))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
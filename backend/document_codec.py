@@ -0,0 +1,94 @@
+"""
+Compact stored form of stage results
+
+Instead of the request dict and the full response (explanation text,
+recommendation lists, per-feature analysis), a stored stage entry keeps the
+fused prediction, probability and confidence as plain fields, so reads can
+project just those, and everything else in one packed binary field:
+
+    header   format version, flags, explanation template, array lengths
+    float32  raw input features, in model feature order
+    float64  model probabilities and ensemble weights
+    JSON     explanation template parameters that cannot be derived
+
+Explanations are rebuilt on read from their template ID and parameters.
+The packed field can be compressed with zstd. zstandard is an optional
+dependency: without it entries are written uncompressed, and reading a
+compressed entry raises a ValueError naming the missing package.
+"""
+
+import json
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+# Bump when the packed layout changes
+PACKED_FORMAT_VERSION = 1
+
+# Explanation templates by ID; append only, the index is what gets stored
+EXPLANATION_TEMPLATES = ('behavioral-1', 'eye_tracking-1', 'facial_analysis-1')
+
+FLAG_ZSTD = 1
+# Every feature survived the float32 round trip unchanged
+FLAG_LOSSLESS = 2
+
+# version, flags, template, n_features, n_values, params bytes
+HEADER = struct.Struct('<BBBHHH')
+
+PackedEntry = namedtuple('PackedEntry', ['template', 'features', 'values', 'params', 'lossless'])
+
+def zstd_available():
+    try:
+        import zstandard  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def pack(template, features, values=(), params=None, compression=None):
+    """Pack one stage entry; compression is None or 'zstd'"""
+    features64 = np.asarray(features, dtype=np.float64)
+    features32 = features64.astype('<f4')
+    values = np.asarray(values, dtype='<f8')
+    params_json = json.dumps(params, separators=(',', ':')).encode() if params else b''
+
+    flags = FLAG_LOSSLESS if np.array_equal(features32.astype(np.float64), features64) else 0
+    payload = b''.join([
+        features32.tobytes(),
+        values.tobytes(),
+        params_json
+    ])
+    if compression == 'zstd':
+        import zstandard
+        compressed = zstandard.ZstdCompressor(level=3).compress(payload)
+        # Tiny entries can grow; keep whichever is smaller
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_ZSTD
+    elif compression:
+        raise ValueError(f"Unknown compression '{compression}', expected 'zstd'")
+
+    header = HEADER.pack(PACKED_FORMAT_VERSION, flags, EXPLANATION_TEMPLATES.index(template),
+                         len(features32), len(values), len(params_json))
+    return header + payload
+
+def unpack(blob):
+    """PackedEntry of a packed stage entry, features and values as float64 arrays"""
+    blob = bytes(blob)
+    version, flags, template, n_features, n_values, params_length = HEADER.unpack_from(blob)
+    if version != PACKED_FORMAT_VERSION:
+        raise ValueError(f"Unsupported packed entry version {version}")
+
+    payload = blob[HEADER.size:]
+    if flags & FLAG_ZSTD:
+        if not zstd_available():
+            raise ValueError("Packed entry is zstd-compressed but zstandard is not installed")
+        import zstandard
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+
+    features = np.frombuffer(payload, dtype='<f4', count=n_features).astype(np.float64)
+    offset = 4 * n_features
+    values = np.frombuffer(payload, dtype='<f8', count=n_values, offset=offset).astype(np.float64)
+    offset += 8 * n_values
+    params = json.loads(payload[offset:offset + params_length]) if params_length else {}
+    return PackedEntry(EXPLANATION_TEMPLATES[template], features, values, params, bool(flags & FLAG_LOSSLESS))
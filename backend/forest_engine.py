@@ -0,0 +1,255 @@
+"""
+Compact array-backed Random Forest inference engine
+
+Flattens every tree of a fitted sklearn RandomForestClassifier into a few
+contiguous NumPy arrays and walks all trees for a whole batch with vectorized
+indexing. Results are identical to RandomForestClassifier.predict_proba while
+loading from a plain .npz instead of unpickling 100+ estimator objects.
+
+Exports are generated, not committed: run the export after every retraining
+and as a deployment step. The server checks each export's source fingerprint
+and serves the joblib model when the export is missing or stale.
+
+Usage:
+    python forest_engine.py export [--model-dir models]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+# Bump when the .npz layout changes
+FOREST_FORMAT_VERSION = 1
+
+# Exported forest files live next to the joblib models
+FOREST_SUFFIX = '.forest.npz'
+
+# Rows traversed together; keeps the (rows, trees) index arrays cache-sized
+BLOCK_ROWS = 256
+
+def file_fingerprint(path):
+    """sha256 of a model file, used to detect a stale export"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def forest_path(model_path):
+    """Path of the exported forest for a joblib model path"""
+    return os.path.splitext(model_path)[0] + FOREST_SUFFIX
+
+class CompactForest:
+    """Random Forest flattened into contiguous arrays
+
+    All trees share one node table. feature (int16) and threshold (float32)
+    describe the split; children (int32, [left, right] per node) are global
+    node offsets. Leaves point to themselves with an infinite threshold, so
+    every sample can take max_depth steps without masking. Leaf class
+    probabilities are kept in float64 so the averaged output matches sklearn
+    bit for bit.
+    """
+
+    def __init__(self, feature, threshold, children, leaf_values, roots, max_depth,
+                 classes, feature_importances, n_features, source_fingerprint=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        # Flat [left0, right0, left1, right1, ...] view for the traversal
+        self._children_flat = children.ravel()
+        self.leaf_values = leaf_values
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.feature_importances_ = feature_importances
+        self.n_features_in_ = int(n_features)
+        self.source_fingerprint = source_fingerprint
+
+    @property
+    def n_estimators(self):
+        return len(self.roots)
+
+    @classmethod
+    def from_sklearn(cls, forest, source_fingerprint=None):
+        """Flatten a fitted RandomForestClassifier"""
+        if getattr(forest, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests are supported")
+
+        n_classes = len(forest.classes_)
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            node_ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            # sklearn casts X to float32 and tests x <= threshold (float64).
+            # Rounding the threshold down to the nearest float32 keeps that
+            # comparison exact for every float32 x.
+            threshold = tree.threshold.astype(np.float32)
+            too_high = threshold.astype(np.float64) > tree.threshold
+            threshold[too_high] = np.nextafter(threshold[too_high], np.float32(-np.inf))
+            threshold[is_leaf] = np.inf
+
+            feature = np.where(is_leaf, 0, tree.feature)
+            left = np.where(is_leaf, node_ids, tree.children_left) + offset
+            right = np.where(is_leaf, node_ids, tree.children_right) + offset
+
+            # Same normalization as DecisionTreeClassifier.predict_proba
+            value = tree.value[:, 0, :n_classes].astype(np.float64)
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+
+            features.append(feature)
+            thresholds.append(threshold)
+            children.append(np.column_stack([left, right]))
+            values.append(value / normalizer)
+            roots.append(offset)
+            offset += tree.node_count
+
+        n_features = forest.n_features_in_
+        if n_features > np.iinfo(np.int16).max:
+            raise ValueError(f"Too many features for int16 indices: {n_features}")
+
+        return cls(
+            feature=np.concatenate(features).astype(np.int16),
+            threshold=np.concatenate(thresholds).astype(np.float32),
+            children=np.concatenate(children).astype(np.int32),
+            leaf_values=np.concatenate(values),
+            roots=np.asarray(roots, dtype=np.int32),
+            max_depth=max(e.tree_.max_depth for e in forest.estimators_),
+            classes=np.asarray(forest.classes_),
+            feature_importances=np.asarray(forest.feature_importances_, dtype=np.float64),
+            n_features=n_features,
+            source_fingerprint=source_fingerprint
+        )
+
+    def apply(self, X):
+        """Global leaf index reached in every tree, shape (n_samples, n_estimators)"""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected input with {self.n_features_in_} features, got shape {X.shape}")
+
+        n_samples = X.shape[0]
+        values = X.ravel()
+        row_offsets = (np.arange(n_samples, dtype=np.intp) * self.n_features_in_)[:, np.newaxis]
+        nodes = np.repeat(self.roots.astype(np.intp)[np.newaxis, :], n_samples, axis=0)
+        for _ in range(self.max_depth):
+            x = values.take(row_offsets + self.feature.take(nodes))
+            # Same test as sklearn: x <= threshold goes left
+            go_right = np.logical_not(x <= self.threshold.take(nodes))
+            nodes = self._children_flat.take(2 * nodes + go_right)
+        return nodes
+
+    def predict_proba(self, X):
+        """Class probabilities averaged over all trees"""
+        X = np.asarray(X)
+        if X.ndim == 2 and X.shape[0] > BLOCK_ROWS:
+            return np.concatenate([self._predict_proba_block(X[start:start + BLOCK_ROWS])
+                                   for start in range(0, X.shape[0], BLOCK_ROWS)])
+        return self._predict_proba_block(X)
+
+    def _predict_proba_block(self, X):
+        nodes = self.apply(X)
+        # Accumulate trees in order, as RandomForestClassifier does, so the
+        # float64 sums are identical. cumsum is cheaper for a few rows, a
+        # per-tree loop for large batches.
+        if nodes.shape[0] <= 16:
+            proba = np.cumsum(self.leaf_values[nodes], axis=1)[:, -1]
+        else:
+            nodes = np.asfortranarray(nodes)
+            proba = self.leaf_values.take(nodes[:, 0], axis=0)
+            for tree in range(1, nodes.shape[1]):
+                proba += self.leaf_values.take(nodes[:, tree], axis=0)
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def save(self, path):
+        np.savez(
+            path,
+            format_version=FOREST_FORMAT_VERSION,
+            feature=self.feature,
+            threshold=self.threshold,
+            children=self.children,
+            leaf_values=self.leaf_values,
+            roots=self.roots,
+            max_depth=self.max_depth,
+            classes=self.classes_,
+            feature_importances=self.feature_importances_,
+            n_features=self.n_features_in_,
+            source_fingerprint=self.source_fingerprint or ''
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format_version']) != FOREST_FORMAT_VERSION:
+                raise ValueError(f"Unsupported forest format version {int(data['format_version'])}")
+            return cls(
+                feature=data['feature'],
+                threshold=data['threshold'],
+                children=data['children'],
+                leaf_values=data['leaf_values'],
+                roots=data['roots'],
+                max_depth=int(data['max_depth']),
+                classes=data['classes'],
+                feature_importances=data['feature_importances'],
+                n_features=int(data['n_features']),
+                source_fingerprint=str(data['source_fingerprint']) or None
+            )
+
+def load_compact_forest(model_path):
+    """Load the exported forest for model_path, or None if missing or stale"""
+    path = forest_path(model_path)
+    if not os.path.exists(path):
+        return None
+    forest = CompactForest.load(path)
+    if forest.source_fingerprint != file_fingerprint(model_path):
+        return None
+    return forest
+
+def export_forest(model_path, check_rows=2000):
+    """Export one joblib RandomForest next to itself and verify parity"""
+    import joblib
+
+    rf = joblib.load(model_path)
+    forest = CompactForest.from_sklearn(rf, source_fingerprint=file_fingerprint(model_path))
+
+    # Parity check on random rows in the scaled feature space
+    X = np.random.RandomState(0).normal(scale=2.0, size=(check_rows, forest.n_features_in_))
+    if not np.array_equal(forest.predict_proba(X), rf.predict_proba(X)):
+        raise RuntimeError(f"Compact forest does not match sklearn for {model_path}")
+
+    path = forest_path(model_path)
+    forest.save(path)
+    print(f"Exported {model_path} -> {path} ({forest.n_estimators} trees, "
+          f"{len(forest.feature)} nodes, {os.path.getsize(path) / 1024:.0f} KB)")
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Export RandomForest models to the compact array format")
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--model-dir', default=os.environ.get(
+        'MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models')))
+    args = parser.parse_args()
+
+    failed = False
+    for name in ('behavioral_rf_model.joblib', 'eye_tracking_rf_model.joblib'):
+        model_path = os.path.join(args.model_dir, name)
+        if not os.path.exists(model_path):
+            continue
+        try:
+            export_forest(model_path)
+        except Exception as e:
+            print(f"Failed to export {model_path}: {e}")
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
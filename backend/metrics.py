@@ -0,0 +1,265 @@
+"""
+Prometheus metrics and per-request phase timings, without a client library
+
+Histograms are kept in process and rendered in the Prometheus text
+exposition format (version 0.0.4) by the server's /metrics endpoint.
+
+Code on the request path marks its phases with `with phase('rf_predict'):`.
+Timings go to the RequestTrace of the current request, set by TimedRoute;
+outside a request phase() does nothing. Work handed to a thread or process
+pool runs under collect_phases(), which returns the phases recorded inside
+it so the caller can add them to its own request with add_phases().
+
+Endpoints marked with @traced can also report their own request's phases:
+a traced request gets a trace ID (the client's X-Trace-Id, or a new one)
+and its phase timings in a Server-Timing response header.
+"""
+
+import asyncio
+import contextvars
+import functools
+import math
+import re
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from starlette.exceptions import HTTPException
+
+# Starlette appends the charset
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# Seconds; covers sub-millisecond phases up to slow uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Endpoints under this prefix are labelled with the stage that follows it
+STAGE_PATH_PREFIX = '/api/assessment/'
+
+TRACE_ID_HEADER = 'X-Trace-Id'
+TRACE_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}\Z')
+
+# 'off', 'header' (only requests that send X-Trace-Id) or 'all'
+TRACING_MODES = ('off', 'header', 'all')
+_tracing = 'header'
+
+def set_tracing(mode):
+    global _tracing
+    if mode not in TRACING_MODES:
+        raise ValueError(f"Unknown request tracing mode '{mode}', expected one of {TRACING_MODES}")
+    _tracing = mode
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render_metric(name, kind, documentation, samples):
+    """Text exposition lines of a counter or gauge; samples are (labels dict, value) pairs"""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in samples:
+        lines.append(f'{name}{format_labels(list(labels.items()))} {format_value(value)}')
+    return lines
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values (event loop only)"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._series = {}
+
+    def observe(self, value, *labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labelvalues, (counts, total, count) in sorted(self._series.items()):
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{format_labels(labels + [("le", format_value(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {count}')
+        return lines
+
+class RequestTrace:
+    """Phase timings of one request (or of one collect_phases() call)"""
+
+    def __init__(self, trace_id=None):
+        self.started = time.perf_counter()
+        self.endpoint_finished = None
+        self.phases = {}
+        self.trace_id = trace_id
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+_current_trace = contextvars.ContextVar('request_trace', default=None)
+
+@contextmanager
+def phase(name):
+    """Add the time spent in the block to the current request's phase"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start)
+
+def add_phases(phases):
+    """Add phase timings measured elsewhere (a worker, a shared batch) to the current request"""
+    trace = _current_trace.get()
+    if trace is not None:
+        for name, seconds in phases.items():
+            trace.add(name, seconds)
+
+def current_trace_id():
+    """Trace ID of the current request, or None if it is not traced"""
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+def collect_phases(func, *args):
+    """Run func(*args) and return (result, {phase: seconds} recorded inside it)
+
+    Module-level so process pools can pickle it.
+    """
+    trace = RequestTrace()
+    token = _current_trace.set(trace)
+    try:
+        result = func(*args)
+    finally:
+        _current_trace.reset(token)
+    return result, trace.phases
+
+request_duration = Histogram(
+    'asd_request_duration_seconds', 'Request latency until the response is fully sent',
+    ['endpoint', 'stage', 'method', 'status'])
+request_phase_duration = Histogram(
+    'asd_request_phase_duration_seconds', 'Time spent in each phase of a request',
+    ['endpoint', 'stage', 'phase'])
+
+# endpoint -> requests being handled
+requests_in_flight = {}
+
+def traced(endpoint):
+    """Mark an endpoint for per-request tracing (Server-Timing and X-Trace-Id headers)"""
+    endpoint.traced = True
+    return endpoint
+
+def request_trace_id(scope):
+    """The client's trace ID, a new one, or None if the request is not traced"""
+    if _tracing == 'off':
+        return None
+    for name, value in scope['headers']:
+        if name == TRACE_ID_HEADER.lower().encode():
+            value = value.decode('latin-1')
+            # Invalid IDs are replaced rather than echoed into headers and documents
+            return value if TRACE_ID_PATTERN.match(value) else uuid.uuid4().hex
+    return uuid.uuid4().hex if _tracing == 'all' else None
+
+def trace_headers(trace):
+    """Response headers of a traced request, durations in milliseconds"""
+    timings = [f'{name};dur={1000 * seconds:.3f}' for name, seconds in trace.phases.items()]
+    timings.append(f'total;dur={1000 * (time.perf_counter() - trace.started):.3f}')
+    return {
+        TRACE_ID_HEADER: trace.trace_id,
+        'Server-Timing': ', '.join(timings),
+        # Lets browsers expose the timings to cross-origin pages
+        'Timing-Allow-Origin': '*'
+    }
+
+def _mark_endpoint(endpoint):
+    """Wrap an async endpoint to split request validation and serialization from its body"""
+    @functools.wraps(endpoint)
+    async def timed_endpoint(*args, **kwargs):
+        trace = _current_trace.get()
+        if trace is not None:
+            # Body parsing and model validation run before the endpoint is called
+            trace.add('validation', time.perf_counter() - trace.started)
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            if trace is not None:
+                trace.endpoint_finished = time.perf_counter()
+    return timed_endpoint
+
+class TimedRoute(APIRoute):
+    """APIRoute recording latency and phase histograms for every request
+
+    Install with app.router.route_class = TimedRoute before declaring routes.
+    'serialization' is the time from the endpoint returning to the response
+    headers going out (response model encoding and JSON rendering). Traced
+    endpoints also get the trace headers; phases still running when the
+    headers go out (a streamed body) are not in Server-Timing.
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            endpoint = _mark_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+        self.traced = getattr(endpoint, 'traced', False)
+        self.stage = path[len(STAGE_PATH_PREFIX):].split('/')[0] if path.startswith(STAGE_PATH_PREFIX) else ''
+        self._untimed_app = self.app
+        self.app = self._timed_app
+
+    async def _timed_app(self, scope, receive, send):
+        trace = RequestTrace(request_trace_id(scope) if self.traced else None)
+        token = _current_trace.set(trace)
+        status = 500
+        requests_in_flight[self.path] = requests_in_flight.get(self.path, 0) + 1
+
+        async def timed_send(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if trace.endpoint_finished is not None:
+                    trace.add('serialization', time.perf_counter() - trace.endpoint_finished)
+                if trace.trace_id is not None:
+                    headers = [(name.lower().encode(), value.encode('latin-1'))
+                               for name, value in trace_headers(trace).items()]
+                    message = {**message, 'headers': list(message.get('headers', [])) + headers}
+            await send(message)
+
+        try:
+            await self._untimed_app(scope, receive, timed_send)
+        except HTTPException as e:
+            status = e.status_code
+            if trace.trace_id is not None:
+                # The error response is rendered by the exception handler, outside this route
+                e.headers = {**(e.headers or {}), **trace_headers(trace)}
+            raise
+        except RequestValidationError:
+            status = 422
+            raise
+        finally:
+            _current_trace.reset(token)
+            requests_in_flight[self.path] -= 1
+            request_duration.observe(time.perf_counter() - trace.started,
+                                     self.path, self.stage, scope['method'], str(status))
+            for name, seconds in trace.phases.items():
+                request_phase_duration.observe(seconds, self.path, self.stage, name)
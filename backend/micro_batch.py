@@ -0,0 +1,95 @@
+"""
+Micro-batching of concurrent single-row model requests
+
+Used by server.py for the behavioral and eye tracking endpoints, so rows
+that arrive together are scored with one vectorized model call.
+"""
+
+import asyncio
+
+import numpy as np
+
+import metrics
+
+class MicroBatcher:
+    """Coalesces concurrent single-row requests into one vectorized model call
+    
+    Rows that arrive within window_ms of each other (or until max_batch_size
+    is reached) are stacked and scored with one batch_func call on the
+    executor (anything with an async run_with_phases(func, *args)); each
+    caller gets back its own row's result. When no batch is in flight the
+    first row is dispatched immediately, so an idle server adds no latency.
+    """
+    
+    def __init__(self, batch_func, executor, max_batch_size=32, window_ms=2.0):
+        self.batch_func = batch_func
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window_ms / 1000
+        self._pending = []
+        self._timer = None
+        self._in_flight = 0
+        self.batches = 0
+        self.rows = 0
+        self.max_observed_batch = 0
+        # Batch size distribution, keyed by power-of-two upper bound
+        self.batch_size_histogram = {}
+    
+    async def submit(self, row):
+        """Queue one feature row and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        if len(self._pending) >= self.max_batch_size or self._in_flight == 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        result, phases = await future
+        # Every row in a batch waited for the whole batch's phases
+        metrics.add_phases(phases)
+        return result
+    
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        self._in_flight += 1
+        asyncio.get_running_loop().create_task(self._run(batch))
+    
+    async def _run(self, batch):
+        size = len(batch)
+        self.batches += 1
+        self.rows += size
+        self.max_observed_batch = max(self.max_observed_batch, size)
+        bucket = 1 << (size - 1).bit_length()
+        self.batch_size_histogram[bucket] = self.batch_size_histogram.get(bucket, 0) + 1
+        try:
+            results, phases = await self.executor.run_with_phases(
+                self.batch_func, np.vstack([row for row, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result((result, phases))
+        finally:
+            self._in_flight -= 1
+            # Rows that queued up behind this batch go out now
+            if self._pending and self._timer is None:
+                self._flush()
+    
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'window_ms': self.window * 1000,
+            'batches': self.batches,
+            'rows': self.rows,
+            'avg_batch_size': self.rows / self.batches if self.batches else 0.0,
+            'max_observed_batch': self.max_observed_batch,
+            'batch_size_histogram': {f'<={k}': v for k, v in sorted(self.batch_size_histogram.items())}
+        }
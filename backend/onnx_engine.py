@@ -0,0 +1,165 @@
+"""
+ONNX export and onnxruntime inference for the scaler + model pipelines
+
+Each RandomForest and SVM in models/ is exported together with its stage's
+StandardScaler as one ONNX graph taking raw float64 features, next to the
+joblib file (behavioral_rf_model.joblib -> behavioral_rf_model.onnx). The
+server can then run the graphs with onnxruntime on CPU instead of sklearn.
+
+Requires onnxruntime; exporting also requires skl2onnx. Both are optional
+dependencies: without onnxruntime the server logs a warning and keeps sklearn.
+
+Usage:
+    python onnx_engine.py export [--model-dir models]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+from forest_engine import file_fingerprint
+
+ONNX_SUFFIX = '.onnx'
+
+# Largest allowed probability difference from sklearn when exporting
+EXPORT_TOLERANCE = 1e-5
+
+def onnxruntime_available():
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def onnx_path(model_path):
+    """Path of the exported pipeline for a joblib model path"""
+    return os.path.splitext(model_path)[0] + ONNX_SUFFIX
+
+def parity_rows(scaler, n_rows):
+    """Raw-feature rows for parity checks
+
+    Random rows around the training distribution, plus the same rows rounded
+    to multiples of 0.5: questionnaire answers and integer features land
+    exactly on the grid, where float32/float64 split differences show up.
+    """
+    X = scaler.inverse_transform(np.random.RandomState(0).normal(scale=2.0, size=(n_rows, scaler.n_features_in_)))
+    return np.vstack([X, np.round(X * 2) / 2])
+
+def pipeline_fingerprint(model_path, scaler_path):
+    """Identifies the model + scaler pair an export was made from"""
+    digest = hashlib.sha256()
+    for path in (model_path, scaler_path):
+        digest.update(file_fingerprint(path).encode())
+    return digest.hexdigest()
+
+class OnnxModel:
+    """onnxruntime session for an exported scaler + classifier pipeline"""
+
+    def __init__(self, path, intra_op_threads=1):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.n_features_in_ = self.session.get_inputs()[0].shape[1]
+        self.source_fingerprint = self.session.get_modelmeta().custom_metadata_map.get('source_fingerprint')
+
+    def predict_proba(self, X):
+        """Class probabilities for unscaled features"""
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        return self.session.run(['probabilities'], {self.input_name: X})[0]
+
+def load_onnx_model(model_path, scaler_path, intra_op_threads=1):
+    """Load the exported pipeline for model_path, or None if missing or stale"""
+    path = onnx_path(model_path)
+    if not os.path.exists(path):
+        return None
+    model = OnnxModel(path, intra_op_threads)
+    if model.source_fingerprint != pipeline_fingerprint(model_path, scaler_path):
+        return None
+    return model
+
+def export_pipeline(model_path, scaler_path, check_rows=2000):
+    """Export scaler + model as one ONNX graph next to the model and verify parity"""
+    import joblib
+    from sklearn.pipeline import Pipeline
+    from skl2onnx import convert_sklearn
+    from skl2onnx.common.data_types import DoubleTensorType
+    from skl2onnx.sklapi import CastTransformer
+
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path)
+    n_features = scaler.n_features_in_
+
+    steps = [('scaler', scaler)]
+    if hasattr(model, 'estimators_'):
+        # sklearn trees round the scaled features to float32 and compare them
+        # with float64 thresholds; do the same round trip inside the graph
+        steps += [('to_float32', CastTransformer(dtype=np.float32)),
+                  ('to_float64', CastTransformer(dtype=np.float64))]
+    steps.append(('model', model))
+    pipeline = Pipeline(steps)
+    for _, step in steps[1:-1]:
+        step.fit(np.zeros((1, n_features)))
+
+    onnx_model = convert_sklearn(
+        pipeline,
+        initial_types=[('input', DoubleTensorType([None, n_features]))],
+        options={id(model): {'zipmap': False}},
+        target_opset={'': 17, 'ai.onnx.ml': 3}
+    )
+    entry = onnx_model.metadata_props.add()
+    entry.key = 'source_fingerprint'
+    entry.value = pipeline_fingerprint(model_path, scaler_path)
+
+    path = onnx_path(model_path)
+    with open(path, 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+
+    # Parity check against the joblib pipeline
+    X = parity_rows(scaler, check_rows)
+    try:
+        error = np.max(np.abs(OnnxModel(path).predict_proba(X) - model.predict_proba(scaler.transform(X))))
+        if error > EXPORT_TOLERANCE:
+            raise RuntimeError(f"ONNX export differs from sklearn by {error:.2e} for {model_path}")
+    except Exception:
+        os.remove(path)
+        raise
+
+    print(f"Exported {model_path} -> {path} (max |diff| {error:.1e}, {os.path.getsize(path) / 1024:.0f} KB)")
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the scaler + RF/SVM pipelines to ONNX")
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--model-dir', default=os.environ.get(
+        'MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models')))
+    args = parser.parse_args()
+
+    try:
+        import skl2onnx  # noqa: F401
+        import onnxruntime  # noqa: F401
+    except ImportError as e:
+        print(f"Exporting needs skl2onnx and onnxruntime (pip install -r requirements-optional.txt): {e}")
+        return 1
+
+    failed = False
+    for stage in ('behavioral', 'eye_tracking'):
+        scaler_path = os.path.join(args.model_dir, f'{stage}_scaler.joblib')
+        for name in ('rf_model', 'svm_model'):
+            model_path = os.path.join(args.model_dir, f'{stage}_{name}.joblib')
+            if not (os.path.exists(model_path) and os.path.exists(scaler_path)):
+                continue
+            try:
+                export_pipeline(model_path, scaler_path)
+            except Exception as e:
+                print(f"Failed to export {model_path}: {e}")
+                failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Content-addressed cache of assessment responses
+
+Used by server.py for the single-record endpoints: identical requests to the
+same model version are answered from memory, and concurrent identical
+requests share one computation.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from scoring import json_encoder
+
+class ResponseCache:
+    """Content-addressed LRU cache of full assessment responses
+    
+    Keys are sha256 digests of the canonical JSON of the stage, the validated
+    request and the active model version. Values are kept serialized, so the
+    byte budget is exact and every caller gets its own copy. Concurrent
+    misses for the same key share one computation.
+    """
+    
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes  # 0 disables the cache
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> task of the computation in progress (event loop only)
+        self._in_flight = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.warmed = 0
+    
+    @staticmethod
+    def make_key(stage, data, model_version):
+        canonical = json.dumps({'stage': stage, 'data': data, 'model_version': model_version},
+                               sort_keys=True, separators=(',', ':'), default=json_encoder)
+        return hashlib.sha256(canonical.encode()).hexdigest()
+    
+    def get(self, key):
+        with self._lock:
+            blob = self._entries.get(key)
+            if blob is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return json.loads(blob)
+    
+    def put(self, key, value):
+        """Store a response and return its serialized form"""
+        blob = json.dumps(value, default=json_encoder).encode()
+        if len(blob) > self.max_bytes:
+            return blob
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= len(previous)
+            self._entries[key] = blob
+            self.bytes += len(blob)
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+        return blob
+    
+    async def get_or_compute(self, key, compute):
+        """Return the cached response for key, or await compute() once for all callers
+        
+        The computation runs as its own task, so a cancelled caller (the one
+        that started it included) stops waiting without cancelling it for
+        the others.
+        """
+        if not self.max_bytes:
+            return await compute()
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            _, blob = await asyncio.shield(task)
+            return json.loads(blob)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        
+        task = asyncio.ensure_future(self._compute(key, compute))
+        # Mark a failure retrieved in case every caller was cancelled
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._in_flight[key] = task
+        value, _ = await asyncio.shield(task)
+        return value
+    
+    async def _compute(self, key, compute):
+        try:
+            value = await compute()
+            return value, self.put(key, value)
+        finally:
+            del self._in_flight[key]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._in_flight),
+                'evictions': self.evictions,
+                'warmed': self.warmed
+            }
@@ -0,0 +1,1071 @@
+"""
+Model loading and scoring, shared by server.py and batch_score.py
+
+Holds the loaded models in module globals (filled by load_model_artifacts),
+the batch scoring functions of each stage and the upload row helpers.
+Importing it only reads configuration from the environment: no database
+connection, write-ahead log or event loop state, so offline tools and
+inference pool workers can load and score without the server's storage.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from bson import ObjectId
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.svm import SVC
+
+import metrics
+from metrics import phase
+from forest_engine import load_compact_forest, file_fingerprint
+from svm_engine import build_fused_svm
+from behavioral_table import BehavioralLookupTable
+from onnx_engine import load_onnx_model, onnxruntime_available, parity_rows
+
+logger = logging.getLogger(__name__)
+
+def json_encoder(obj):
+    """Custom JSON encoder for MongoDB ObjectId and datetime objects"""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+# --- LOCAL_MODELS_PATH_PATCH START ---
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join(BASE_DIR, 'models'))
+# Wrap joblib.load so '/app/models/xxx' -> local MODEL_DIR/xxx when running locally
+_original_joblib_load = joblib.load
+def _joblib_load_wrapper(path, *args, **kwargs):
+    if isinstance(path, str) and path.startswith('/app/models/'):
+        path = os.path.join(MODEL_DIR, path.replace('/app/models/', ''))
+    return _original_joblib_load(path, *args, **kwargs)
+joblib.load = _joblib_load_wrapper
+# --- LOCAL_MODELS_PATH_PATCH END ---
+
+# Global variables for models
+models = {}
+scalers = {}
+encoders = {}
+ensemble_weights = {}
+fused_svms = {}
+onnx_models = {}
+behavioral_table = None
+model_versions = {}
+model_metadata = {}
+# Seconds spent loading each group of artifacts, exported by /metrics
+model_load_seconds = {}
+
+# Facial analysis is rule-based; bump when its scoring changes
+FACIAL_MODEL_VERSION = 'heuristic-1'
+
+# Layout version of the *_ensemble_weights.joblib artifacts written by simple_training.py
+ENSEMBLE_WEIGHTS_VERSION = 2
+
+# Base models in the order their probabilities reach ensemble_predict, with
+# the model file each one is served from
+ENSEMBLE_BASE_MODELS = ('random_forest', 'svm')
+ENSEMBLE_SOURCE_FILES = {'random_forest': 'rf_model', 'svm': 'svm_model', 'scaler': 'scaler'}
+
+# 'compact' serves RandomForests from their forest_engine.py export when one
+# is up to date, 'sklearn' always unpickles the full estimator
+RF_ENGINE = os.environ.get('RF_ENGINE', 'compact')
+
+# 'fused' folds each stage's scaler into its RBF SVM (svm_engine.py) after a
+# parity check at load time, 'sklearn' keeps scaler.transform + SVC.predict_proba
+SVM_ENGINE = os.environ.get('SVM_ENGINE', 'fused')
+
+# 'table' answers behavioral rows from the behavioral_table.py lookup table
+# when it is up to date and covers the age, 'live' always runs the models
+BEHAVIORAL_LOOKUP = os.environ.get('BEHAVIORAL_LOOKUP', 'table')
+
+# 'onnx' runs the scaler + RF/SVM pipelines exported by onnx_engine.py with
+# onnxruntime, per model, when they pass a parity check against the joblib
+# models at startup; anything else (or a failed check) keeps sklearn
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'sklearn')
+ONNX_INTRA_OP_THREADS = int(os.environ.get('ONNX_INTRA_OP_THREADS', 1))
+ONNX_PARITY_TOLERANCE = float(os.environ.get('ONNX_PARITY_TOLERANCE', 1e-5))
+
+# Per-process dataset for PSO.optimize_features pool workers
+_feature_worker_data = {}
+
+def _init_feature_worker(X, y, model_type):
+    """Process pool initializer: ship the dataset to each worker once"""
+    _feature_worker_data.update(X=X, y=y, model_type=model_type)
+
+def _evaluate_feature_mask(mask):
+    """Score one feature mask inside a pool worker"""
+    X = _feature_worker_data['X']
+    return PSO()._evaluate_features(X[:, mask], _feature_worker_data['y'], _feature_worker_data['model_type'])
+
+class PSO:
+    """Particle Swarm Optimization for feature selection and model optimization"""
+    
+    def __init__(self, n_particles=20, n_iterations=50, w=0.5, c1=1.5, c2=1.5,
+                 patience=None, min_diversity=None, time_budget=None, tol=1e-9):
+        self.n_particles = n_particles
+        self.n_iterations = n_iterations
+        self.w = w  # inertia weight
+        self.c1 = c1  # cognitive parameter
+        self.c2 = c2  # social parameter
+        # Early stopping (all disabled by default)
+        self.patience = patience  # iterations without global best improvement
+        self.min_diversity = min_diversity  # mean particle distance to swarm centroid
+        self.time_budget = time_budget  # wall-clock seconds, returns best-so-far
+        self.tol = tol  # minimum gain that counts as an improvement
+        # Filled in by the last optimize_* run
+        self.iterations_run = 0
+        self.stop_reason = None
+        
+    def _swarm_diversity(self, particles):
+        """Mean Euclidean distance of the particles to the swarm centroid"""
+        return float(np.mean(np.linalg.norm(particles - particles.mean(axis=0), axis=1)))
+    
+    def _stop_reason(self, stalled_iterations, particles, deadline):
+        """Return why the swarm should stop early, or None to keep going"""
+        if self.patience is not None and stalled_iterations >= self.patience:
+            return 'stalled'
+        if self.min_diversity is not None and self._swarm_diversity(particles) < self.min_diversity:
+            return 'converged'
+        if deadline is not None and time.monotonic() >= deadline:
+            return 'deadline'
+        return None
+    
+    def optimize_features(self, X, y, model_type='rf', n_jobs=-1):
+        """Optimize feature selection using PSO
+        
+        Fitness for the whole swarm is evaluated once per iteration, on a
+        process pool when n_jobs != 1. Scores are memoized by feature bitmask
+        so a subset that particles revisit is never refit.
+        """
+        n_features = X.shape[1]
+        
+        # Initialize particles (binary encoding for feature selection)
+        particles = np.random.randint(0, 2, (self.n_particles, n_features))
+        velocities = np.random.uniform(-1, 1, (self.n_particles, n_features))
+        
+        # Track best positions
+        personal_best = particles.copy()
+        personal_best_scores = np.full(self.n_particles, -np.inf)
+        global_best = particles[0].copy()
+        global_best_score = -np.inf
+        
+        deadline = time.monotonic() + self.time_budget if self.time_budget else None
+        stalled_iterations = 0
+        self.iterations_run = 0
+        self.stop_reason = 'max_iterations'
+        
+        # Fitness memo keyed by packed feature bitmask
+        fitness_cache = {}
+        self.feature_cache_stats = {'evaluations': 0, 'cache_hits': 0}
+        
+        if n_jobs is None or n_jobs < 0:
+            n_jobs = os.cpu_count() or 1
+        pool = None
+        if n_jobs > 1:
+            pool = ProcessPoolExecutor(
+                max_workers=min(n_jobs, self.n_particles),
+                initializer=_init_feature_worker,
+                initargs=(X, y, model_type)
+            )
+        
+        try:
+            for iteration in range(self.n_iterations):
+                # Selected features per particle; at least one feature must be selected
+                masks = particles == 1
+                masks[~masks.any(axis=1), 0] = True
+                keys = [np.packbits(mask).tobytes() for mask in masks]
+                
+                # Evaluate each distinct, not yet seen subset exactly once
+                pending = {}
+                for key, mask in zip(keys, masks):
+                    if key not in fitness_cache and key not in pending:
+                        pending[key] = mask
+                self.feature_cache_stats['cache_hits'] += len(keys) - len(pending)
+                self.feature_cache_stats['evaluations'] += len(pending)
+                
+                if pool is not None and len(pending) > 1:
+                    scores = pool.map(_evaluate_feature_mask, pending.values())
+                else:
+                    scores = (self._evaluate_features(X[:, mask], y, model_type) for mask in pending.values())
+                fitness_cache.update(zip(pending.keys(), scores))
+                
+                scores = np.array([fitness_cache[key] for key in keys], dtype=float)
+                
+                # Update personal best
+                improved = scores > personal_best_scores
+                personal_best_scores[improved] = scores[improved]
+                personal_best[improved] = particles[improved]
+                
+                # Update global best
+                previous_best_score = global_best_score
+                best_idx = int(np.argmax(scores))
+                if scores[best_idx] > global_best_score:
+                    global_best_score = scores[best_idx]
+                    global_best = particles[best_idx].copy()
+                stalled_iterations = 0 if global_best_score > previous_best_score + self.tol else stalled_iterations + 1
+                self.iterations_run = iteration + 1
+                
+                # Update velocities and positions for the whole swarm. Random
+                # draws keep the per-particle r1, r2, position order of the
+                # original loop.
+                r = np.random.random((self.n_particles, 3, n_features))
+                r1, r2, r_pos = r[:, 0], r[:, 1], r[:, 2]
+                
+                velocities = (self.w * velocities +
+                              self.c1 * r1 * (personal_best - particles) +
+                              self.c2 * r2 * (global_best - particles))
+                
+                # Update positions using sigmoid function for binary encoding
+                sigmoid_v = 1 / (1 + np.exp(-velocities))
+                particles = (r_pos < sigmoid_v).astype(int)
+                
+                reason = self._stop_reason(stalled_iterations, particles, deadline)
+                if reason is not None:
+                    self.stop_reason = reason
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        
+        return global_best, global_best_score
+    
+    def _evaluate_features(self, X, y, model_type):
+        """Evaluate feature subset using cross-validation"""
+        if X.shape[1] == 0:
+            return 0
+            
+        try:
+            if model_type == 'rf':
+                model = RandomForestClassifier(n_estimators=10, random_state=42)
+            else:
+                model = SVC(random_state=42)
+            
+            # Simple train-test split for speed
+            split_idx = int(0.8 * len(X))
+            X_train, X_test = X[:split_idx], X[split_idx:]
+            y_train, y_test = y[:split_idx], y[split_idx:]
+            
+            if len(np.unique(y_train)) < 2:  # Not enough classes
+                return 0
+                
+            model.fit(X_train, y_train)
+            score = model.score(X_test, y_test)
+            return score
+        except:
+            return 0
+
+    def optimize_prediction(self, predictions, weights=None):
+        """Optimize final prediction using PSO ensemble weighting"""
+        if weights is None:
+            weights = np.random.random(len(predictions))
+            weights = weights / np.sum(weights)
+        
+        # Use PSO to find optimal weights for ensemble.
+        # The whole swarm is held as (n_particles, n_models) arrays so each
+        # iteration is a handful of NumPy operations instead of a Python loop.
+        predictions = np.asarray(predictions, dtype=float)
+        n_models = len(predictions)
+        particles = np.random.random((self.n_particles, n_models))
+        # Normalize weights
+        particles = particles / particles.sum(axis=1, keepdims=True)
+        
+        velocities = np.random.uniform(-0.1, 0.1, (self.n_particles, n_models))
+        
+        personal_best = particles.copy()
+        personal_best_scores = np.full(self.n_particles, -np.inf)
+        global_best = particles[0].copy()
+        global_best_score = -np.inf
+        
+        deadline = time.monotonic() + self.time_budget if self.time_budget else None
+        stalled_iterations = 0
+        self.iterations_run = 0
+        self.stop_reason = 'max_iterations'
+        
+        for iteration in range(min(self.n_iterations, 20)):  # Fewer iterations for speed
+            # Fitness of every particle at once
+            scores = self._swarm_fitness(predictions, particles)
+            
+            improved = scores > personal_best_scores
+            personal_best_scores[improved] = scores[improved]
+            personal_best[improved] = particles[improved]
+            
+            previous_best_score = global_best_score
+            best_idx = int(np.argmax(scores))
+            if scores[best_idx] > global_best_score:
+                global_best_score = scores[best_idx]
+                global_best = particles[best_idx].copy()
+            stalled_iterations = 0 if global_best_score > previous_best_score + self.tol else stalled_iterations + 1
+            self.iterations_run = iteration + 1
+            
+            # Draw r1/r2 per particle in the same order as the scalar loop
+            # did, so results under a fixed seed are unchanged
+            r = np.random.random((self.n_particles, 2, n_models))
+            r1, r2 = r[:, 0], r[:, 1]
+            
+            velocities = (self.w * velocities +
+                          self.c1 * r1 * (personal_best - particles) +
+                          self.c2 * r2 * (global_best - particles))
+            
+            particles = particles + velocities
+            # Normalize weights
+            particles = np.abs(particles)
+            particles = particles / particles.sum(axis=1, keepdims=True)
+            
+            reason = self._stop_reason(stalled_iterations, particles, deadline)
+            if reason is not None:
+                self.stop_reason = reason
+                break
+        
+        return global_best, global_best_score
+    
+    def _ensemble_fitness(self, predictions, weights, ensemble_pred):
+        """Calculate fitness for ensemble weights"""
+        # Combine accuracy proxy with diversity
+        diversity = np.std([pred * weight for pred, weight in zip(predictions, weights)])
+        confidence = abs(ensemble_pred - 0.5)  # Distance from uncertainty
+        return confidence + 0.1 * diversity
+    
+    def _swarm_fitness(self, predictions, particles):
+        """Vectorized _ensemble_fitness for a (n_particles, n_models) swarm"""
+        weighted = particles * predictions
+        ensemble_preds = weighted.sum(axis=1) / particles.sum(axis=1)
+        diversity = np.std(weighted, axis=1)
+        confidence = np.abs(ensemble_preds - 0.5)
+        return confidence + 0.1 * diversity
+
+class PSOResultCache:
+    """Bounded LRU/TTL cache for PSO.optimize_prediction results
+    
+    Keyed on the base probabilities quantized to `precision` decimals, so
+    repeated and near-identical inputs reuse the weights of an earlier swarm.
+    """
+    
+    def __init__(self, max_size=4096, ttl=3600, precision=3):
+        self.max_size = max_size
+        self.ttl = ttl  # seconds, 0 disables expiry
+        self.precision = precision
+        self._entries = OrderedDict()
+        # Handlers may run on worker threads, so guard the OrderedDict
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def make_key(self, stage, predictions):
+        return (stage,) + tuple(round(float(p), self.precision) for p in predictions)
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            weights, score, created = entry
+            if self.ttl and time.monotonic() - created > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return weights.copy(), score
+    
+    def put(self, key, weights, score):
+        with self._lock:
+            self._entries[key] = (weights.copy(), score, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def add_counter(self, name, delta):
+        """Count lookups made against a worker process's copy of the cache"""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + delta)
+    
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl,
+                'precision': self.precision,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+# Early stopping for the request-path PSO
+PSO_PATIENCE = int(os.environ.get('PSO_PATIENCE', 5))
+PSO_MIN_DIVERSITY = float(os.environ.get('PSO_MIN_DIVERSITY', 1e-3))
+PSO_TIME_BUDGET_MS = float(os.environ.get('PSO_TIME_BUDGET_MS', 50))
+
+pso_cache = PSOResultCache(
+    max_size=int(os.environ.get('PSO_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('PSO_CACHE_TTL', 3600)),
+    precision=int(os.environ.get('PSO_CACHE_PRECISION', 3))
+)
+
+def ensemble_predict(stage, base_predictions):
+    """Combine base model probabilities into the ensemble probability
+    
+    Uses the offline-calibrated weights for the stage when they were loaded,
+    which is a constant-time weighted average. Otherwise runs the PSO search,
+    memoized in pso_cache. Returns (weights, probability, score, info) where
+    info describes how the weights were obtained.
+    """
+    artifact = ensemble_weights.get(stage)
+    if artifact is not None:
+        weights = np.asarray(artifact['weights'], dtype=float)
+        # Same fitness the PSO would report for these weights
+        score = PSO()._swarm_fitness(np.asarray(base_predictions, dtype=float), weights[np.newaxis, :])[0]
+        info = {'method': 'calibrated'}
+    else:
+        cache_key = pso_cache.make_key(stage, base_predictions)
+        cached = pso_cache.get(cache_key)
+        if cached is not None:
+            weights, _ = cached
+            score = PSO()._swarm_fitness(np.asarray(base_predictions, dtype=float), weights[np.newaxis, :])[0]
+            info = {'method': 'pso_cached'}
+        else:
+            pso = PSO(
+                n_particles=15, n_iterations=30,
+                patience=PSO_PATIENCE or None,
+                min_diversity=PSO_MIN_DIVERSITY or None,
+                time_budget=PSO_TIME_BUDGET_MS / 1000 if PSO_TIME_BUDGET_MS else None
+            )
+            weights, score = pso.optimize_prediction(base_predictions)
+            pso_cache.put(cache_key, weights, score)
+            info = {'method': 'pso', 'iterations': pso.iterations_run, 'stop_reason': pso.stop_reason}
+    
+    probability = np.average(base_predictions, weights=weights)
+    return weights, probability, score, info
+
+def cache_counters():
+    """Counters of the caches that scoring updates, as {(cache, counter): value}"""
+    counters = {('pso_cache', name): getattr(pso_cache, name) for name in ('hits', 'misses', 'evictions', 'expirations')}
+    if behavioral_table is not None:
+        counters.update({('behavioral_table', name): getattr(behavioral_table, name) for name in ('hits', 'misses')})
+    return counters
+
+def _score_in_worker(func, *args):
+    """Process pool entry point: (result, phases, cache counter deltas) of func(*args)
+    
+    Workers count hits and misses in their own copies of the caches; the
+    deltas go back with the result so /health and /metrics include them.
+    """
+    before = cache_counters()
+    result, phases = metrics.collect_phases(func, *args)
+    deltas = {key: value - before.get(key, 0) for key, value in cache_counters().items()}
+    return result, phases, deltas
+
+def add_cache_counters(deltas):
+    """Add a worker's cache counter deltas to this process's counters"""
+    for (cache_name, name), delta in deltas.items():
+        if cache_name == 'pso_cache':
+            pso_cache.add_counter(name, delta)
+        elif behavioral_table is not None:
+            setattr(behavioral_table, name, getattr(behavioral_table, name) + delta)
+
+def load_random_forest(path):
+    """Load a RandomForest model, preferring its compact array export"""
+    if RF_ENGINE == 'compact':
+        model_path = os.path.join(MODEL_DIR, path.replace('/app/models/', ''))
+        forest = load_compact_forest(model_path)
+        if forest is not None:
+            logger.info(f"Using compact forest engine for {os.path.basename(model_path)}")
+            return forest
+        logger.info(f"No up-to-date compact export for {os.path.basename(model_path)}, using sklearn")
+    return joblib.load(path)
+
+def load_fused_svm(stage):
+    """Build the fused scaler + SVM path for a stage, or drop back to sklearn"""
+    fused_svms.pop(stage, None)
+    if SVM_ENGINE != 'fused':
+        return
+    try:
+        fused_svms[stage] = build_fused_svm(scalers[stage], models[f'{stage}_svm'])
+        logger.info(f"Using fused SVM engine for {stage}")
+    except Exception as e:
+        logger.warning(f"Fused SVM unavailable for {stage}, using sklearn: {str(e)}")
+
+def svm_probabilities(stage, features, features_scaled):
+    """Positive-class SVM probabilities, from the fused path when available"""
+    fused = fused_svms.get(stage)
+    if fused is not None:
+        return fused.predict_proba(features)[:, 1]
+    return models[f'{stage}_svm'].predict_proba(features_scaled)[:, 1]
+
+def load_onnx_models(stage, check_rows=500):
+    """Serve a stage's RF and SVM from their ONNX exports where they match sklearn"""
+    for name in ('rf', 'svm'):
+        onnx_models.pop(f'{stage}_{name}', None)
+    if INFERENCE_BACKEND != 'onnx':
+        return
+    if not onnxruntime_available():
+        logger.warning(f"INFERENCE_BACKEND=onnx but onnxruntime is not installed, using sklearn for {stage}")
+        return
+    
+    scaler_path = os.path.join(MODEL_DIR, f'{stage}_scaler.joblib')
+    features = parity_rows(scalers[stage], check_rows)
+    features_scaled = scalers[stage].transform(features)
+    for name in ('rf', 'svm'):
+        key = f'{stage}_{name}'
+        try:
+            model = load_onnx_model(os.path.join(MODEL_DIR, f'{key}_model.joblib'), scaler_path, ONNX_INTRA_OP_THREADS)
+            if model is None:
+                logger.info(f"No up-to-date ONNX export for {key}, using sklearn")
+                continue
+            error = np.max(np.abs(model.predict_proba(features) - models[key].predict_proba(features_scaled)))
+            if error > ONNX_PARITY_TOLERANCE:
+                logger.warning(f"ONNX export for {key} differs from sklearn by {error:.2e}, using sklearn")
+                continue
+            onnx_models[key] = model
+            logger.info(f"Using onnxruntime for {key}")
+        except Exception as e:
+            logger.warning(f"ONNX backend unavailable for {key}, using sklearn: {str(e)}")
+
+def base_model_probabilities(stage, features):
+    """RF and SVM probabilities of the ASD class for a stage's raw feature matrix"""
+    rf_onnx = onnx_models.get(f'{stage}_rf')
+    svm_onnx = onnx_models.get(f'{stage}_svm')
+    
+    # Scale features (the ONNX pipelines include the scaler)
+    features_scaled = None
+    if rf_onnx is None or svm_onnx is None:
+        with phase('scaling'):
+            features_scaled = scalers[stage].transform(features)
+    
+    with phase('rf_predict'):
+        if rf_onnx is not None:
+            rf_probs = rf_onnx.predict_proba(features)[:, 1]
+        else:
+            rf_probs = models[f'{stage}_rf'].predict_proba(features_scaled)[:, 1]
+    with phase('svm_predict'):
+        if svm_onnx is not None:
+            svm_probs = svm_onnx.predict_proba(features)[:, 1]
+        else:
+            svm_probs = svm_probabilities(stage, features, features_scaled)
+    return rf_probs, svm_probs
+
+# Feature order of the behavioral and eye tracking models
+BEHAVIORAL_FEATURE_NAMES = ['A1_Score', 'A2_Score', 'A3_Score', 'A4_Score', 'A5_Score',
+                            'A6_Score', 'A7_Score', 'A8_Score', 'A9_Score', 'A10_Score', 'age', 'gender']
+EYE_TRACKING_FEATURE_NAMES = ['fixation_count', 'mean_saccade', 'max_saccade', 'std_saccade',
+                              'mean_x', 'mean_y', 'std_x', 'std_y', 'mean_pupil']
+
+EYE_TRACKING_DESCRIPTIONS = {
+    'fixation_count': 'Number of visual fixations - indicates attention patterns',
+    'mean_saccade': 'Average saccadic eye movement - relates to visual scanning',
+    'max_saccade': 'Maximum saccadic movement - indicates eye movement range',
+    'std_saccade': 'Saccadic movement variability - shows consistency patterns',
+    'mean_x': 'Average horizontal gaze position - indicates gaze centering',
+    'mean_y': 'Average vertical gaze position - indicates gaze height preference',
+    'std_x': 'Horizontal gaze variability - shows scanning patterns',
+    'std_y': 'Vertical gaze variability - indicates vertical attention spread',
+    'mean_pupil': 'Average pupil diameter - relates to arousal and attention'
+}
+
+# Features above this RandomForest importance are reported in explanations
+SIGNIFICANT_IMPORTANCE = 0.05
+
+class ModelMetadata:
+    """Per-stage feature metadata derived from the RandomForest once at load time
+    
+    Holds the importances, feature names, significant-feature mask and
+    descriptions, so request handlers only add the per-request values.
+    """
+    
+    def __init__(self, feature_names, feature_importances, descriptions=None, with_contribution=False):
+        self.feature_names = list(feature_names)
+        self.feature_importances = np.asarray(feature_importances, dtype=float)
+        self.significant_mask = self.feature_importances > SIGNIFICANT_IMPORTANCE
+        self.descriptions = descriptions
+        self.with_contribution = with_contribution
+        # (column, name, importance, description) of each significant feature
+        self.significant = [
+            (i, name, float(self.feature_importances[i]),
+             descriptions.get(name) if descriptions else None)
+            for i, name in enumerate(self.feature_names) if self.significant_mask[i]
+        ]
+    
+    def top_features(self, feature_values):
+        """Significant features with this row's values, as reported in explanations"""
+        top_features = {}
+        for i, name, importance, description in self.significant:
+            value = float(feature_values[i])
+            entry = {'importance': importance, 'value': value}
+            if self.with_contribution:
+                entry['contribution'] = float(importance * value)
+            if description is not None:
+                entry['description'] = description
+            top_features[name] = entry
+        return top_features
+
+def artifact_version(paths):
+    """Short content hash identifying the model files a stage is served from"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_fingerprint(path).encode())
+    return digest.hexdigest()[:16]
+
+def load_ensemble_weights(stage, path):
+    """A stage's weights artifact with weights in ENSEMBLE_BASE_MODELS order, or None if unusable
+    
+    The weights only hold for the models and scaler they were fitted with,
+    so an artifact whose recorded file fingerprints do not match the files
+    served now is ignored.
+    """
+    artifact = joblib.load(path)
+    if artifact.get('version') != ENSEMBLE_WEIGHTS_VERSION:
+        logger.warning(f"Ignoring {stage} ensemble weights with unsupported version {artifact.get('version')}")
+        return None
+    if sorted(artifact['models']) != sorted(ENSEMBLE_BASE_MODELS):
+        logger.warning(f"Ignoring {stage} ensemble weights for models {artifact['models']}")
+        return None
+    sources = artifact.get('sources', {})
+    for name, suffix in ENSEMBLE_SOURCE_FILES.items():
+        source_path = os.path.join(MODEL_DIR, f'{stage}_{suffix}.joblib')
+        if not os.path.exists(source_path) or sources.get(name) != file_fingerprint(source_path):
+            logger.warning(f"Ignoring {stage} ensemble weights fitted for a different {source_path}, "
+                           f"falling back to per-request PSO")
+            return None
+    by_model = dict(zip(artifact['models'], artifact['weights']))
+    return {**artifact, 'models': list(ENSEMBLE_BASE_MODELS), 'weights': [by_model[name] for name in ENSEMBLE_BASE_MODELS]}
+
+def load_model_artifacts():
+    """Load models, scalers, encoders and ensemble weights into the module globals"""
+    global behavioral_table
+    
+    # Load behavioral models
+    started = time.perf_counter()
+    models['behavioral_rf'] = load_random_forest('/app/models/behavioral_rf_model.joblib')
+    models['behavioral_svm'] = joblib.load('/app/models/behavioral_svm_model.joblib')
+    scalers['behavioral'] = joblib.load('/app/models/behavioral_scaler.joblib')
+    encoders['behavioral'] = joblib.load('/app/models/behavioral_label_encoder.joblib')
+    load_fused_svm('behavioral')
+    load_onnx_models('behavioral')
+    model_load_seconds['behavioral'] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    behavioral_table = BehavioralLookupTable.load(MODEL_DIR) if BEHAVIORAL_LOOKUP == 'table' else None
+    if behavioral_table is not None:
+        logger.info(f"Behavioral lookup table loaded for {len(behavioral_table.ages)} ages")
+    elif BEHAVIORAL_LOOKUP == 'table':
+        logger.info("No up-to-date behavioral lookup table, using live inference")
+    model_load_seconds['behavioral_lookup'] = time.perf_counter() - started
+    
+    logger.info("Behavioral models loaded successfully")
+    
+    # Load eye tracking models if available
+    if os.path.exists('/app/models/eye_tracking_rf_model.joblib'):
+        started = time.perf_counter()
+        models['eye_tracking_rf'] = load_random_forest('/app/models/eye_tracking_rf_model.joblib')
+        models['eye_tracking_svm'] = joblib.load('/app/models/eye_tracking_svm_model.joblib')
+        scalers['eye_tracking'] = joblib.load('/app/models/eye_tracking_scaler.joblib')
+        load_fused_svm('eye_tracking')
+        load_onnx_models('eye_tracking')
+        model_load_seconds['eye_tracking'] = time.perf_counter() - started
+        logger.info("Eye tracking models loaded successfully")
+    
+    # Load offline-calibrated ensemble weights if available
+    started = time.perf_counter()
+    for stage in ('behavioral', 'eye_tracking'):
+        path = os.path.join(MODEL_DIR, f'{stage}_ensemble_weights.joblib')
+        if not os.path.exists(path):
+            logger.info(f"No calibrated ensemble weights for {stage}, falling back to per-request PSO")
+            continue
+        artifact = load_ensemble_weights(stage, path)
+        if artifact is not None:
+            ensemble_weights[stage] = artifact
+            logger.info(f"Calibrated {stage} ensemble weights loaded: {artifact['weights']}")
+    model_load_seconds['ensemble_weights'] = time.perf_counter() - started
+    
+    # Feature metadata, read on every request
+    started = time.perf_counter()
+    model_metadata['behavioral'] = ModelMetadata(
+        BEHAVIORAL_FEATURE_NAMES, models['behavioral_rf'].feature_importances_, with_contribution=True)
+    if 'eye_tracking_rf' in models:
+        model_metadata['eye_tracking'] = ModelMetadata(
+            EYE_TRACKING_FEATURE_NAMES, models['eye_tracking_rf'].feature_importances_,
+            descriptions=EYE_TRACKING_DESCRIPTIONS)
+    
+    # Versions key the response cache, so cached responses never outlive the models
+    for stage in ('behavioral', 'eye_tracking'):
+        if f'{stage}_rf' not in models:
+            continue
+        paths = [os.path.join(MODEL_DIR, f'{stage}_{name}.joblib') for name in ('rf_model', 'svm_model', 'scaler')]
+        if stage in ensemble_weights:
+            paths.append(os.path.join(MODEL_DIR, f'{stage}_ensemble_weights.joblib'))
+        model_versions[stage] = artifact_version(paths)
+    model_versions['facial_analysis'] = FACIAL_MODEL_VERSION
+    model_load_seconds['metadata'] = time.perf_counter() - started
+
+def _init_inference_worker():
+    """Process pool initializer: load the models once per worker process"""
+    load_model_artifacts()
+
+def behavioral_feature_matrix(records):
+    """Build the (n, 12) behavioral feature matrix from questionnaire records"""
+    return np.array([[
+        r.A1_Score, r.A2_Score, r.A3_Score, r.A4_Score, r.A5_Score,
+        r.A6_Score, r.A7_Score, r.A8_Score, r.A9_Score, r.A10_Score,
+        r.age, 1 if r.gender == 'm' else 0  # Encoded gender
+    ] for r in records], dtype=float)
+
+def validate_behavioral_batch(features, genders):
+    """Check the behavioral input domain for a whole batch at once
+    
+    Applies the same rules as the BehavioralAssessment validators and
+    returns a list of {'index', 'errors'} entries for the invalid rows.
+    """
+    genders = np.asarray(genders)
+    valid_scores = np.isin(features[:, :10], (0, 0.5, 1)).all(axis=1)
+    valid_age = (features[:, 10] >= 0) & (features[:, 10] <= 100)
+    valid_gender = np.isin(genders, ('f', 'm'))
+    
+    errors = []
+    for i in np.flatnonzero(~(valid_scores & valid_age & valid_gender)):
+        record_errors = []
+        if not valid_scores[i]:
+            record_errors.append('Scores must be 0, 0.5, or 1')
+        if not valid_age[i]:
+            record_errors.append('Age must be between 0 and 100')
+        if not valid_gender[i]:
+            record_errors.append('Gender must be f or m')
+        errors.append({'index': int(i), 'errors': record_errors})
+    return errors
+
+def behavioral_base_probabilities(features):
+    """RF and SVM probabilities of the ASD class for a behavioral feature matrix
+    
+    Rows covered by the lookup table are read from it; the rest go through
+    the base models in one pass.
+    """
+    rf_probs = np.empty(len(features))
+    svm_probs = np.empty(len(features))
+    live = np.ones(len(features), dtype=bool)
+    
+    if behavioral_table is not None:
+        with phase('table_lookup'):
+            hit, table_rf, table_svm = behavioral_table.lookup(features)
+        rf_probs[hit] = table_rf
+        svm_probs[hit] = table_svm
+        live = ~hit
+    
+    if live.any():
+        rf_probs[live], svm_probs[live] = base_model_probabilities('behavioral', features[live])
+    
+    return rf_probs, svm_probs
+
+def score_behavioral_features(features):
+    """Score a behavioral feature matrix in one vectorized model pass (CPU-bound)
+    
+    Returns one result dict per row, identical to what the single-record
+    endpoint produces for the same input.
+    """
+    # Base predictions for all rows at once
+    rf_probs, svm_probs = behavioral_base_probabilities(features)
+    
+    metadata = model_metadata['behavioral']
+    
+    results = []
+    for row, feature_values in enumerate(features):
+        # Ensemble weighting (calibrated weights, or PSO if none are available)
+        base_predictions = [rf_probs[row], svm_probs[row]]  # Probability of ASD class
+        
+        with phase('pso'):
+            optimal_weights, pso_prob, pso_score, weighting_info = ensemble_predict('behavioral', base_predictions)
+        pso_pred = 1 if pso_prob > 0.5 else 0
+        
+        with phase('explanation'):
+            top_features = metadata.top_features(feature_values)
+            
+            # Generate explanation
+            explanation = generate_behavioral_explanation(pso_pred, pso_prob, top_features)
+        
+        results.append({
+            'prediction': int(pso_pred),
+            'probability': float(pso_prob),
+            'confidence': float(pso_score),
+            'model_results': {
+                'random_forest': {'probability': float(rf_probs[row]), 'prediction': int(rf_probs[row] > 0.5)},
+                'svm': {'probability': float(svm_probs[row]), 'prediction': int(svm_probs[row] > 0.5)},
+                'pso': {'probability': float(pso_prob), 'prediction': int(pso_pred), 'weights': optimal_weights.tolist(), **weighting_info}
+            },
+            'explanation': explanation,
+            'stage': 'behavioral',
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    return results
+
+# Optional identifier column echoed back with each scored row
+UPLOAD_ID_COLUMN = 'participant_id'
+
+def upload_numeric_matrix(chunk, columns):
+    """Numeric feature matrix from DataFrame columns; unparseable values become NaN"""
+    return np.column_stack([pd.to_numeric(chunk[c], errors='coerce').to_numpy(dtype=float) for c in columns])
+
+def behavioral_upload_features(chunk):
+    """Feature matrix and per-row validation errors for a chunk of behavioral rows"""
+    genders = chunk['gender'].astype(str).to_numpy()
+    features = np.column_stack([
+        upload_numeric_matrix(chunk, BEHAVIORAL_FEATURE_NAMES[:11]),
+        (genders == 'm').astype(float)  # Encoded gender
+    ])
+    return features, validate_behavioral_batch(features, genders)
+
+def eye_tracking_upload_features(chunk):
+    """Feature matrix and per-row validation errors for a chunk of eye tracking rows"""
+    features = upload_numeric_matrix(chunk, EYE_TRACKING_FEATURE_NAMES)
+    errors = [{'index': int(i), 'errors': ['Eye tracking features must be finite numbers']}
+              for i in np.flatnonzero(~np.isfinite(features).all(axis=1))]
+    return features, errors
+
+def score_upload_chunk(stage, chunk):
+    """Validate and score one uploaded chunk (CPU-bound)
+    
+    Returns (errors, valid_rows, records, results) with the validated input
+    record and the result for each valid row.
+    """
+    with phase('validation'):
+        if stage == 'behavioral':
+            features, errors = behavioral_upload_features(chunk)
+            scorer, feature_names = score_behavioral_features, BEHAVIORAL_FEATURE_NAMES
+        else:
+            features, errors = eye_tracking_upload_features(chunk)
+            scorer, feature_names = score_eye_tracking_features, EYE_TRACKING_FEATURE_NAMES
+    
+    invalid = {e['index'] for e in errors}
+    valid_rows = [i for i in range(len(chunk)) if i not in invalid]
+    results = scorer(features[valid_rows]) if valid_rows else []
+    
+    # Same shape as the single-record endpoints' assessment_input(data)
+    records = [dict(zip(feature_names, features[i].tolist())) for i in valid_rows]
+    if stage == 'behavioral':
+        for record in records:
+            record['gender'] = 'm' if record['gender'] else 'f'
+    return errors, valid_rows, records, results
+
+def upload_result_rows(chunk, offset, errors, valid_rows, results):
+    """Output rows for a scored chunk in file order, with errors in place of invalid rows"""
+    ids = chunk[UPLOAD_ID_COLUMN].tolist() if UPLOAD_ID_COLUMN in chunk.columns else None
+    rows = [{'row': offset + e['index'], 'errors': e['errors']} for e in errors]
+    for i, result in zip(valid_rows, results):
+        rows.append({'row': offset + i, **({UPLOAD_ID_COLUMN: ids[i]} if ids else {}), **result})
+    rows.sort(key=lambda row: row['row'])
+    return rows
+
+UPLOAD_CSV_COLUMNS = ['row', UPLOAD_ID_COLUMN, 'prediction', 'probability', 'confidence',
+                      'rf_probability', 'svm_probability', 'top_features', 'errors']
+
+def format_upload_rows(rows, output_format, header):
+    """Serialize scored upload rows as NDJSON lines or CSV records"""
+    if output_format == 'ndjson':
+        return ''.join(json.dumps(row, default=json_encoder) + '\n' for row in rows)
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(UPLOAD_CSV_COLUMNS)
+    for row in rows:
+        model_results = row.get('model_results', {})
+        # Significant features, most important first
+        top_features = row.get('explanation', {}).get('feature_analysis', {})
+        top_features = sorted(top_features, key=lambda name: -top_features[name]['importance'])
+        writer.writerow([
+            row['row'], row.get(UPLOAD_ID_COLUMN, ''), row.get('prediction', ''), row.get('probability', ''),
+            row.get('confidence', ''), model_results.get('random_forest', {}).get('probability', ''),
+            model_results.get('svm', {}).get('probability', ''), ';'.join(top_features),
+            '; '.join(row.get('errors', []))
+        ])
+    return buffer.getvalue()
+
+def eye_tracking_feature_matrix(records):
+    """Build the (n, 9) eye tracking feature matrix from gaze records"""
+    return np.array([[
+        r.fixation_count, r.mean_saccade, r.max_saccade, r.std_saccade,
+        r.mean_x, r.mean_y, r.std_x, r.std_y, r.mean_pupil
+    ] for r in records], dtype=float)
+
+def score_eye_tracking_features(features):
+    """Score an eye tracking feature matrix in one vectorized model pass (CPU-bound)"""
+    # Make base predictions for all rows at once
+    rf_probs, svm_probs = base_model_probabilities('eye_tracking', features)
+    
+    metadata = model_metadata['eye_tracking']
+    
+    results = []
+    for row, feature_values in enumerate(features):
+        # Ensemble weighting (calibrated weights, or PSO if none are available)
+        base_predictions = [rf_probs[row], svm_probs[row]]  # Probability of ASD class
+        
+        with phase('pso'):
+            optimal_weights, pso_prob, pso_score, weighting_info = ensemble_predict('eye_tracking', base_predictions)
+        pso_pred = 1 if pso_prob > 0.5 else 0
+        
+        with phase('explanation'):
+            top_features = metadata.top_features(feature_values)
+            
+            # Generate explanation
+            explanation = generate_eye_tracking_explanation(pso_pred, pso_prob, top_features)
+        
+        results.append({
+            'prediction': int(pso_pred),
+            'probability': float(pso_prob),
+            'confidence': float(pso_score),
+            'model_results': {
+                'random_forest': {'probability': float(rf_probs[row]), 'prediction': int(rf_probs[row] > 0.5)},
+                'svm': {'probability': float(svm_probs[row]), 'prediction': int(svm_probs[row] > 0.5)},
+                'pso': {'probability': float(pso_prob), 'prediction': int(pso_pred), 'weights': optimal_weights.tolist(), **weighting_info}
+            },
+            'explanation': explanation,
+            'stage': 'eye_tracking', 
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    return results
+
+def score_facial_analysis(data):
+    """Run facial analysis scoring and explanation for one request dict (session id not needed)"""
+    # For now, return a mock result since CNN training would need more setup
+    # In a full implementation, this would use the trained CNN model
+    
+    # Simple analysis based on facial features
+    feature_mean = np.mean(data['facial_features']) if data['facial_features'] else 0.5
+    
+    # Mock prediction based on attention patterns and emotions
+    attention_score = data['attention_patterns'].get('attention_to_faces', 0.5)
+    emotion_variability = np.std(list(data['emotion_scores'].values())) if data['emotion_scores'] else 0.5
+    
+    # Combine features for prediction
+    combined_score = (feature_mean * 0.4 + attention_score * 0.4 + emotion_variability * 0.2)
+    prediction = 1 if combined_score > 0.6 else 0
+    
+    with phase('explanation'):
+        explanation = {
+            'summary': f"Facial analysis {'indicates' if prediction else 'does not indicate'} ASD patterns",
+            'key_factors': {
+                'attention_to_faces': attention_score,
+                'emotion_variability': emotion_variability,
+                'facial_features_score': feature_mean
+            },
+            'interpretation': generate_facial_explanation(prediction, combined_score, data)
+        }
+    
+    result = {
+        'prediction': int(prediction),
+        'probability': float(combined_score),
+        'confidence': float(abs(combined_score - 0.5) * 2),
+        'explanation': explanation,
+        'stage': 'facial_analysis',
+        'timestamp': datetime.now().isoformat()
+    }
+    
+    return result
+
+def generate_behavioral_explanation(prediction, probability, top_features):
+    """Generate explanation for behavioral assessment"""
+    result_text = "indicates ASD patterns" if prediction else "does not indicate ASD patterns"
+    confidence_text = "high" if probability > 0.8 or probability < 0.2 else "moderate"
+    
+    explanation = {
+        'summary': f"Behavioral assessment {result_text} with {confidence_text} confidence",
+        'key_indicators': [],
+        'feature_analysis': top_features,
+        'recommendations': []
+    }
+    
+    # Analyze key features
+    if 'A6_Score' in top_features and top_features['A6_Score']['value'] == 1:
+        explanation['key_indicators'].append("Sensory sensitivity patterns detected")
+    
+    if 'A9_Score' in top_features and top_features['A9_Score']['value'] == 1:
+        explanation['key_indicators'].append("Behavioral flexibility concerns noted")
+    
+    if 'A5_Score' in top_features and top_features['A5_Score']['value'] == 1:
+        explanation['key_indicators'].append("Attention to detail patterns observed")
+    
+    # Add recommendations
+    if prediction:
+        explanation['recommendations'] = [
+            "Consider comprehensive diagnostic evaluation",
+            "Proceed with eye tracking and facial analysis",
+            "Consult with autism specialist"
+        ]
+    else:
+        explanation['recommendations'] = [
+            "Continue with additional assessments for complete evaluation",
+            "Monitor development patterns over time"
+        ]
+    
+    return explanation
+
+def generate_eye_tracking_explanation(prediction, probability, top_features):
+    """Generate explanation for eye tracking assessment"""
+    result_text = "suggests ASD patterns" if prediction else "does not suggest ASD patterns"
+    
+    explanation = {
+        'summary': f"Eye tracking analysis {result_text}",
+        'gaze_patterns': {},
+        'feature_analysis': top_features,
+        'clinical_significance': []
+    }
+    
+    # Analyze gaze patterns
+    if 'std_x' in top_features or 'std_y' in top_features:
+        explanation['gaze_patterns']['spatial_variability'] = "Atypical gaze distribution patterns detected"
+    
+    if 'fixation_count' in top_features:
+        explanation['gaze_patterns']['attention_patterns'] = "Unusual visual attention duration observed"
+    
+    if 'mean_saccade' in top_features:
+        explanation['gaze_patterns']['eye_movements'] = "Atypical saccadic eye movement patterns"
+    
+    # Clinical significance
+    explanation['clinical_significance'] = [
+        "Eye tracking provides objective measures of visual attention",
+        "Gaze patterns can indicate social attention differences",
+        "Results should be interpreted alongside other assessments"
+    ]
+    
+    return explanation
+
+def generate_facial_explanation(prediction, score, data):
+    """Generate explanation for facial analysis"""
+    explanation = []
+    
+    if data['attention_patterns'].get('attention_to_faces', 0) < 0.5:
+        explanation.append("Reduced attention to facial regions detected")
+    
+    if len(data['emotion_scores']) > 0:
+        dominant_emotion = max(data['emotion_scores'], key=data['emotion_scores'].get)
+        explanation.append(f"Dominant emotional expression: {dominant_emotion}")
+    
+    if not explanation:
+        explanation.append("Facial analysis completed with standard patterns")
+    
+    return explanation
@@ -1,12 +1,12 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, validator
 from typing import List, Dict, Optional, Any
 import joblib
 import numpy as np
 import pandas as pd
 import os
-import motor.motor_asyncio
 from datetime import datetime
 import json
 from sklearn.preprocessing import StandardScaler, LabelEncoder
@@ -15,22 +15,33 @@ from sklearn.svm import SVC
 import base64
 import cv2
 
-# --- LOCAL_MODELS_PATH_PATCH START ---
-import os
-BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join(BASE_DIR, 'models'))
-# Wrap joblib.load so '/app/models/xxx' -> local MODEL_DIR/xxx when running locally
-_original_joblib_load = joblib.load
-def _joblib_load_wrapper(path, *args, **kwargs):
-    if isinstance(path, str) and path.startswith('/app/models/'):
-        path = os.path.join(MODEL_DIR, path.replace('/app/models/', ''))
-    return _original_joblib_load(path, *args, **kwargs)
-joblib.load = _joblib_load_wrapper
-# --- LOCAL_MODELS_PATH_PATCH END ---
 import asyncio
 import logging
 from bson import ObjectId
 import random
+import time
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from assessment_store import create_repository
+import document_codec
+from write_ahead_log import CircuitBreaker, CircuitOpenError, GuardedRepository, claim_write_ahead_log
+import metrics
+from metrics import phase
+import scoring
+from response_cache import ResponseCache
+from write_behind import WriteBehindBuffer, db_flush_duration
+from micro_batch import MicroBatcher
+from active_sessions import SessionStore, STAGE_SUMMARY_FIELDS, stage_summary, merge_stored
+from scoring import (
+    BASE_DIR, models, model_versions, model_metadata,
+    model_load_seconds, pso_cache, BEHAVIORAL_FEATURE_NAMES, EYE_TRACKING_FEATURE_NAMES,
+    EYE_TRACKING_DESCRIPTIONS, load_model_artifacts, add_cache_counters,
+    behavioral_feature_matrix, validate_behavioral_batch, score_behavioral_features,
+    eye_tracking_feature_matrix, score_eye_tracking_features, score_upload_chunk,
+    upload_result_rows, format_upload_rows, score_facial_analysis, generate_behavioral_explanation,
+    generate_eye_tracking_explanation
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -57,179 +68,232 @@ def clean_mongo_doc(doc):
             cleaned[key] = value
     return cleaned
 
-def json_encoder(obj):
-    """Custom JSON encoder for MongoDB ObjectId and datetime objects"""
-    if isinstance(obj, ObjectId):
-        return str(obj)
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
-
 app = FastAPI(
     title="ASD Detection API",
     description="Machine Learning API for Autism Spectrum Disorder Detection with Multi-Stage Assessment",
     version="1.0.0"
 )
 
+# Every route records latency and phase histograms, exported by /metrics
+app.router.route_class = metrics.TimedRoute
+
+# Per-request tracing of the single-record assessment endpoints: 'header' traces
+# requests that send X-Trace-Id, 'all' traces every request, 'off' disables it
+REQUEST_TRACING = os.environ.get('REQUEST_TRACING', 'header')
+metrics.set_tracing(REQUEST_TRACING)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[metrics.TRACE_ID_HEADER, "Server-Timing"],
 )
 
-# Database connection
+# Database connection: 'mongo' (MONGO_URL) or 'sqlite' (a local WAL-mode file at SQLITE_PATH)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
-db = client.asd_detection
-
-# Global variables for models
-models = {}
-scalers = {}
-encoders = {}
-
-class PSO:
-    """Particle Swarm Optimization for feature selection and model optimization"""
-    
-    def __init__(self, n_particles=20, n_iterations=50, w=0.5, c1=1.5, c2=1.5):
-        self.n_particles = n_particles
-        self.n_iterations = n_iterations
-        self.w = w  # inertia weight
-        self.c1 = c1  # cognitive parameter
-        self.c2 = c2  # social parameter
-        
-    def optimize_features(self, X, y, model_type='rf'):
-        """Optimize feature selection using PSO"""
-        n_features = X.shape[1]
-        
-        # Initialize particles (binary encoding for feature selection)
-        particles = np.random.randint(0, 2, (self.n_particles, n_features))
-        velocities = np.random.uniform(-1, 1, (self.n_particles, n_features))
-        
-        # Track best positions
-        personal_best = particles.copy()
-        personal_best_scores = np.full(self.n_particles, -np.inf)
-        global_best = particles[0].copy()
-        global_best_score = -np.inf
-        
-        for iteration in range(self.n_iterations):
-            for i in range(self.n_particles):
-                # Evaluate fitness (model accuracy with selected features)
-                selected_features = particles[i] == 1
-                if np.sum(selected_features) == 0:  # At least one feature must be selected
-                    selected_features[0] = True
-                
-                score = self._evaluate_features(X[:, selected_features], y, model_type)
-                
-                # Update personal best
-                if score > personal_best_scores[i]:
-                    personal_best_scores[i] = score
-                    personal_best[i] = particles[i].copy()
-                
-                # Update global best
-                if score > global_best_score:
-                    global_best_score = score
-                    global_best = particles[i].copy()
-            
-            # Update velocities and positions
-            for i in range(self.n_particles):
-                r1, r2 = np.random.random(n_features), np.random.random(n_features)
-                
-                velocities[i] = (self.w * velocities[i] + 
-                               self.c1 * r1 * (personal_best[i] - particles[i]) + 
-                               self.c2 * r2 * (global_best - particles[i]))
-                
-                # Update positions using sigmoid function for binary encoding
-                sigmoid_v = 1 / (1 + np.exp(-velocities[i]))
-                particles[i] = (np.random.random(n_features) < sigmoid_v).astype(int)
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join(BASE_DIR, 'asd_detection.sqlite3'))
+
+# Circuit breaker around the database: after DB_BREAKER_FAILURES consecutive failures
+# writes go to a local write-ahead log at WAL_PATH and are replayed on recovery (0 disables).
+# Each worker process claims its own log: WAL_PATH, or <stem>.1.wal, <stem>.2.wal, ... if taken
+DB_BREAKER_FAILURES = int(os.environ.get('DB_BREAKER_FAILURES', 5))
+DB_BREAKER_RESET_SECONDS = float(os.environ.get('DB_BREAKER_RESET_SECONDS', 30))
+WAL_PATH = os.environ.get('WAL_PATH', os.path.join(BASE_DIR, 'assessments.wal'))
+WAL_FSYNC = os.environ.get('WAL_FSYNC', '1') == '1'
+WAL_REPLAY_INTERVAL_SECONDS = float(os.environ.get('WAL_REPLAY_INTERVAL_SECONDS', 5))
+# MongoDB client timeouts in milliseconds. A failure only reaches the breaker once
+# the driver gives up, so these bound how long requests wait while the database
+# is down before it opens (pymongo's defaults are 30 s and 20 s, and no socket timeout)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 2000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 2000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 5000))
+
+repository = create_repository(STORAGE_BACKEND, mongo_url=MONGO_URL, sqlite_path=SQLITE_PATH, mongo_options={
+    'serverSelectionTimeoutMS': MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    'connectTimeoutMS': MONGO_CONNECT_TIMEOUT_MS,
+    'socketTimeoutMS': MONGO_SOCKET_TIMEOUT_MS
+})
+if DB_BREAKER_FAILURES:
+    repository = GuardedRepository(
+        repository,
+        CircuitBreaker(DB_BREAKER_FAILURES, DB_BREAKER_RESET_SECONDS),
+        claim_write_ahead_log(WAL_PATH, fsync=WAL_FSYNC),
+        replay_interval=WAL_REPLAY_INTERVAL_SECONDS
+    )
+
+
+
+class InferenceExecutor:
+    """Runs CPU-bound scoring off the asyncio event loop
+    
+    mode is 'thread', 'process' (workers load the joblib models through an
+    initializer) or 'inline' (run on the event loop, as before). At most
+    max_concurrency calls run at once; the rest wait in a queue whose depth
+    is reported by stats().
+    """
+    
+    MODES = ('thread', 'process', 'inline')
+    
+    def __init__(self, mode='thread', workers=None, max_concurrency=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown inference executor mode '{mode}', expected one of {self.MODES}")
+        self.mode = mode
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_concurrency = max_concurrency or self.workers * 2
+        self._pool = None
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.queue_depth = 0
+        self.peak_queue_depth = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+    
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.mode == 'thread':
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='inference')
+        elif self.mode == 'process':
+            # spawn avoids forking the event loop and the Mongo client
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=scoring._init_inference_worker
+            )
+            # Spawn the workers now so model loading doesn't land on the first requests
+            for _ in range(self.workers):
+                self._pool.submit(os.getpid)
+    
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+    
+    async def run(self, func, *args):
+        """Run func(*args) on the configured executor and return its result
         
-        return global_best, global_best_score
+        Phases timed inside func count towards the calling request.
+        """
+        result, phases = await self.run_with_phases(func, *args)
+        metrics.add_phases(phases)
+        return result
     
-    def _evaluate_features(self, X, y, model_type):
-        """Evaluate feature subset using cross-validation"""
-        if X.shape[1] == 0:
-            return 0
-            
+    async def run_with_phases(self, func, *args):
+        """Run func(*args) and return (result, its phase timings, including the queue wait)"""
+        enqueued = time.perf_counter()
+        self.queue_depth += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
         try:
-            if model_type == 'rf':
-                model = RandomForestClassifier(n_estimators=10, random_state=42)
-            else:
-                model = SVC(random_state=42)
-            
-            # Simple train-test split for speed
-            split_idx = int(0.8 * len(X))
-            X_train, X_test = X[:split_idx], X[split_idx:]
-            y_train, y_test = y[:split_idx], y[split_idx:]
-            
-            if len(np.unique(y_train)) < 2:  # Not enough classes
-                return 0
-                
-            model.fit(X_train, y_train)
-            score = model.score(X_test, y_test)
-            return score
-        except:
-            return 0
-
-    def optimize_prediction(self, predictions, weights=None):
-        """Optimize final prediction using PSO ensemble weighting"""
-        if weights is None:
-            weights = np.random.random(len(predictions))
-            weights = weights / np.sum(weights)
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
         
-        # Use PSO to find optimal weights for ensemble
-        n_models = len(predictions)
-        particles = np.random.random((self.n_particles, n_models))
-        # Normalize weights
-        particles = particles / particles.sum(axis=1, keepdims=True)
-        
-        velocities = np.random.uniform(-0.1, 0.1, (self.n_particles, n_models))
-        
-        personal_best = particles.copy()
-        personal_best_scores = np.full(self.n_particles, -np.inf)
-        global_best = particles[0].copy()
-        global_best_score = -np.inf
-        
-        for iteration in range(min(self.n_iterations, 20)):  # Fewer iterations for speed
-            for i in range(self.n_particles):
-                # Calculate weighted ensemble prediction
-                ensemble_pred = np.average(predictions, weights=particles[i])
-                
-                # Simple fitness: diversity + accuracy proxy
-                score = self._ensemble_fitness(predictions, particles[i], ensemble_pred)
-                
-                if score > personal_best_scores[i]:
-                    personal_best_scores[i] = score
-                    personal_best[i] = particles[i].copy()
-                
-                if score > global_best_score:
-                    global_best_score = score
-                    global_best = particles[i].copy()
-            
-            # Update particles
-            for i in range(self.n_particles):
-                r1, r2 = np.random.random(n_models), np.random.random(n_models)
-                
-                velocities[i] = (self.w * velocities[i] + 
-                               self.c1 * r1 * (personal_best[i] - particles[i]) + 
-                               self.c2 * r2 * (global_best - particles[i]))
-                
-                particles[i] += velocities[i]
-                # Normalize weights
-                particles[i] = np.abs(particles[i])
-                particles[i] = particles[i] / np.sum(particles[i])
-        
-        return global_best, global_best_score
+        started = time.perf_counter()
+        self.total_wait_seconds += started - enqueued
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            if self._pool is None:
+                result, phases = metrics.collect_phases(func, *args)
+            elif self.mode == 'process':
+                result, phases, counters = await loop.run_in_executor(self._pool, scoring._score_in_worker, func, *args)
+                add_cache_counters(counters)
+            else:
+                result, phases = await loop.run_in_executor(self._pool, metrics.collect_phases, func, *args)
+            phases['queue_wait'] = started - enqueued
+            return result, phases
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_run_seconds += time.perf_counter() - started
+            self._semaphore.release()
     
-    def _ensemble_fitness(self, predictions, weights, ensemble_pred):
-        """Calculate fitness for ensemble weights"""
-        # Combine accuracy proxy with diversity
-        diversity = np.std([pred * weight for pred, weight in zip(predictions, weights)])
-        confidence = abs(ensemble_pred - 0.5)  # Distance from uncertainty
-        return confidence + 0.1 * diversity
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'workers': self.workers,
+            'max_concurrency': self.max_concurrency,
+            'queue_depth': self.queue_depth,
+            'peak_queue_depth': self.peak_queue_depth,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'avg_wait_ms': 1000 * self.total_wait_seconds / self.completed if self.completed else 0.0,
+            'avg_run_ms': 1000 * self.total_run_seconds / self.completed if self.completed else 0.0
+        }
 
-class BehavioralAssessment(BaseModel):
-    """Behavioral questionnaire data"""
+inference_executor = InferenceExecutor(
+    mode=os.environ.get('INFERENCE_EXECUTOR', 'thread'),
+    workers=int(os.environ.get('INFERENCE_WORKERS', 0)) or None,
+    max_concurrency=int(os.environ.get('INFERENCE_MAX_CONCURRENCY', 0)) or None
+)
+
+# Response cache for the single-record assessment endpoints (RESPONSE_CACHE_MAX_BYTES=0 disables it)
+response_cache = ResponseCache(max_bytes=int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)))
+
+# Response fields that describe one request rather than the model output; never cached
+PER_REQUEST_FIELDS = ('timestamp',)
+
+def model_output(result):
+    """A stage result without its per-request fields, as held in the response cache"""
+    return {key: value for key, value in result.items() if key not in PER_REQUEST_FIELDS}
+
+async def cached_stage_result(stage, data, compute):
+    """Stage result for data from the response cache or compute(), stamped for this request"""
+    cache_key = ResponseCache.make_key(stage, assessment_input(data), model_versions.get(stage))
+    
+    async def compute_output():
+        return model_output(await compute())
+    
+    output = await response_cache.get_or_compute(cache_key, compute_output)
+    return {**output, 'timestamp': datetime.now().isoformat()}
+
+# Most recent stored assessments used to warm the cache at startup (0 disables warm-up)
+RESPONSE_CACHE_WARMUP = int(os.environ.get('RESPONSE_CACHE_WARMUP', 1000))
+
+# Write-behind persistence (WRITE_BEHIND_MAX_PENDING=0 writes inline)
+WRITE_BEHIND_MAX_BATCH = int(os.environ.get('WRITE_BEHIND_MAX_BATCH', 500))
+WRITE_BEHIND_FLUSH_MS = float(os.environ.get('WRITE_BEHIND_FLUSH_MS', 50))
+WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 10000))
+
+# Standalone stage documents: batch, upload and session-less requests
+assessment_writer = WriteBehindBuffer(
+    'assessments',
+    lambda documents: repository.insert_assessments(documents),
+    max_batch=WRITE_BEHIND_MAX_BATCH,
+    flush_interval_ms=WRITE_BEHIND_FLUSH_MS,
+    max_pending=WRITE_BEHIND_MAX_PENDING
+)
+
+# Stage and final result upserts into the per-session documents
+session_writer = WriteBehindBuffer(
+    'sessions',
+    lambda updates: repository.update_sessions(updates),
+    max_batch=WRITE_BEHIND_MAX_BATCH,
+    flush_interval_ms=WRITE_BEHIND_FLUSH_MS,
+    max_pending=WRITE_BEHIND_MAX_PENDING,
+    key=lambda update: update[0]
+)
+
+ASSESSMENT_STAGES = ('behavioral', 'eye_tracking', 'facial_analysis')
+
+# Stage results of in-progress sessions (SESSION_STORE_MAX_SESSIONS=0 disables the store)
+session_store = SessionStore(
+    ASSESSMENT_STAGES,
+    max_sessions=int(os.environ.get('SESSION_STORE_MAX_SESSIONS', 10000)),
+    ttl_seconds=float(os.environ.get('SESSION_STORE_TTL_SECONDS', 1800))
+)
+
+class BehavioralAssessmentRecord(BaseModel):
+    """Behavioral questionnaire fields without per-field validation (batch input)"""
     A1_Score: float  # Social responsiveness - now supports 0, 0.5, 1
     A2_Score: float  # Communication patterns
     A3_Score: float  # Repetitive behaviors
@@ -242,6 +306,10 @@ class BehavioralAssessment(BaseModel):
     A10_Score: float  # Emotional regulation
     age: float
     gender: str  # 'f' or 'm'
+    session_id: Optional[str] = None  # Groups stage results for /api/assessment/complete
+
+class BehavioralAssessment(BehavioralAssessmentRecord):
+    """Behavioral questionnaire data"""
     
     @validator('A1_Score', 'A2_Score', 'A3_Score', 'A4_Score', 'A5_Score', 
               'A6_Score', 'A7_Score', 'A8_Score', 'A9_Score', 'A10_Score')
@@ -273,12 +341,132 @@ class EyeTrackingData(BaseModel):
     std_x: float
     std_y: float
     mean_pupil: float
+    session_id: Optional[str] = None
 
 class FacialAnalysisData(BaseModel):
     """Facial analysis features"""
     facial_features: List[float]  # CNN features from facial analysis
     emotion_scores: Dict[str, float]
     attention_patterns: Dict[str, float]
+    session_id: Optional[str] = None
+
+def assessment_input(data):
+    """Validated stage input without the session id, as stored and cache-keyed"""
+    return data.dict(exclude={'session_id'})
+
+# Stored stage entries: 'compact' (packed features and probabilities, templated
+# explanations) or 'full' (request dict and whole response)
+STORED_FORMAT = os.environ.get('STORED_FORMAT', 'compact')
+
+# Compression of the packed field in compact entries: 'none' or 'zstd' (needs zstandard)
+STORED_COMPRESSION = os.environ.get('STORED_COMPRESSION', 'none')
+if STORED_COMPRESSION == 'zstd' and not document_codec.zstd_available():
+    logger.warning("STORED_COMPRESSION=zstd but zstandard is not installed, storing uncompressed")
+    STORED_COMPRESSION = 'none'
+
+def compact_stage_entry(stage, data, result):
+    """Stored form of a stage result without the request dict and response text"""
+    if stage == 'facial_analysis':
+        features = data['facial_features']
+        values = []
+        params = {'emotion_scores': data['emotion_scores'], 'attention_patterns': data['attention_patterns']}
+    else:
+        feature_names = BEHAVIORAL_FEATURE_NAMES if stage == 'behavioral' else EYE_TRACKING_FEATURE_NAMES
+        features = [data[name] for name in feature_names]
+        if stage == 'behavioral':
+            features[-1] = 1 if data['gender'] == 'm' else 0  # Encoded gender
+        model_results = result['model_results']
+        pso = model_results['pso']
+        values = [model_results['random_forest']['probability'], model_results['svm']['probability'], *pso['weights']]
+        # How the ensemble weights were obtained
+        params = {key: value for key, value in pso.items() if key not in ('probability', 'prediction', 'weights')}
+    
+    return {
+        **stage_summary(result),
+        'packed': document_codec.pack(f'{stage}-1', features, values, params,
+                                      STORED_COMPRESSION if STORED_COMPRESSION != 'none' else None)
+    }
+
+def expand_stage_entry(stage, entry):
+    """(data, result) of a stored stage entry, or None if it cannot be rebuilt exactly
+    
+    Compact entries are rebuilt from their packed features and probabilities
+    with the current explanation templates, so only entries whose features
+    were stored losslessly and whose model version is still served qualify.
+    """
+    if 'packed' not in entry:
+        return entry.get('data'), entry.get('result')
+    if entry.get('model_version') != model_versions.get(stage):
+        return None
+    packed = document_codec.unpack(entry['packed'])
+    if not packed.lossless:
+        return None
+    
+    if stage == 'facial_analysis':
+        data = {'facial_features': packed.features.tolist(), **packed.params}
+        result = score_facial_analysis(FacialAnalysisData(**data))
+        result['timestamp'] = entry['timestamp'].isoformat()
+        return data, result
+    
+    feature_names = BEHAVIORAL_FEATURE_NAMES if stage == 'behavioral' else EYE_TRACKING_FEATURE_NAMES
+    data = dict(zip(feature_names, packed.features.tolist()))
+    if stage == 'behavioral':
+        data['gender'] = 'm' if data['gender'] else 'f'
+    
+    rf_prob, svm_prob, *weights = packed.values.tolist()
+    prediction, probability = entry['prediction'], entry['probability']
+    top_features = model_metadata[stage].top_features(packed.features)
+    if stage == 'behavioral':
+        explanation = generate_behavioral_explanation(prediction, probability, top_features)
+    else:
+        explanation = generate_eye_tracking_explanation(prediction, probability, top_features)
+    
+    result = {
+        'prediction': prediction,
+        'probability': probability,
+        'confidence': entry['confidence'],
+        'model_results': {
+            'random_forest': {'probability': rf_prob, 'prediction': int(rf_prob > 0.5)},
+            'svm': {'probability': svm_prob, 'prediction': int(svm_prob > 0.5)},
+            'pso': {'probability': probability, 'prediction': prediction, 'weights': weights, **packed.params}
+        },
+        'explanation': explanation,
+        'stage': stage,
+        'timestamp': entry['timestamp'].isoformat()
+    }
+    return data, result
+
+async def store_stage_results(stage, entries):
+    """Queue (session_id, data, result) entries of one stage for persistence
+    
+    A result with a session is $set into that session's document by an atomic
+    upsert, so each session stays a single document; results without one are
+    stored as standalone assessments documents.
+    """
+    now = datetime.now()
+    model_version = model_versions.get(stage)
+    trace_id = metrics.current_trace_id()
+    session_updates, documents = [], []
+    for session_id, data, result in entries:
+        if STORED_FORMAT == 'compact':
+            entry = compact_stage_entry(stage, data, result)
+        else:
+            entry = {'data': data, 'result': result}
+        entry.update({'model_version': model_version, 'timestamp': now})
+        if trace_id is not None:
+            entry['trace_id'] = trace_id
+        if session_id:
+            session_store.put(session_id, stage, stage_summary(result), now)
+            session_updates.append((session_id, {f'stages.{stage}': entry, 'updated_at': now}))
+        else:
+            documents.append({'stage': stage, **entry})
+    
+    # Only the enqueue (and any backpressure) unless writes go inline
+    with phase('db_write'):
+        if session_updates:
+            await session_writer.put_many(session_updates)
+        if documents:
+            await assessment_writer.put_many(documents)
 
 class AssessmentResult(BaseModel):
     """Complete assessment result"""
@@ -294,29 +482,78 @@ class AssessmentResult(BaseModel):
 @app.on_event("startup")
 async def load_models():
     """Load trained ML models on startup"""
-    global models, scalers, encoders
-    
     try:
-        # Load behavioral models
-        models['behavioral_rf'] = joblib.load('/app/models/behavioral_rf_model.joblib')
-        models['behavioral_svm'] = joblib.load('/app/models/behavioral_svm_model.joblib')
-        scalers['behavioral'] = joblib.load('/app/models/behavioral_scaler.joblib')
-        encoders['behavioral'] = joblib.load('/app/models/behavioral_label_encoder.joblib')
-        
-        logger.info("Behavioral models loaded successfully")
-        
-        # Load eye tracking models if available
-        if os.path.exists('/app/models/eye_tracking_rf_model.joblib'):
-            models['eye_tracking_rf'] = joblib.load('/app/models/eye_tracking_rf_model.joblib')
-            models['eye_tracking_svm'] = joblib.load('/app/models/eye_tracking_svm_model.joblib')
-            scalers['eye_tracking'] = joblib.load('/app/models/eye_tracking_scaler.joblib')
-            logger.info("Eye tracking models loaded successfully")
-        
+        load_model_artifacts()
         logger.info("All models loaded successfully")
         
     except Exception as e:
         logger.error(f"Error loading models: {str(e)}")
         raise e
+    
+    inference_executor.start()
+    logger.info(f"Inference executor started: {inference_executor.mode} x {inference_executor.workers}")
+    
+    if response_cache.max_bytes and RESPONSE_CACHE_WARMUP:
+        asyncio.get_running_loop().create_task(warm_response_cache(RESPONSE_CACHE_WARMUP))
+
+async def warm_response_cache(limit):
+    """Seed the response cache from the most recent stored stage results"""
+    try:
+        docs = await repository.recent_stage_results(list(model_versions), limit)
+        
+        # Oldest first, so the most recent responses end up most recently used
+        for doc in reversed(docs):
+            if doc['model_version'] != model_versions.get(doc['stage']):
+                continue
+            expanded = expand_stage_entry(doc['stage'], doc)
+            if expanded is None:
+                continue
+            data, result = expanded
+            response_cache.put(ResponseCache.make_key(doc['stage'], data, doc['model_version']), model_output(result))
+            response_cache.warmed += 1
+        logger.info(f"Response cache warmed with {response_cache.warmed} of {len(docs)} recent assessments")
+        
+    except Exception as e:
+        logger.warning(f"Response cache warm-up failed: {str(e)}")
+
+@app.on_event("startup")
+async def create_assessment_indexes():
+    """Create the assessments and sessions indexes in the background (no-op if they exist)"""
+    asyncio.get_running_loop().create_task(ensure_assessment_indexes())
+
+async def ensure_assessment_indexes():
+    try:
+        await repository.ensure_indexes()
+        logger.info("Assessment indexes ready")
+    except Exception as e:
+        logger.warning(f"Could not create assessment indexes: {str(e)}")
+
+@app.on_event("startup")
+async def start_repository():
+    """Start storage background work (write-ahead log replay)"""
+    await repository.start()
+
+@app.on_event("startup")
+async def start_assessment_writer():
+    """Start the write-behind tasks for assessment and session documents"""
+    assessment_writer.start()
+    session_writer.start()
+
+@app.on_event("shutdown")
+async def shutdown_inference_executor():
+    """Stop inference workers on shutdown"""
+    inference_executor.shutdown()
+
+@app.on_event("shutdown")
+async def stop_assessment_writer():
+    """Flush buffered assessment and session writes on shutdown"""
+    await assessment_writer.stop()
+    await session_writer.stop()
+
+@app.on_event("shutdown")
+async def close_repository():
+    """Close the storage backend once buffered writes are out"""
+    await repository.close()
 
 @app.get("/")
 async def root():
@@ -345,7 +582,19 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "models_loaded": len(models),
-        "available_stages": ["behavioral", "eye_tracking", "facial_analysis"]
+        "available_stages": ["behavioral", "eye_tracking", "facial_analysis"],
+        "pso_cache": pso_cache.stats(),
+        "inference_executor": inference_executor.stats(),
+        "micro_batching": {
+            "behavioral": behavioral_batcher.stats(),
+            "eye_tracking": eye_tracking_batcher.stats()
+        },
+        "behavioral_lookup": scoring.behavioral_table.stats() if scoring.behavioral_table is not None else None,
+        "response_cache": response_cache.stats(),
+        "assessment_writer": assessment_writer.stats(),
+        "session_writer": session_writer.stats(),
+        "session_store": session_store.stats(),
+        "storage": repository.stats()
     }
 
 @app.get("/api/health")
@@ -355,76 +604,86 @@ async def api_health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "models_loaded": len(models),
-        "available_stages": ["behavioral", "eye_tracking", "facial_analysis"]
+        "available_stages": ["behavioral", "eye_tracking", "facial_analysis"],
+        "pso_cache": pso_cache.stats(),
+        "inference_executor": inference_executor.stats(),
+        "micro_batching": {
+            "behavioral": behavioral_batcher.stats(),
+            "eye_tracking": eye_tracking_batcher.stats()
+        },
+        "behavioral_lookup": scoring.behavioral_table.stats() if scoring.behavioral_table is not None else None,
+        "response_cache": response_cache.stats(),
+        "assessment_writer": assessment_writer.stats(),
+        "session_writer": session_writer.stats(),
+        "session_store": session_store.stats(),
+        "storage": repository.stats()
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Latency histograms, cache, executor and storage metrics in Prometheus text format"""
+    render = metrics.render_metric
+    caches = {
+        'response': response_cache.stats(),
+        'pso': pso_cache.stats(),
+        'session_store': session_store.stats()
     }
+    if scoring.behavioral_table is not None:
+        caches['behavioral_lookup'] = scoring.behavioral_table.stats()
+    executor = inference_executor.stats()
+    writers = [assessment_writer.stats(), session_writer.stats()]
+    storage = repository.stats()
+    
+    lines = metrics.request_duration.render() + metrics.request_phase_duration.render() + db_flush_duration.render()
+    lines += render('asd_requests_in_flight', 'gauge', 'Requests being handled',
+                    [({'endpoint': endpoint}, n) for endpoint, n in sorted(metrics.requests_in_flight.items())])
+    lines += render('asd_model_load_duration_seconds', 'gauge', 'Time taken to load each group of model artifacts',
+                    [({'artifacts': name}, seconds) for name, seconds in model_load_seconds.items()])
+    lines += render('asd_models_loaded', 'gauge', 'Models loaded', [({}, len(models))])
+    lines += render('asd_cache_hits_total', 'counter', 'Cache hits',
+                    [({'cache': name}, stats['hits']) for name, stats in caches.items()])
+    lines += render('asd_cache_misses_total', 'counter', 'Cache misses',
+                    [({'cache': name}, stats['misses']) for name, stats in caches.items()])
+    lines += render('asd_cache_hit_ratio', 'gauge', 'Cache hits over lookups since startup',
+                    [({'cache': name}, stats['hit_ratio']) for name, stats in caches.items()])
+    lines += render('asd_inference_queue_depth', 'gauge', 'Scoring calls waiting for an inference slot',
+                    [({'mode': executor['mode']}, executor['queue_depth'])])
+    lines += render('asd_inference_in_flight', 'gauge', 'Scoring calls running on the inference executor',
+                    [({'mode': executor['mode']}, executor['in_flight'])])
+    lines += render('asd_inference_calls_total', 'counter', 'Finished inference executor calls',
+                    [({'mode': executor['mode']}, executor['completed'])])
+    lines += render('asd_inference_failures_total', 'counter', 'Failed inference executor calls',
+                    [({'mode': executor['mode']}, executor['failed'])])
+    lines += render('asd_write_behind_depth', 'gauge', 'Writes buffered for the database',
+                    [({'collection': w['collection']}, w['depth']) for w in writers])
+    lines += render('asd_write_behind_written_total', 'counter', 'Buffered writes stored',
+                    [({'collection': w['collection']}, w['written']) for w in writers])
+    if 'circuit_breaker' in storage:
+        state = storage['circuit_breaker']['state']
+        lines += render('asd_db_circuit_breaker_state', 'gauge', 'Current database circuit breaker state (1 = current)',
+                        [({'state': s}, int(s == state)) for s in ('closed', 'open', 'half_open')])
+        lines += render('asd_write_ahead_log_pending_bytes', 'gauge', 'Bytes in the local write-ahead log awaiting replay',
+                        [({}, storage['write_ahead_log']['pending_bytes'])])
+    
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type=metrics.CONTENT_TYPE)
+
+# Upper bound on records per /api/assessment/behavioral/batch request
+BEHAVIORAL_BATCH_MAX = int(os.environ.get('BEHAVIORAL_BATCH_MAX', 5000))
+
+
+def score_behavioral(data: BehavioralAssessment):
+    """Run behavioral inference, ensemble weighting and explanation (CPU-bound)"""
+    return score_behavioral_features(behavioral_feature_matrix([data]))[0]
 
 @app.post("/api/assessment/behavioral")
+@metrics.traced
 async def assess_behavioral(data: BehavioralAssessment):
     """Stage 1: Behavioral Assessment with PSO optimization"""
     try:
-        # Prepare features
-        features = np.array([[
-            data.A1_Score, data.A2_Score, data.A3_Score, data.A4_Score, data.A5_Score,
-            data.A6_Score, data.A7_Score, data.A8_Score, data.A9_Score, data.A10_Score,
-            data.age, 1 if data.gender == 'm' else 0  # Encoded gender
-        ]])
-        
-        # Scale features
-        features_scaled = scalers['behavioral'].transform(features)
-        
-        # Make base predictions
-        rf_pred = models['behavioral_rf'].predict_proba(features_scaled)[0]
-        svm_pred = models['behavioral_svm'].predict_proba(features_scaled)[0]
-        
-        # Use PSO for optimal ensemble weighting
-        pso = PSO(n_particles=15, n_iterations=30)
-        base_predictions = [rf_pred[1], svm_pred[1]]  # Probability of ASD class
-        
-        optimal_weights, pso_score = pso.optimize_prediction(base_predictions)
-        
-        # PSO-optimized ensemble prediction
-        pso_prob = np.average(base_predictions, weights=optimal_weights)
-        pso_pred = 1 if pso_prob > 0.5 else 0
-        
-        # Feature importance analysis
-        feature_importance = models['behavioral_rf'].feature_importances_
-        feature_names = ['A1_Score', 'A2_Score', 'A3_Score', 'A4_Score', 'A5_Score',
-                        'A6_Score', 'A7_Score', 'A8_Score', 'A9_Score', 'A10_Score', 'age', 'gender']
-        
-        top_features = {}
-        feature_values = features[0]
-        for i, (name, importance) in enumerate(zip(feature_names, feature_importance)):
-            if importance > 0.05:  # Only significant features
-                top_features[name] = {
-                    'importance': float(importance),
-                    'value': float(feature_values[i]),
-                    'contribution': float(importance * feature_values[i])
-                }
-        
-        # Generate explanation
-        explanation = generate_behavioral_explanation(pso_pred, pso_prob, top_features)
-        
-        result = {
-            'prediction': int(pso_pred),
-            'probability': float(pso_prob),
-            'confidence': float(pso_score),
-            'model_results': {
-                'random_forest': {'probability': float(rf_pred[1]), 'prediction': int(rf_pred[1] > 0.5)},
-                'svm': {'probability': float(svm_pred[1]), 'prediction': int(svm_pred[1] > 0.5)},
-                'pso': {'probability': float(pso_prob), 'prediction': int(pso_pred), 'weights': optimal_weights.tolist()}
-            },
-            'explanation': explanation,
-            'stage': 'behavioral',
-            'timestamp': datetime.now().isoformat()
-        }
+        result = await cached_stage_result('behavioral', data, lambda: behavioral_batcher.submit(behavioral_feature_matrix([data])[0]))
         
         # Store result in database
-        await db.assessments.insert_one({
-            'stage': 'behavioral',
-            'data': data.dict(),
-            'result': result,
-            'timestamp': datetime.now()
-        })
+        await store_stage_results('behavioral', [(data.session_id, assessment_input(data), result)])
         
         return result
         
@@ -432,75 +691,120 @@ async def assess_behavioral(data: BehavioralAssessment):
         logger.error(f"Behavioral assessment error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Assessment failed: {str(e)}")
 
+@app.post("/api/assessment/behavioral/batch")
+async def assess_behavioral_batch(records: List[BehavioralAssessmentRecord]):
+    """Stage 1 for many questionnaires: one validation pass and one model call per batch"""
+    if not records:
+        raise HTTPException(status_code=422, detail="At least one record is required")
+    if len(records) > BEHAVIORAL_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large: {len(records)} records (max {BEHAVIORAL_BATCH_MAX})")
+    
+    with phase('validation'):
+        features = behavioral_feature_matrix(records)
+        errors = validate_behavioral_batch(features, [r.gender for r in records])
+    if errors:
+        raise HTTPException(status_code=422, detail={'message': f"{len(errors)} invalid record(s)", 'errors': errors[:100]})
+    
+    try:
+        results = await inference_executor.run(score_behavioral_features, features)
+        
+        # Store results in database
+        await store_stage_results('behavioral', [
+            (record.session_id, assessment_input(record), result) for record, result in zip(records, results)])
+        
+        return {'stage': 'behavioral', 'count': len(results), 'results': results}
+        
+    except Exception as e:
+        logger.error(f"Behavioral batch assessment error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Assessment failed: {str(e)}")
+
+# Rows parsed and scored at a time by the file upload endpoints
+UPLOAD_CHUNK_ROWS = int(os.environ.get('UPLOAD_CHUNK_ROWS', 5000))
+
+def iter_upload_chunks(upload, chunk_rows):
+    """Parse an uploaded CSV or Parquet file into DataFrames of at most chunk_rows rows"""
+    name = (upload.filename or '').lower()
+    if name.endswith(('.parquet', '.pq')):
+        # Optional dependency, only needed for Parquet uploads
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet uploads are not supported on this server (pyarrow is not installed); upload a CSV file")
+        for batch in pq.ParquetFile(upload.file).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(upload.file, chunksize=chunk_rows)
+
+async def stream_upload_results(stage, first_chunk, chunks, output_format):
+    """Score an upload chunk by chunk, storing and yielding results as they are ready"""
+    chunk = first_chunk
+    offset = 0
+    header = True
+    try:
+        while chunk is not None:
+            errors, valid_rows, records, results = await inference_executor.run(score_upload_chunk, stage, chunk)
+            rows = upload_result_rows(chunk, offset, errors, valid_rows, results)
+            
+            # Store results in database
+            if results:
+                await store_stage_results(stage, [(None, record, result) for record, result in zip(records, results)])
+            
+            with phase('serialization'):
+                body = format_upload_rows(rows, output_format, header)
+            yield body
+            header = False
+            offset += len(chunk)
+            chunk = await asyncio.to_thread(next, chunks, None)
+    
+    except Exception as e:
+        # Headers are already sent, so report the failure in the stream itself
+        logger.error(f"{stage} upload scoring error after {offset} rows: {str(e)}")
+        yield format_upload_rows([{'row': offset, 'errors': [f"Assessment failed: {str(e)}"]}], output_format, header)
+    finally:
+        chunks.close()
+
+async def start_upload_stream(stage, file, output_format, required_columns):
+    """Check an upload's format and columns, then stream its scored rows back"""
+    if output_format not in ('ndjson', 'csv'):
+        raise HTTPException(status_code=422, detail="format must be 'ndjson' or 'csv'")
+    
+    try:
+        chunks = iter_upload_chunks(file, UPLOAD_CHUNK_ROWS)
+        first_chunk = await asyncio.to_thread(next, chunks, None)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Could not parse upload: {str(e)}")
+    if first_chunk is None:
+        raise HTTPException(status_code=422, detail="Upload contains no rows")
+    missing = [c for c in required_columns if c not in first_chunk.columns]
+    if missing:
+        chunks.close()
+        raise HTTPException(status_code=422, detail=f"Missing columns: {', '.join(missing)}")
+    
+    media_type = 'application/x-ndjson' if output_format == 'ndjson' else 'text/csv'
+    return StreamingResponse(stream_upload_results(stage, first_chunk, chunks, output_format), media_type=media_type)
+
+@app.post("/api/assessment/behavioral/upload")
+async def assess_behavioral_upload(file: UploadFile = File(...), output_format: str = Query('ndjson', alias='format')):
+    """Stage 1 for a CSV/Parquet file of questionnaires, streamed back as NDJSON or CSV"""
+    return await start_upload_stream('behavioral', file, output_format, BEHAVIORAL_FEATURE_NAMES)
+
+
+def score_eye_tracking(data: EyeTrackingData):
+    """Run eye tracking inference, ensemble weighting and explanation (CPU-bound)"""
+    return score_eye_tracking_features(eye_tracking_feature_matrix([data]))[0]
+
 @app.post("/api/assessment/eye_tracking")
+@metrics.traced
 async def assess_eye_tracking(data: EyeTrackingData):
     """Stage 2: Eye Tracking Assessment with PSO optimization"""
     try:
         if 'eye_tracking_rf' not in models:
             raise HTTPException(status_code=501, detail="Eye tracking models not available")
         
-        # Prepare features
-        features = np.array([[
-            data.fixation_count, data.mean_saccade, data.max_saccade, data.std_saccade,
-            data.mean_x, data.mean_y, data.std_x, data.std_y, data.mean_pupil
-        ]])
-        
-        # Scale features
-        features_scaled = scalers['eye_tracking'].transform(features)
-        
-        # Make base predictions
-        rf_pred = models['eye_tracking_rf'].predict_proba(features_scaled)[0]
-        svm_pred = models['eye_tracking_svm'].predict_proba(features_scaled)[0]
-        
-        # Use PSO for optimal ensemble weighting
-        pso = PSO(n_particles=15, n_iterations=30)
-        base_predictions = [rf_pred[1], svm_pred[1]]  # Probability of ASD class
-        
-        optimal_weights, pso_score = pso.optimize_prediction(base_predictions)
-        
-        # PSO-optimized ensemble prediction
-        pso_prob = np.average(base_predictions, weights=optimal_weights)
-        pso_pred = 1 if pso_prob > 0.5 else 0
-        
-        # Feature importance analysis
-        feature_importance = models['eye_tracking_rf'].feature_importances_
-        feature_names = ['fixation_count', 'mean_saccade', 'max_saccade', 'std_saccade',
-                        'mean_x', 'mean_y', 'std_x', 'std_y', 'mean_pupil']
-        
-        top_features = {}
-        feature_values = features[0]
-        for i, (name, importance) in enumerate(zip(feature_names, feature_importance)):
-            if importance > 0.05:
-                top_features[name] = {
-                    'importance': float(importance),
-                    'value': float(feature_values[i]),
-                    'description': get_eye_tracking_description(name)
-                }
-        
-        # Generate explanation
-        explanation = generate_eye_tracking_explanation(pso_pred, pso_prob, top_features)
-        
-        result = {
-            'prediction': int(pso_pred),
-            'probability': float(pso_prob),
-            'confidence': float(pso_score),
-            'model_results': {
-                'random_forest': {'probability': float(rf_pred[1]), 'prediction': int(rf_pred[1] > 0.5)},
-                'svm': {'probability': float(svm_pred[1]), 'prediction': int(svm_pred[1] > 0.5)},
-                'pso': {'probability': float(pso_prob), 'prediction': int(pso_pred), 'weights': optimal_weights.tolist()}
-            },
-            'explanation': explanation,
-            'stage': 'eye_tracking', 
-            'timestamp': datetime.now().isoformat()
-        }
+        result = await cached_stage_result('eye_tracking', data, lambda: eye_tracking_batcher.submit(eye_tracking_feature_matrix([data])[0]))
         
         # Store result in database
-        await db.assessments.insert_one({
-            'stage': 'eye_tracking',
-            'data': data.dict(),
-            'result': result,
-            'timestamp': datetime.now()
-        })
+        await store_stage_results('eye_tracking', [(data.session_id, assessment_input(data), result)])
         
         return result
         
@@ -508,50 +812,22 @@ async def assess_eye_tracking(data: EyeTrackingData):
         logger.error(f"Eye tracking assessment error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Assessment failed: {str(e)}")
 
+@app.post("/api/assessment/eye_tracking/upload")
+async def assess_eye_tracking_upload(file: UploadFile = File(...), output_format: str = Query('ndjson', alias='format')):
+    """Stage 2 for a CSV/Parquet file of gaze features, streamed back as NDJSON or CSV"""
+    if 'eye_tracking_rf' not in models:
+        raise HTTPException(status_code=501, detail="Eye tracking models not available")
+    return await start_upload_stream('eye_tracking', file, output_format, EYE_TRACKING_FEATURE_NAMES)
+
 @app.post("/api/assessment/facial_analysis")
+@metrics.traced
 async def assess_facial_analysis(data: FacialAnalysisData):
     """Stage 3: Facial Analysis Assessment"""
     try:
-        # For now, return a mock result since CNN training would need more setup
-        # In a full implementation, this would use the trained CNN model
-        
-        # Simple analysis based on facial features
-        feature_mean = np.mean(data.facial_features) if data.facial_features else 0.5
-        
-        # Mock prediction based on attention patterns and emotions
-        attention_score = data.attention_patterns.get('attention_to_faces', 0.5)
-        emotion_variability = np.std(list(data.emotion_scores.values())) if data.emotion_scores else 0.5
-        
-        # Combine features for prediction
-        combined_score = (feature_mean * 0.4 + attention_score * 0.4 + emotion_variability * 0.2)
-        prediction = 1 if combined_score > 0.6 else 0
-        
-        explanation = {
-            'summary': f"Facial analysis {'indicates' if prediction else 'does not indicate'} ASD patterns",
-            'key_factors': {
-                'attention_to_faces': attention_score,
-                'emotion_variability': emotion_variability,
-                'facial_features_score': feature_mean
-            },
-            'interpretation': generate_facial_explanation(prediction, combined_score, data)
-        }
-        
-        result = {
-            'prediction': int(prediction),
-            'probability': float(combined_score),
-            'confidence': float(abs(combined_score - 0.5) * 2),
-            'explanation': explanation,
-            'stage': 'facial_analysis',
-            'timestamp': datetime.now().isoformat()
-        }
+        result = await cached_stage_result('facial_analysis', data, lambda: inference_executor.run(score_facial_analysis, assessment_input(data)))
         
         # Store result in database
-        await db.assessments.insert_one({
-            'stage': 'facial_analysis',
-            'data': data.dict(),
-            'result': result,
-            'timestamp': datetime.now()
-        })
+        await store_stage_results('facial_analysis', [(data.session_id, assessment_input(data), result)])
         
         return result
         
@@ -559,48 +835,51 @@ async def assess_facial_analysis(data: FacialAnalysisData):
         logger.error(f"Facial analysis assessment error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Assessment failed: {str(e)}")
 
+# Request coalescing for the single-record model endpoints (MICRO_BATCH_MAX_SIZE=1 disables it)
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 32))
+MICRO_BATCH_WINDOW_MS = float(os.environ.get('MICRO_BATCH_WINDOW_MS', 2))
+
+behavioral_batcher = MicroBatcher(score_behavioral_features, inference_executor, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_WINDOW_MS)
+eye_tracking_batcher = MicroBatcher(score_eye_tracking_features, inference_executor, MICRO_BATCH_MAX_SIZE, MICRO_BATCH_WINDOW_MS)
+
 class CompleteAssessmentRequest(BaseModel):
     """Request model for complete assessment"""
     session_id: str
 
 @app.post("/api/assessment/complete")
+@metrics.traced
 async def complete_assessment(request: CompleteAssessmentRequest):
     """Generate final assessment combining all stages"""
     try:
         session_id = request.session_id
         
-        # For demo purposes, create a mock final result since we're having DB serialization issues
-        # In production, this would properly retrieve and combine all stage results
-        
-        # Get the latest results from each stage for demo
-        try:
-            behavioral = await db.assessments.find_one({'stage': 'behavioral'}, sort=[('timestamp', -1)])
-            eye_tracking = await db.assessments.find_one({'stage': 'eye_tracking'}, sort=[('timestamp', -1)])
-            facial = await db.assessments.find_one({'stage': 'facial_analysis'}, sort=[('timestamp', -1)])
-        except Exception as db_error:
-            logger.warning(f"Database retrieval error: {db_error}")
-            behavioral = eye_tracking = facial = None
-        
-        # Create mock stage results for demo
-        stage_results = {}
-        if behavioral:
-            stage_results['behavioral'] = {
-                'prediction': behavioral['result']['prediction'],
-                'probability': behavioral['result']['probability'],
-                'confidence': behavioral['result']['confidence']
-            }
-        if eye_tracking:
-            stage_results['eye_tracking'] = {
-                'prediction': eye_tracking['result']['prediction'],
-                'probability': eye_tracking['result']['probability'],
-                'confidence': eye_tracking['result']['confidence']
-            }
-        if facial:
-            stage_results['facial_analysis'] = {
-                'prediction': facial['result']['prediction'],
-                'probability': facial['result']['probability'],
-                'confidence': facial['result']['confidence']
-            }
+        # Sessions whose every stage was written by this process are fused straight from memory
+        summaries, written = session_store.get(session_id)
+        if not session_store.is_whole(summaries):
+            # Otherwise the session document holds the latest result of every stage,
+            # including stages other workers wrote
+            try:
+                with phase('db_read'):
+                    # This session's stage results may still be in the write-behind buffer
+                    await session_writer.flush_key(session_id)
+                    # Only the fused fields, from compact entries or full results
+                    session = await repository.get_session(session_id, [
+                        f'stages.{stage}.{prefix}{field}'
+                        for stage in ASSESSMENT_STAGES for prefix in ('', 'result.') for field in STAGE_SUMMARY_FIELDS
+                    ] + [f'stages.{stage}.timestamp' for stage in ASSESSMENT_STAGES])
+                    if session is not None:
+                        latest = session.get('stages', {})
+                    else:
+                        latest = await repository.latest_stage_documents(session_id, ASSESSMENT_STAGES)
+            except Exception as db_error:
+                if not isinstance(db_error, CircuitOpenError):
+                    logger.warning(f"Database retrieval error: {db_error}")
+                # Fusing only the stages this process holds would report a made-up result
+                raise HTTPException(status_code=503, detail="Database unavailable, retry the assessment later",
+                                    headers={'Retry-After': str(math.ceil(DB_BREAKER_RESET_SECONDS))})
+            summaries = merge_stored(summaries, written, latest)
+        
+        stage_results = {stage: summaries[stage] for stage in ASSESSMENT_STAGES if stage in summaries}
         
         # Calculate final prediction with weights
         stage_weights = {'behavioral': 0.6, 'eye_tracking': 0.25, 'facial_analysis': 0.15}
@@ -654,95 +933,24 @@ async def complete_assessment(request: CompleteAssessmentRequest):
             'stages_completed': len(stage_results)
         }
         
+        # Store the fused result in the same session document
+        if stage_results:
+            now = datetime.now()
+            update = {'final_result': final_result, 'completed_at': now}
+            trace_id = metrics.current_trace_id()
+            if trace_id is not None:
+                update['completed_trace_id'] = trace_id
+            with phase('db_write'):
+                await session_writer.put((session_id, update))
+        
         return final_result
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Complete assessment error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Assessment failed: {str(e)}")
 
-def generate_behavioral_explanation(prediction, probability, top_features):
-    """Generate explanation for behavioral assessment"""
-    result_text = "indicates ASD patterns" if prediction else "does not indicate ASD patterns"
-    confidence_text = "high" if probability > 0.8 or probability < 0.2 else "moderate"
-    
-    explanation = {
-        'summary': f"Behavioral assessment {result_text} with {confidence_text} confidence",
-        'key_indicators': [],
-        'feature_analysis': top_features,
-        'recommendations': []
-    }
-    
-    # Analyze key features
-    if 'A6_Score' in top_features and top_features['A6_Score']['value'] == 1:
-        explanation['key_indicators'].append("Sensory sensitivity patterns detected")
-    
-    if 'A9_Score' in top_features and top_features['A9_Score']['value'] == 1:
-        explanation['key_indicators'].append("Behavioral flexibility concerns noted")
-    
-    if 'A5_Score' in top_features and top_features['A5_Score']['value'] == 1:
-        explanation['key_indicators'].append("Attention to detail patterns observed")
-    
-    # Add recommendations
-    if prediction:
-        explanation['recommendations'] = [
-            "Consider comprehensive diagnostic evaluation",
-            "Proceed with eye tracking and facial analysis",
-            "Consult with autism specialist"
-        ]
-    else:
-        explanation['recommendations'] = [
-            "Continue with additional assessments for complete evaluation",
-            "Monitor development patterns over time"
-        ]
-    
-    return explanation
-
-def generate_eye_tracking_explanation(prediction, probability, top_features):
-    """Generate explanation for eye tracking assessment"""
-    result_text = "suggests ASD patterns" if prediction else "does not suggest ASD patterns"
-    
-    explanation = {
-        'summary': f"Eye tracking analysis {result_text}",
-        'gaze_patterns': {},
-        'feature_analysis': top_features,
-        'clinical_significance': []
-    }
-    
-    # Analyze gaze patterns
-    if 'std_x' in top_features or 'std_y' in top_features:
-        explanation['gaze_patterns']['spatial_variability'] = "Atypical gaze distribution patterns detected"
-    
-    if 'fixation_count' in top_features:
-        explanation['gaze_patterns']['attention_patterns'] = "Unusual visual attention duration observed"
-    
-    if 'mean_saccade' in top_features:
-        explanation['gaze_patterns']['eye_movements'] = "Atypical saccadic eye movement patterns"
-    
-    # Clinical significance
-    explanation['clinical_significance'] = [
-        "Eye tracking provides objective measures of visual attention",
-        "Gaze patterns can indicate social attention differences",
-        "Results should be interpreted alongside other assessments"
-    ]
-    
-    return explanation
-
-def generate_facial_explanation(prediction, score, data):
-    """Generate explanation for facial analysis"""
-    explanation = []
-    
-    if data.attention_patterns.get('attention_to_faces', 0) < 0.5:
-        explanation.append("Reduced attention to facial regions detected")
-    
-    if len(data.emotion_scores) > 0:
-        dominant_emotion = max(data.emotion_scores, key=data.emotion_scores.get)
-        explanation.append(f"Dominant emotional expression: {dominant_emotion}")
-    
-    if not explanation:
-        explanation.append("Facial analysis completed with standard patterns")
-    
-    return explanation
-
 def generate_comprehensive_explanation(prediction, probability, stage_results):
     """Generate comprehensive explanation combining all stages"""
     result_text = "indicates ASD" if prediction else "does not indicate ASD"
@@ -806,18 +1014,7 @@ def generate_comprehensive_explanation(prediction, probability, stage_results):
 
 def get_eye_tracking_description(feature_name):
     """Get description for eye tracking features"""
-    descriptions = {
-        'fixation_count': 'Number of visual fixations - indicates attention patterns',
-        'mean_saccade': 'Average saccadic eye movement - relates to visual scanning',
-        'max_saccade': 'Maximum saccadic movement - indicates eye movement range',
-        'std_saccade': 'Saccadic movement variability - shows consistency patterns',
-        'mean_x': 'Average horizontal gaze position - indicates gaze centering',
-        'mean_y': 'Average vertical gaze position - indicates gaze height preference',
-        'std_x': 'Horizontal gaze variability - shows scanning patterns',
-        'std_y': 'Vertical gaze variability - indicates vertical attention spread',
-        'mean_pupil': 'Average pupil diameter - relates to arousal and attention'
-    }
-    return descriptions.get(feature_name, 'Eye tracking measurement')
+    return EYE_TRACKING_DESCRIPTIONS.get(feature_name, 'Eye tracking measurement')
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,203 @@
+"""
+Fused StandardScaler + RBF-SVM inference path
+
+Folds the scaler into the support vectors once, computes the RBF kernel for a
+whole batch with a single matrix product and applies the stored Platt sigmoid
+and libsvm's probability coupling, replacing scaler.transform + SVC.predict_proba (libsvm) on the request path.
+
+Usage:
+    python svm_engine.py benchmark [--model-dir models]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# Platt probabilities are clipped like libsvm does
+MIN_PROBABILITY = 1e-7
+
+# Largest allowed difference from the sklearn path before falling back to it
+PARITY_TOLERANCE = 1e-9
+
+def pairwise_coupling(r):
+    """libsvm's multiclass_probability for two classes, vectorized over rows
+
+    sklearn's bundled libsvm runs this iterative solver (stopping at
+    eps = 0.005 / k) even for binary problems instead of returning the
+    sigmoid directly, so it is replayed step for step to match its output.
+    r is P(first class) from the Platt sigmoid; returns that class's final
+    probability.
+    """
+    a = r
+    b = 1 - r
+    q00, q11, q01 = b * b, a * a, -b * a
+    p0 = np.full_like(r, 0.5)
+    p1 = np.full_like(r, 0.5)
+    active = np.ones(r.shape, dtype=bool)
+    eps = 0.005 / 2
+
+    for _ in range(100):
+        qp0 = q00 * p0 + q01 * p1
+        qp1 = q01 * p0 + q11 * p1
+        pqp = p0 * qp0 + p1 * qp1
+        max_error = np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp))
+        active &= ~(max_error < eps)
+        if not active.any():
+            break
+
+        # t = 0
+        diff = (-qp0 + pqp) / q00
+        n_p0 = p0 + diff
+        n_pqp = (pqp + diff * (diff * q00 + 2 * qp0)) / (1 + diff) / (1 + diff)
+        n_qp1 = (qp1 + diff * q01) / (1 + diff)
+        n_p0 = n_p0 / (1 + diff)
+        n_p1 = p1 / (1 + diff)
+        # t = 1
+        diff = (-n_qp1 + n_pqp) / q11
+        n_p1 = n_p1 + diff
+        n_p0 = n_p0 / (1 + diff)
+        n_p1 = n_p1 / (1 + diff)
+
+        p0 = np.where(active, n_p0, p0)
+        p1 = np.where(active, n_p1, p1)
+    return p0
+
+class FusedRBFSVM:
+    """StandardScaler + binary RBF SVC with Platt scaling as plain NumPy
+
+    For raw features x, the scaled point is s = (x - mean) / scale and
+
+        ||s - sv||^2 = ||s||^2 - 2 x.(sv / scale) + (||sv||^2 + 2 (mean / scale).sv)
+
+    so the support vectors divided by scale and the bracketed per-vector
+    term are precomputed, and the kernel for a batch is one matrix product.
+    """
+
+    def __init__(self, mean, scale, support_vectors, gamma, dual_coef, intercept, prob_a, prob_b, classes):
+        self.mean = mean
+        self.scale = scale
+        self.gamma = gamma
+        self.dual_coef = dual_coef
+        self.intercept = intercept
+        self.prob_a = prob_a
+        self.prob_b = prob_b
+        self.classes_ = classes
+        self.n_features_in_ = support_vectors.shape[1]
+
+        self.folded_vectors = support_vectors / scale
+        self.vector_bias = (support_vectors ** 2).sum(axis=1) + 2 * (support_vectors @ (mean / scale))
+
+    @classmethod
+    def from_sklearn(cls, scaler, svm):
+        """Build from a fitted StandardScaler and SVC(kernel='rbf', probability=True)"""
+        if svm.kernel != 'rbf':
+            raise ValueError(f"Only the RBF kernel is supported, got '{svm.kernel}'")
+        if len(svm.classes_) != 2:
+            raise ValueError("Only binary classifiers are supported")
+        if not getattr(svm, 'probability', False) or len(svm.probA_) == 0:
+            raise ValueError("SVC was not fitted with probability=True")
+
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(svm.n_features_in_)
+        scale = scaler.scale_ if scaler.with_std else np.ones(svm.n_features_in_)
+        # libsvm's own sign convention: sklearn flips dual_coef_/intercept_
+        # for binary problems, but probA_/probB_ apply to the raw value
+        return cls(
+            mean=np.asarray(mean, dtype=np.float64),
+            scale=np.asarray(scale, dtype=np.float64),
+            support_vectors=np.asarray(svm.support_vectors_, dtype=np.float64),
+            gamma=float(svm._gamma),
+            dual_coef=np.asarray(svm._dual_coef_[0], dtype=np.float64),
+            intercept=float(svm._intercept_[0]),
+            prob_a=float(svm.probA_[0]),
+            prob_b=float(svm.probB_[0]),
+            classes=np.asarray(svm.classes_)
+        )
+
+    def decision_values(self, X):
+        """Raw libsvm decision values for unscaled features"""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected input with {self.n_features_in_} features, got shape {X.shape}")
+        scaled_norms = (((X - self.mean) / self.scale) ** 2).sum(axis=1)
+        sq_dist = scaled_norms[:, np.newaxis] - 2 * (X @ self.folded_vectors.T) + self.vector_bias
+        np.maximum(sq_dist, 0, out=sq_dist)
+        kernel = np.exp(-self.gamma * sq_dist)
+        return kernel @ self.dual_coef + self.intercept
+
+    def predict_proba(self, X):
+        """Class probabilities for unscaled features, shape (n_samples, 2)"""
+        f_ap_b = self.decision_values(X) * self.prob_a + self.prob_b
+        # Numerically stable sigmoid, same branches as libsvm's sigmoid_predict
+        exp_term = np.exp(-np.abs(f_ap_b))
+        p_first = np.where(f_ap_b >= 0, exp_term / (1 + exp_term), 1 / (1 + exp_term))
+        p_first = np.clip(p_first, MIN_PROBABILITY, 1 - MIN_PROBABILITY)
+        p_first = pairwise_coupling(p_first)
+        return np.column_stack([p_first, 1 - p_first])
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def parity_error(fused, scaler, svm, X):
+    """Largest absolute probability difference from the sklearn path"""
+    return float(np.max(np.abs(fused.predict_proba(X) - svm.predict_proba(scaler.transform(X)))))
+
+def build_fused_svm(scaler, svm, check_rows=500):
+    """Fuse scaler + svm and verify it against the sklearn path on random rows"""
+    fused = FusedRBFSVM.from_sklearn(scaler, svm)
+    X = scaler.inverse_transform(np.random.RandomState(0).normal(scale=2.0, size=(check_rows, fused.n_features_in_)))
+    error = parity_error(fused, scaler, svm, X)
+    if error > PARITY_TOLERANCE:
+        raise RuntimeError(f"Fused SVM differs from sklearn by {error:.2e}")
+    return fused
+
+def benchmark(name, scaler, svm, batch_sizes=(1, 10, 100, 1000, 10000), repeats=20):
+    """Print parity and timings of the fused path against scaler + SVC"""
+    fused = FusedRBFSVM.from_sklearn(scaler, svm)
+    rng = np.random.RandomState(0)
+    # Raw-feature rows around the training distribution
+    X_all = scaler.inverse_transform(rng.normal(scale=1.5, size=(max(batch_sizes), fused.n_features_in_)))
+
+    print(f"\n{name}: {len(svm.support_vectors_)} support vectors, {fused.n_features_in_} features")
+    print(f"{'batch':>8} {'max |diff|':>12} {'sklearn ms':>12} {'fused ms':>10} {'speedup':>8}")
+    for size in batch_sizes:
+        X = X_all[:size]
+        n = max(1, repeats if size < 1000 else repeats // 4)
+
+        start = time.perf_counter()
+        for _ in range(n):
+            svm.predict_proba(scaler.transform(X))
+        sklearn_ms = (time.perf_counter() - start) / n * 1000
+
+        start = time.perf_counter()
+        for _ in range(n):
+            fused.predict_proba(X)
+        fused_ms = (time.perf_counter() - start) / n * 1000
+
+        print(f"{size:>8} {parity_error(fused, scaler, svm, X):>12.2e} {sklearn_ms:>12.3f} "
+              f"{fused_ms:>10.3f} {sklearn_ms / fused_ms:>7.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the fused scaler + RBF-SVM path against sklearn")
+    parser.add_argument('command', choices=['benchmark'])
+    parser.add_argument('--model-dir', default=os.environ.get(
+        'MODEL_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'models')))
+    args = parser.parse_args()
+
+    import joblib
+
+    for stage in ('behavioral', 'eye_tracking'):
+        svm_path = os.path.join(args.model_dir, f'{stage}_svm_model.joblib')
+        scaler_path = os.path.join(args.model_dir, f'{stage}_scaler.joblib')
+        if not (os.path.exists(svm_path) and os.path.exists(scaler_path)):
+            continue
+        try:
+            benchmark(stage, joblib.load(scaler_path), joblib.load(svm_path))
+        except Exception as e:
+            print(f"\n{stage}: benchmark failed: {e}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,425 @@
+"""
+Circuit breaker and local write-ahead log for assessment persistence
+
+GuardedRepository wraps an AssessmentRepository. While the database keeps
+failing, the circuit breaker opens: writes go to an append-only log file on
+local disk instead, and reads fail fast rather than waiting on timeouts.
+A background replayer drains the log into the database with bulk writes
+once it answers again. While anything is left in the log, new writes are
+appended behind it, so replayed session updates never overwrite newer ones.
+
+Log records are JSON lines of {"method": ..., "items": [...]}, encoded like
+the SQLite backend's documents. The active log is renamed to <path>.replaying
+before it is replayed, so new records never mix with a replay in progress,
+and the number of records already written is checkpointed in
+<path>.replaying.done so a restart resumes where the replay stopped.
+Log file I/O (including fsync) runs on one dedicated thread, in the order
+it was issued, so the event loop never waits on the disk.
+
+A log belongs to one process: it holds an exclusive lock on <path>.lock
+while open, and claim_write_ahead_log gives each process of a multi-worker
+server the first log of a numbered series that no other process holds.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from assessment_store import AssessmentRepository, PartialWriteError, decode_document, encode_document
+
+logger = logging.getLogger(__name__)
+
+# Repository write methods that can be logged and replayed
+LOGGED_METHODS = ('insert_assessments', 'update_sessions')
+
+class CircuitOpenError(Exception):
+    """The database is considered down; the call was not attempted"""
+
+class WriteAheadLogLocked(Exception):
+    """Another process holds the write-ahead log"""
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures
+
+    While open, calls are refused for reset_timeout seconds; then a single
+    trial call is let through (half-open), which closes the breaker on
+    success or reopens it on failure.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self.failures = 0
+        self.opens = 0
+        self.refused = 0
+
+    def allow(self):
+        """Whether a call may go to the database now"""
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+        if self.state == 'closed':
+            return True
+        if self.state == 'half_open' and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self.refused += 1
+        return False
+
+    def record_success(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def release(self):
+        """Give back a half-open trial call that was not made"""
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.opens += 1
+                logger.warning(f"Database circuit breaker opened after {self.consecutive_failures} failure(s)")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'failure_threshold': self.failure_threshold,
+            'reset_timeout_seconds': self.reset_timeout,
+            'failures': self.failures,
+            'opens': self.opens,
+            'refused': self.refused
+        }
+
+class WriteAheadLog:
+    """Append-only JSON-lines log of repository writes on local disk
+
+    Whether anything is pending is tracked in memory: set as soon as an
+    append is issued, cleared when a replay finishes with nothing appended
+    behind it. The coroutine methods run their file work on the log's
+    writer thread.
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.replaying_path = path + '.replaying'
+        self.progress_path = path + '.replaying.done'
+        self.fsync = fsync
+        self.appended = 0
+        self._done = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(path + '.lock', 'a+')
+        if not _try_lock(self._lock_file):
+            self._lock_file.close()
+            raise WriteAheadLogLocked(f"Write-ahead log {path} is in use by another process")
+        self.pending = os.path.exists(self.replaying_path) or self._active_size() > 0
+        # Appends issued so far, so a replay finishing meanwhile leaves pending set
+        self._issued = 0
+        # One thread keeps the file operations in the order they were issued
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='write-ahead-log')
+
+    async def _in_writer(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def append(self, method, items):
+        line = encode_document({'method': method, 'items': items}) + '\n'
+        # Later writes queue behind this one from now on, not once it is on disk
+        self.pending = True
+        self._issued += 1
+        await self._in_writer(self._append_line, line)
+        self.appended += len(items)
+
+    def _append_line(self, line):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _active_size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def has_pending(self):
+        return self.pending
+
+    async def take(self):
+        """Records to replay: an unfinished earlier replay, else the active log (rotated out)"""
+        return await self._in_writer(self._take)
+
+    def _take(self):
+        if not os.path.exists(self.replaying_path):
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                return []
+            self._write_progress(0)
+            os.replace(self.path, self.replaying_path)
+        self._done = 0
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path) as f:
+                self._done = int(f.read().strip() or 0)
+        return self._read(self.replaying_path)[self._done:]
+
+    async def mark_done(self, count):
+        """Checkpoint that the next count records taken have been written"""
+        await self._in_writer(lambda: self._write_progress(self._done + count))
+
+    def _write_progress(self, done):
+        with open(self.progress_path, 'w') as f:
+            f.write(str(done))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._done = done
+
+    def _read(self, path):
+        records = []
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = decode_document(line)
+                except json.JSONDecodeError:
+                    # Only the last line can be torn by a crash mid-append
+                    logger.warning(f"Skipping unreadable write-ahead log line {line_number} in {path}")
+                    continue
+                if record.get('method') in LOGGED_METHODS:
+                    records.append(record)
+        return records
+
+    async def keep(self, records):
+        """Replace the replaying file with the records still to be written"""
+        await self._in_writer(self._keep, records)
+
+    def _keep(self, records):
+        temporary = self.replaying_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(encode_document(record) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        # A crash between the two steps replays some records twice, never skips any
+        self._write_progress(0)
+        os.replace(temporary, self.replaying_path)
+
+    async def finish(self):
+        """The replaying file has been written out completely"""
+        issued = self._issued
+        active_size = await self._in_writer(self._finish)
+        # Appends issued before finish() ran first and are in active_size
+        self.pending = active_size > 0 or self._issued != issued
+
+    def _finish(self):
+        for path in (self.replaying_path, self.progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return self._active_size()
+
+    def stats(self):
+        sizes = [os.path.getsize(p) for p in (self.path, self.replaying_path) if os.path.exists(p)]
+        return {
+            'path': self.path,
+            'pending_bytes': sum(sizes),
+            'appended': self.appended
+        }
+
+    def close(self):
+        """Wait for issued file work, then let another process claim the log"""
+        self._executor.shutdown(wait=True)
+        self._lock_file.close()
+
+def _try_lock(f):
+    """Take an exclusive lock on an open file without blocking; False if it is held"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+def claim_write_ahead_log(path, fsync=True, max_logs=64):
+    """Open the first of path, <stem>.1<ext>, <stem>.2<ext>, ... not held by another process
+    
+    A restarted process claims a log its predecessor left behind and
+    replays it.
+    """
+    stem, ext = os.path.splitext(path)
+    for n in range(max_logs):
+        try:
+            return WriteAheadLog(f'{stem}.{n}{ext}' if n else path, fsync=fsync)
+        except WriteAheadLogLocked:
+            continue
+    raise WriteAheadLogLocked(f"All {max_logs} write-ahead logs at {path} are in use")
+
+class GuardedRepository(AssessmentRepository):
+    """Repository behind a circuit breaker, writing to a local log while it is down"""
+
+    def __init__(self, repository, breaker, log, replay_interval=5, replay_batch=500):
+        self.repository = repository
+        self.name = repository.name
+        self.breaker = breaker
+        self.log = log
+        self.replay_interval = replay_interval
+        self.replay_batch = replay_batch
+        self._task = None
+        # Serializes the background replay with replays run ahead of reads
+        self._replay_lock = asyncio.Lock()
+        self.logged_writes = 0
+        self.replayed = 0
+
+    async def _write(self, method, items):
+        # Queue behind anything still in the log so writes stay in order
+        if not self.log.has_pending() and self.breaker.allow():
+            try:
+                await getattr(self.repository, method)(items)
+                self.breaker.record_success()
+                return
+            except PartialWriteError:
+                # The database answered; the rejected items are retried by the caller
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                logger.warning(f"{method} failed, writing {len(items)} item(s) to the write-ahead log: {str(e)}")
+        if method == 'insert_assessments':
+            # Fixed ids make a replay interrupted before its checkpoint idempotent on MongoDB
+            for document in items:
+                document.setdefault('_id', ObjectId())
+        await self.log.append(method, items)
+        self.logged_writes += 1
+
+    async def insert_assessments(self, documents):
+        await self._write('insert_assessments', documents)
+
+    async def update_sessions(self, updates):
+        await self._write('update_sessions', updates)
+
+    async def _read(self, method, *args):
+        # Logged writes are not in the database yet; reading past them would return stale data
+        if self.log.has_pending() and not await self.replay():
+            raise CircuitOpenError("Write-ahead log not replayed yet")
+        return await self._call(method, *args)
+
+    async def _call(self, method, *args):
+        if not self.breaker.allow():
+            raise CircuitOpenError("Database circuit breaker is open")
+        try:
+            result = await getattr(self.repository, method)(*args)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    async def get_session(self, session_id, fields=None):
+        return await self._read('get_session', session_id, fields)
+
+    async def latest_stage_documents(self, session_id, stages):
+        return await self._read('latest_stage_documents', session_id, stages)
+
+    async def recent_stage_results(self, stages, limit):
+        return await self._read('recent_stage_results', stages, limit)
+
+    async def ensure_indexes(self):
+        await self._call('ensure_indexes')
+
+    async def replay(self):
+        """Write logged records to the database in bulk; True once the log is empty"""
+        async with self._replay_lock:
+            return await self._replay()
+
+    async def _replay(self):
+        while self.log.has_pending():
+            if not self.breaker.allow():
+                return False
+            records = await self.log.take()
+            if not records:
+                # No database call to settle a half-open trial with
+                self.breaker.release()
+            while records:
+                # Consecutive records of one method go out as one bulk write
+                method, batch, used = records[0]['method'], [], 0
+                limit = max(self.replay_batch, len(records[0]['items']))
+                while (used < len(records) and records[used]['method'] == method
+                       and len(batch) + len(records[used]['items']) <= limit):
+                    batch.extend(records[used]['items'])
+                    used += 1
+                try:
+                    await getattr(self.repository, method)(batch)
+                except PartialWriteError as e:
+                    self.breaker.record_success()
+                    self.replayed += len(batch) - len(e.unwritten)
+                    await self.log.keep([{'method': method, 'items': e.unwritten}] + records[used:])
+                    logger.error(f"Write-ahead log replay: {len(e.unwritten)} {method} item(s) rejected, kept in the log")
+                    return False
+                except Exception as e:
+                    self.breaker.record_failure()
+                    logger.warning(f"Write-ahead log replay paused, {len(records)} record(s) left: {str(e)}")
+                    return False
+                self.breaker.record_success()
+                await self.log.mark_done(used)
+                self.replayed += len(batch)
+                records = records[used:]
+            await self.log.finish()
+        return True
+
+    async def _run(self):
+        while True:
+            if self.log.has_pending():
+                try:
+                    if await self.replay():
+                        logger.info(f"Write-ahead log drained, {self.replayed} item(s) replayed so far")
+                except Exception as e:
+                    logger.error(f"Write-ahead log replay failed: {str(e)}")
+            await asyncio.sleep(self.replay_interval)
+
+    async def start(self):
+        await self.repository.start()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Last chance to drain; anything left stays on disk for the next start
+        if self.log.has_pending():
+            try:
+                await self.replay()
+            except Exception as e:
+                logger.error(f"Write-ahead log replay on shutdown failed: {str(e)}")
+        self.log.close()
+        await self.repository.close()
+
+    def stats(self):
+        return {
+            **self.repository.stats(),
+            'circuit_breaker': self.breaker.stats(),
+            'write_ahead_log': {**self.log.stats(), 'logged_writes': self.logged_writes, 'replayed': self.replayed}
+        }
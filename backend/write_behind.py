@@ -0,0 +1,209 @@
+"""
+Write-behind buffering of repository writes
+
+Used by server.py so assessment endpoints return without waiting for the
+database: writes are queued in memory and flushed in batches by a
+background task.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+import metrics
+from assessment_store import PartialWriteError
+
+logger = logging.getLogger(__name__)
+
+# Write-behind flush latency by collection
+db_flush_duration = metrics.Histogram(
+    'asd_db_flush_duration_seconds', 'Duration of write-behind flushes to the database', ['collection'])
+
+class WriteBehindBuffer:
+    """Write-behind buffer for one collection's writes
+    
+    Endpoints hand items to put()/put_many() and return without waiting for
+    the database. A background task passes them to write (a repository write
+    method) once max_batch items are queued or flush_interval has passed,
+    and everything left is flushed on shutdown. Once max_pending items are
+    waiting, put() blocks until a flush makes room (backpressure). Items are
+    written in submission order. With a key function, flush_key() writes out
+    the items of one key (a session) ahead of the rest.
+    """
+    
+    def __init__(self, collection, write, max_batch=500, flush_interval_ms=50, max_pending=10000, key=None):
+        self.collection = collection
+        self.write = write
+        self.key = key
+        # key -> number of buffered items with that key
+        self._key_counts = {}
+        self.max_batch = max(1, max_batch)
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending  # 0 writes through on the request path
+        self._buffer = deque()
+        self._task = None
+        self._wakeup = None
+        self._space = None
+        self._flush_lock = None
+        self._stopping = False
+        self.peak_depth = 0
+        self.enqueued = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.backpressure_waits = 0
+        self.total_flush_time = 0.0
+        self.max_flush_time = 0.0
+        self.last_flush_size = 0
+    
+    def start(self):
+        if self._task is not None or not self.max_pending:
+            return
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        """Stop the background task and write out everything still buffered"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        await self.flush()
+        if self._buffer:
+            logger.error(f"Dropping {len(self._buffer)} buffered {self.collection} write(s) on shutdown")
+    
+    async def put(self, operation):
+        await self.put_many([operation])
+    
+    async def put_many(self, operations):
+        """Queue operations for writing, waiting only while the buffer is full"""
+        if self._task is None:
+            await self.write(operations)
+            return
+        
+        async with self._space:
+            if self._buffer and len(self._buffer) + len(operations) > self.max_pending:
+                self.backpressure_waits += 1
+                await self._space.wait_for(
+                    lambda: not self._buffer or len(self._buffer) + len(operations) <= self.max_pending)
+            self._buffer.extend(operations)
+            self._count_keys(operations, 1)
+        
+        self.enqueued += len(operations)
+        self.peak_depth = max(self.peak_depth, len(self._buffer))
+        if len(self._buffer) >= self.max_batch:
+            self._wakeup.set()
+    
+    async def flush(self):
+        """Write out everything buffered so far (stops early if a write fails)"""
+        while self._buffer:
+            if not await self._write_batch():
+                break
+    
+    async def flush_key(self, key):
+        """Write out the buffered items of one key, leaving other keys' items queued"""
+        if not self._key_counts.get(key):
+            return
+        async with self._flush_lock:
+            batch = [op for op in self._buffer if self.key(op) == key]
+            if not batch:
+                return
+            self._buffer = deque(op for op in self._buffer if self.key(op) != key)
+            self._count_keys(batch, -1)
+            retry = await self._write(batch)
+            self._requeue(retry)
+        
+        async with self._space:
+            self._space.notify_all()
+    
+    def _count_keys(self, operations, sign):
+        if self.key is None:
+            return
+        for op in operations:
+            key = self.key(op)
+            count = self._key_counts.get(key, 0) + sign
+            if count:
+                self._key_counts[key] = count
+            else:
+                del self._key_counts[key]
+    
+    def _requeue(self, retry):
+        if retry:
+            self.failed_flushes += 1
+            self._buffer.extendleft(reversed(retry))
+            self._count_keys(retry, 1)
+    
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer:
+                if not await self._write_batch():
+                    break
+                # A partial batch waits for the next interval
+                if len(self._buffer) < self.max_batch:
+                    break
+    
+    async def _write_batch(self):
+        """Write up to max_batch operations; failed operations go back to the front"""
+        async with self._flush_lock:
+            batch = [self._buffer.popleft() for _ in range(min(self.max_batch, len(self._buffer)))]
+            if not batch:
+                return True
+            self._count_keys(batch, -1)
+            retry = await self._write(batch)
+            self._requeue(retry)
+        
+        async with self._space:
+            self._space.notify_all()
+        return not retry
+    
+    async def _write(self, batch):
+        """Write a batch and update the flush stats; returns the operations to retry"""
+        start = time.perf_counter()
+        retry = []
+        try:
+            await self.write(batch)
+        except PartialWriteError as e:
+            retry = e.unwritten
+            logger.error(f"{self.collection} write-behind flush failed for {len(retry)} of {len(batch)} operations")
+        except Exception as e:
+            retry = batch
+            logger.error(f"{self.collection} write-behind flush failed, {len(batch)} operations kept: {str(e)}")
+        
+        elapsed = time.perf_counter() - start
+        db_flush_duration.observe(elapsed, self.collection)
+        self.flushes += 1
+        self.total_flush_time += elapsed
+        self.max_flush_time = max(self.max_flush_time, elapsed)
+        self.last_flush_size = len(batch)
+        self.written += len(batch) - len(retry)
+        return retry
+    
+    def stats(self):
+        return {
+            'enabled': self._task is not None,
+            'collection': self.collection,
+            'depth': len(self._buffer),
+            'peak_depth': self.peak_depth,
+            'max_pending': self.max_pending,
+            'max_batch': self.max_batch,
+            'flush_interval_ms': self.flush_interval * 1000,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'flushes': self.flushes,
+            'failed_flushes': self.failed_flushes,
+            'backpressure_waits': self.backpressure_waits,
+            'last_flush_size': self.last_flush_size,
+            'avg_flush_ms': self.total_flush_time / self.flushes * 1000 if self.flushes else 0.0,
+            'max_flush_ms': self.max_flush_time * 1000
+        }
@@ -411,7 +411,7 @@ function App() {
         const response = await fetch(`${BACKEND_URL}/api/assessment/behavioral`, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(backendAnswers)
+          body: JSON.stringify({ ...backendAnswers, session_id: sessionId })
         });
         
         console.log('Response status:', response.status);
@@ -810,7 +810,7 @@ function App() {
         const response = await fetch(`${BACKEND_URL}/api/assessment/eye_tracking`, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(eyeTrackingData)
+          body: JSON.stringify({ ...eyeTrackingData, session_id: sessionId })
         });
         
         if (!response.ok) throw new Error('Eye tracking assessment failed');
@@ -1204,7 +1204,7 @@ function App() {
         const response = await fetch(`${BACKEND_URL}/api/assessment/facial_analysis`, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify(facialData)
+          body: JSON.stringify({ ...facialData, session_id: sessionId })
         });
         
         if (!response.ok) throw new Error('Facial analysis failed');
@@ -17,6 +17,7 @@ from sklearn.metrics import classification_report, confusion_matrix, accuracy_sc
 import pyswarms as ps
 import matplotlib.pyplot as plt
 import shap
+from simple_training import fit_ensemble_weights, out_of_fold_probabilities
 
 warnings.filterwarnings('ignore')
 
@@ -134,10 +135,12 @@ class ASDDataProcessor:
 class ASDModelTrainer:
     """ML Model training for ASD detection"""
     
-    def __init__(self):
+    def __init__(self, stage='behavioral'):
+        self.stage = stage  # 'behavioral' or 'eye_tracking', names the ensemble weights file
         self.models = {}
         self.results = {}
         self.feature_names = []
+        self.ensemble_weights = None
         
     def train_random_forest(self, X_train, y_train, X_test, y_test, optimize=True):
         """Train Random Forest model"""
@@ -307,7 +310,7 @@ class ASDModelTrainer:
         
         return best_pos, -best_cost
     
-    def create_ensemble(self, X_test, y_test):
+    def create_ensemble(self, X_train, y_train, X_test, y_test):
         """Create ensemble predictions from all models"""
         print("\n=== Creating Ensemble Model ===")
         
@@ -343,6 +346,14 @@ class ASDModelTrainer:
             'probabilities': ensemble_prob
         }
         
+        # Calibrate ensemble weights for serving on out-of-fold training
+        # predictions; the test split only scores them
+        if len(ensemble_probs) == 2:
+            oof_probs = out_of_fold_probabilities(list(self.models.values()), X_train, y_train)
+            self.ensemble_weights = fit_ensemble_weights(
+                oof_probs, y_train, model_names=list(self.models), holdout=(ensemble_probs, y_test))
+            print(f"Calibrated ensemble weights: {dict(zip(self.ensemble_weights['models'], self.ensemble_weights['weights']))}")
+        
         return ensemble_pred, ensemble_prob
     
     def explain_model_predictions(self, X_train, X_test, model_name='random_forest'):
@@ -403,7 +414,12 @@ class ASDModelTrainer:
         return None
     
     def save_models(self, save_dir='models'):
-        """Save trained models"""
+        """Save trained models
+        
+        The ensemble weights are saved next to the asd_* models they were
+        fitted for, as asd_<stage>_ensemble_weights.joblib. The server does
+        not load them; it serves the simple_training.py models and weights.
+        """
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
         
@@ -411,6 +427,11 @@ class ASDModelTrainer:
             filepath = os.path.join(save_dir, f'asd_{name}_model.joblib')
             joblib.dump(model, filepath)
             print(f"Saved {name} model to {filepath}")
+        
+        if self.ensemble_weights is not None:
+            filepath = os.path.join(save_dir, f'asd_{self.stage}_ensemble_weights.joblib')
+            joblib.dump(self.ensemble_weights, filepath)
+            print(f"Saved ensemble weights to {filepath}")
     
     def print_model_comparison(self):
         """Print comparison of all models"""
@@ -471,7 +492,7 @@ def main():
             print(f"PSO optimization failed: {e}")
         
         # Create ensemble
-        trainer.create_ensemble(X_test, y_test)
+        trainer.create_ensemble(X_train, y_train, X_test, y_test)
         
         # Generate explanations
         trainer.explain_model_predictions(X_train, X_test, 'random_forest')
@@ -502,7 +523,7 @@ def main():
             print(f"Eye tracking test set: {X_test_eye.shape}")
             
             # Create separate trainer for eye tracking
-            eye_trainer = ASDModelTrainer()
+            eye_trainer = ASDModelTrainer(stage='eye_tracking')
             eye_trainer.feature_names = eye_features
             
             # Train models on eye tracking data
@@ -510,7 +531,7 @@ def main():
             eye_trainer.train_svm(X_train_eye, y_train_eye, X_test_eye, y_test_eye, optimize=False)
             
             # Create ensemble
-            eye_trainer.create_ensemble(X_test_eye, y_test_eye)
+            eye_trainer.create_ensemble(X_train_eye, y_train_eye, X_test_eye, y_test_eye)
             
             # Generate explanations
             eye_trainer.explain_model_predictions(X_train_eye, X_test_eye, 'random_forest')
@@ -193,7 +193,10 @@ class PSO:
             weights = np.random.random(len(predictions))
             weights = weights / np.sum(weights)
         
-        # Use PSO to find optimal weights for ensemble
+        # Use PSO to find optimal weights for ensemble.
+        # The whole swarm is held as (n_particles, n_models) arrays so each
+        # iteration is a handful of NumPy operations instead of a Python loop.
+        predictions = np.asarray(predictions, dtype=float)
         n_models = len(predictions)
         particles = np.random.random((self.n_particles, n_models))
         # Normalize weights
@@ -207,33 +210,31 @@ class PSO:
         global_best_score = -np.inf
         
         for iteration in range(min(self.n_iterations, 20)):  # Fewer iterations for speed
-            for i in range(self.n_particles):
-                # Calculate weighted ensemble prediction
-                ensemble_pred = np.average(predictions, weights=particles[i])
-                
-                # Simple fitness: diversity + accuracy proxy
-                score = self._ensemble_fitness(predictions, particles[i], ensemble_pred)
-                
-                if score > personal_best_scores[i]:
-                    personal_best_scores[i] = score
-                    personal_best[i] = particles[i].copy()
-                
-                if score > global_best_score:
-                    global_best_score = score
-                    global_best = particles[i].copy()
+            # Fitness of every particle at once
+            scores = self._swarm_fitness(predictions, particles)
             
-            # Update particles
-            for i in range(self.n_particles):
-                r1, r2 = np.random.random(n_models), np.random.random(n_models)
-                
-                velocities[i] = (self.w * velocities[i] + 
-                               self.c1 * r1 * (personal_best[i] - particles[i]) + 
-                               self.c2 * r2 * (global_best - particles[i]))
-                
-                particles[i] += velocities[i]
-                # Normalize weights
-                particles[i] = np.abs(particles[i])
-                particles[i] = particles[i] / np.sum(particles[i])
+            improved = scores > personal_best_scores
+            personal_best_scores[improved] = scores[improved]
+            personal_best[improved] = particles[improved]
+            
+            best_idx = int(np.argmax(scores))
+            if scores[best_idx] > global_best_score:
+                global_best_score = scores[best_idx]
+                global_best = particles[best_idx].copy()
+            
+            # Draw r1/r2 per particle in the same order as the scalar loop
+            # did, so results under a fixed seed are unchanged
+            r = np.random.random((self.n_particles, 2, n_models))
+            r1, r2 = r[:, 0], r[:, 1]
+            
+            velocities = (self.w * velocities +
+                          self.c1 * r1 * (personal_best - particles) +
+                          self.c2 * r2 * (global_best - particles))
+            
+            particles = particles + velocities
+            # Normalize weights
+            particles = np.abs(particles)
+            particles = particles / particles.sum(axis=1, keepdims=True)
         
         return global_best, global_best_score
     
@@ -243,6 +244,14 @@ class PSO:
         diversity = np.std([pred * weight for pred, weight in zip(predictions, weights)])
         confidence = abs(ensemble_pred - 0.5)  # Distance from uncertainty
         return confidence + 0.1 * diversity
+    
+    def _swarm_fitness(self, predictions, particles):
+        """Vectorized _ensemble_fitness for a (n_particles, n_models) swarm"""
+        weighted = particles * predictions
+        ensemble_preds = weighted.sum(axis=1) / particles.sum(axis=1)
+        diversity = np.std(weighted, axis=1)
+        confidence = np.abs(ensemble_preds - 0.5)
+        return confidence + 0.1 * diversity
 
 class BehavioralAssessment(BaseModel):
     """Behavioral questionnaire data"""
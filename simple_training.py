@@ -6,17 +6,81 @@ import pandas as pd
 import numpy as np
 import warnings
 import os
+import hashlib
 import joblib
 from datetime import datetime
-from sklearn.model_selection import train_test_split
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold, cross_val_predict, train_test_split
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.svm import SVC
-from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, roc_auc_score
+from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, roc_auc_score, log_loss
 import matplotlib.pyplot as plt
 
 warnings.filterwarnings('ignore')
 
+# Bump when the layout of the ensemble weights artifact changes
+ENSEMBLE_WEIGHTS_VERSION = 2
+
+def model_fingerprints(stage, save_dir='models'):
+    """sha256 of the saved model and scaler files the stage's ensemble weights were fitted for
+    
+    The server ignores the weights when the files it serves no longer match.
+    """
+    fingerprints = {}
+    for name, suffix in (('random_forest', 'rf_model'), ('svm', 'svm_model'), ('scaler', 'scaler')):
+        with open(os.path.join(save_dir, f'{stage}_{suffix}.joblib'), 'rb') as f:
+            fingerprints[name] = hashlib.sha256(f.read()).hexdigest()
+    return fingerprints
+
+def out_of_fold_probabilities(models, X, y, folds=5):
+    """ASD-class probabilities of each model for its training data, by cross-validation
+    
+    Every row is predicted by a clone of the model fitted without it, so
+    ensemble weights can be fitted on the training split and the test split
+    stays unseen for evaluation.
+    """
+    folds = min(folds, int(np.unique(y, return_counts=True)[1].min()))
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=42)
+    return [cross_val_predict(clone(model), X, y, cv=cv, method='predict_proba')[:, 1] for model in models]
+
+def fit_ensemble_weights(base_probs, y_true, model_names=('random_forest', 'svm'), steps=101, holdout=None):
+    """Fit ensemble weights for two base models on out-of-fold predictions
+    
+    Searches the weight simplex on a grid and keeps the weights with the
+    lowest log loss of the weighted ASD probability. base_probs must not
+    come from the evaluation data; holdout=(base_probs, y_true) of the test
+    split is only used to report the fitted weights' accuracy.
+    """
+    def ensemble_log_loss(probs, y, weights):
+        return log_loss(y, np.clip(probs @ weights, 1e-7, 1 - 1e-7), labels=[0, 1])
+    
+    base_probs = np.column_stack(base_probs)
+    best_weights, best_loss = None, np.inf
+    for w in np.linspace(0, 1, steps):
+        weights = np.array([w, 1 - w])
+        loss = ensemble_log_loss(base_probs, y_true, weights)
+        if loss < best_loss:
+            best_weights, best_loss = weights, loss
+    
+    artifact = {
+        'version': ENSEMBLE_WEIGHTS_VERSION,
+        'models': list(model_names),
+        'weights': best_weights.tolist(),
+        'objective': 'log_loss',
+        'fit_log_loss': float(best_loss),
+        'n_fit': int(len(y_true)),
+        'created_at': datetime.now().isoformat()
+    }
+    if holdout is not None:
+        holdout_probs, y_holdout = np.column_stack(holdout[0]), holdout[1]
+        artifact.update({
+            'holdout_log_loss': float(ensemble_log_loss(holdout_probs, y_holdout, best_weights)),
+            'holdout_accuracy': float(accuracy_score(y_holdout, (holdout_probs @ best_weights > 0.5).astype(int))),
+            'n_holdout': int(len(y_holdout))
+        })
+    return artifact
+
 def train_behavioral_models():
     """Train models on behavioral data"""
     print("="*60)
@@ -114,12 +178,22 @@ def train_behavioral_models():
     print(f"Ensemble AUC: {ensemble_auc:.4f}")
     print(f"Classification Report:\n{classification_report(y_test, ensemble_pred)}")
     
+    # Calibrate ensemble weights on out-of-fold predictions for the training
+    # split so the server can combine predictions without running PSO per
+    # request; the test split only scores them
+    oof_probs = out_of_fold_probabilities([rf_model, svm_model], X_train_scaled, y_train)
+    ensemble_weights = fit_ensemble_weights(oof_probs, y_train, holdout=([rf_prob, svm_prob], y_test))
+    print(f"Calibrated ensemble weights (RF, SVM): {ensemble_weights['weights']}")
+    print(f"Calibrated Ensemble Accuracy: {ensemble_weights['holdout_accuracy']:.4f}")
+    
     # Save models
     os.makedirs('models', exist_ok=True)
     joblib.dump(rf_model, 'models/behavioral_rf_model.joblib')
     joblib.dump(svm_model, 'models/behavioral_svm_model.joblib')
     joblib.dump(scaler, 'models/behavioral_scaler.joblib')
     joblib.dump(label_encoder, 'models/behavioral_label_encoder.joblib')
+    ensemble_weights['sources'] = model_fingerprints('behavioral')
+    joblib.dump(ensemble_weights, 'models/behavioral_ensemble_weights.joblib')
     
     print("\nModels saved successfully!")
     
@@ -221,10 +295,17 @@ def train_eye_tracking_models():
     print(f"SVM AUC: {svm_auc:.4f}")
     print(f"Classification Report:\n{classification_report(y_test, svm_pred)}")
     
+    # Calibrate ensemble weights on out-of-fold predictions for the training split
+    oof_probs = out_of_fold_probabilities([rf_model, svm_model], X_train_scaled, y_train)
+    ensemble_weights = fit_ensemble_weights(oof_probs, y_train, holdout=([rf_prob, svm_prob], y_test))
+    print(f"Calibrated ensemble weights (RF, SVM): {ensemble_weights['weights']}")
+    
     # Save models
     joblib.dump(rf_model, 'models/eye_tracking_rf_model.joblib')
     joblib.dump(svm_model, 'models/eye_tracking_svm_model.joblib')
     joblib.dump(scaler, 'models/eye_tracking_scaler.joblib')
+    ensemble_weights['sources'] = model_fingerprints('eye_tracking')
+    joblib.dump(ensemble_weights, 'models/eye_tracking_ensemble_weights.joblib')
     
     print("\nEye tracking models saved successfully!")
     
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import active_sessions
+from active_sessions import SessionStore, merge_stored
+
+STAGES = ('behavioral', 'eye_tracking')
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def summary(probability):
+    return {'prediction': int(probability > 0.5), 'probability': probability, 'confidence': abs(probability - 0.5) * 2}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_whole_sessions_are_hits_and_partial_ones_are_not():
+    store = SessionStore(STAGES)
+    store.put('s1', 'behavioral', summary(0.8), T0)
+    summaries, written = store.get('s1')
+    assert not store.is_whole(summaries) and written == {'behavioral': T0}
+
+    store.put('s1', 'eye_tracking', summary(0.3), T0)
+    summaries, _ = store.get('s1')
+    assert store.is_whole(summaries)
+    assert store.get('missing') == ({}, {})
+    assert (store.hits, store.partial, store.misses) == (1, 1, 1)
+
+
+def test_sessions_expire_after_their_last_write(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(active_sessions.time, 'monotonic', clock)
+    store = SessionStore(STAGES, ttl_seconds=10)
+    store.put('s1', 'behavioral', summary(0.8), T0)
+    clock.now += 8
+    # A stage write extends the session's lifetime
+    store.put('s1', 'eye_tracking', summary(0.3), T0)
+    clock.now += 8
+    assert store.get('s1')[0] != {}
+
+    clock.now += 3
+    assert store.get('s1') == ({}, {})
+    assert store.expired == 1 and store.bytes == 0
+
+
+def test_least_recently_written_session_is_evicted():
+    store = SessionStore(STAGES, max_sessions=2)
+    store.put('s1', 'behavioral', summary(0.8), T0)
+    store.put('s2', 'behavioral', summary(0.8), T0)
+    store.put('s1', 'eye_tracking', summary(0.3), T0)
+    store.put('s3', 'behavioral', summary(0.8), T0)
+    assert store.get('s2') == ({}, {})
+    assert store.get('s1')[0] and store.get('s3')[0]
+    assert store.evictions == 1 and store.stats()['sessions'] == 2
+
+
+def test_disabled_store_holds_nothing():
+    store = SessionStore(STAGES, max_sessions=0)
+    store.put('s1', 'behavioral', summary(0.8), T0)
+    assert store.get('s1') == ({}, {})
+
+
+def test_partial_session_merges_with_stored_entries():
+    stored = {
+        # Stored before this process's write, e.g. by another worker's earlier request
+        'behavioral': {'result': summary(0.2), 'timestamp': T0 - timedelta(seconds=5)},
+        # Only the stored entry exists
+        'eye_tracking': {**summary(0.7), 'timestamp': T0},
+    }
+    summaries = {'behavioral': summary(0.9)}
+    assert merge_stored(summaries, {'behavioral': T0}, stored) == {
+        'behavioral': summary(0.9), 'eye_tracking': summary(0.7)}
+
+    # A newer stored entry wins over the one held in memory
+    assert merge_stored(summaries, {'behavioral': T0 - timedelta(seconds=10)}, stored)['behavioral'] == summary(0.2)
@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime
+
+from assessment_store import SQLiteRepository
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+
+def with_repository(tmp_path, scenario):
+    async def run():
+        repository = SQLiteRepository(str(tmp_path / 'assessments.sqlite3'))
+        try:
+            await repository.ensure_indexes()
+            return await scenario(repository)
+        finally:
+            await repository.close()
+
+    return asyncio.run(run())
+
+
+def test_update_sessions_upserts_like_mongo_set(tmp_path):
+    async def scenario(repository):
+        await repository.update_sessions([
+            ('s1', {'stages.behavioral': {'probability': 0.8, 'timestamp': T0}, 'updated_at': T0}),
+        ])
+        created = await repository.get_session('s1')
+        # Dotted paths set one field, leaving its siblings alone
+        await repository.update_sessions([
+            ('s1', {'stages.eye_tracking': {'probability': 0.3}, 'updated_at': T0}),
+            ('s1', {'stages.behavioral.probability': 0.9}),
+        ])
+        return created, await repository.get_session('s1')
+
+    created, session = with_repository(tmp_path, scenario)
+    assert created['_id'] == 's1' and isinstance(created['created_at'], datetime)
+    assert session['created_at'] == created['created_at']
+    assert session['stages'] == {
+        'behavioral': {'probability': 0.9, 'timestamp': T0},
+        'eye_tracking': {'probability': 0.3},
+    }
+
+
+def test_set_replaces_whole_subdocuments(tmp_path):
+    async def scenario(repository):
+        await repository.update_sessions([('s1', {'stages.behavioral': {'probability': 0.8, 'result': {'a': 1}}})])
+        await repository.update_sessions([('s1', {'stages.behavioral': {'probability': 0.2}})])
+        return await repository.get_session('s1')
+
+    assert with_repository(tmp_path, scenario)['stages'] == {'behavioral': {'probability': 0.2}}
+
+
+def test_get_session_projects_dotted_fields(tmp_path):
+    async def scenario(repository):
+        await repository.update_sessions([('s1', {
+            'stages.behavioral': {'probability': 0.8, 'result': {'prediction': 1}},
+            'final_result': {'final_probability': 0.7},
+        })])
+        return (await repository.get_session('s1', ['stages.behavioral.result.prediction', 'stages.missing.probability']),
+                await repository.get_session('missing'))
+
+    projected, missing = with_repository(tmp_path, scenario)
+    assert projected == {'_id': 's1', 'stages': {'behavioral': {'result': {'prediction': 1}}}}
+    assert missing is None
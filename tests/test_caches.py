@@ -0,0 +1,150 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from scoring import PSOResultCache
+from response_cache import ResponseCache
+
+
+def test_response_cache_single_flight():
+    cache = ResponseCache()
+    key = ResponseCache.make_key('behavioral', {'A1_Score': 1}, 'v1')
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'prediction': 1, 'probability': 0.9}
+
+    async def run():
+        first = await asyncio.gather(*(cache.get_or_compute(key, compute) for _ in range(5)))
+        second = await cache.get_or_compute(key, compute)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert len(calls) == 1
+    assert first == [{'prediction': 1, 'probability': 0.9}] * 5 and second == first[0]
+    assert cache.coalesced == 4 and cache.hits == 1 and cache.misses == 1
+    # Every caller gets its own copy
+    second['prediction'] = 0
+    assert cache.get(key)['prediction'] == 1
+
+
+def test_response_cache_failure_is_shared_and_not_cached():
+    cache = ResponseCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError('model error')
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute('key', compute) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.stats()['entries'] == 0 and cache.stats()['in_flight'] == 0
+
+
+def test_response_cache_leader_cancellation_does_not_reach_followers():
+    cache = ResponseCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {'prediction': 0}
+
+    async def run():
+        leader = asyncio.ensure_future(cache.get_or_compute('key', compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cache.get_or_compute('key', compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == {'prediction': 0}
+    assert len(calls) == 1
+    assert cache.get('key') == {'prediction': 0}
+
+
+def test_response_cache_evicts_least_recently_used_by_bytes():
+    value = {'explanation': 'x' * 100}
+    entry_bytes = len(ResponseCache().put('probe', value))
+    cache = ResponseCache(max_bytes=3 * entry_bytes)
+    for key in 'abc':
+        cache.put(key, value)
+    cache.get('a')
+    cache.put('d', value)
+
+    assert cache.get('b') is None
+    assert all(cache.get(key) == value for key in 'acd')
+    assert cache.evictions == 1 and cache.bytes == 3 * entry_bytes
+
+    # Larger than the whole budget: returned but not stored
+    cache.put('huge', {'explanation': 'x' * (4 * entry_bytes)})
+    assert cache.get('huge') is None and cache.evictions == 1
+
+
+def test_response_cache_disabled():
+    cache = ResponseCache(max_bytes=0)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {'prediction': 0}
+
+    async def run():
+        for _ in range(2):
+            await cache.get_or_compute('key', compute)
+
+    asyncio.run(run())
+    assert len(calls) == 2 and cache.stats()['entries'] == 0
+
+
+def test_pso_cache_quantizes_keys_and_copies_weights():
+    cache = PSOResultCache(precision=3)
+    key = cache.make_key('behavioral', [0.12341, 0.9])
+    assert cache.make_key('behavioral', [0.12339, 0.9000001]) == key
+    assert cache.make_key('eye_tracking', [0.12341, 0.9]) != key
+
+    weights = np.array([0.3, 0.7])
+    cache.put(key, weights, 0.95)
+    weights[0] = 1.0
+    cached, score = cache.get(key)
+    np.testing.assert_array_equal(cached, [0.3, 0.7])
+    assert score == 0.95
+    cached[0] = 1.0
+    np.testing.assert_array_equal(cache.get(key)[0], [0.3, 0.7])
+
+
+def test_pso_cache_evicts_least_recently_used():
+    cache = PSOResultCache(max_size=2)
+    for key in ('a', 'b'):
+        cache.put(key, np.array([0.5, 0.5]), 0.9)
+    cache.get('a')
+    cache.put('c', np.array([0.5, 0.5]), 0.9)
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1 and cache.stats()['size'] == 2
+
+
+@pytest.mark.parametrize('ttl, expired', [(60, True), (0, False)])
+def test_pso_cache_ttl(monkeypatch, ttl, expired):
+    now = [1000.0]
+    monkeypatch.setattr('scoring.time.monotonic', lambda: now[0])
+    cache = PSOResultCache(ttl=ttl)
+    cache.put('a', np.array([0.5, 0.5]), 0.9)
+
+    now[0] += 30
+    assert cache.get('a') is not None
+    now[0] += 31
+    assert (cache.get('a') is None) == expired
+    assert cache.expirations == int(expired)
@@ -0,0 +1,62 @@
+import sys
+
+import numpy as np
+import pytest
+
+import document_codec
+from document_codec import PACKED_FORMAT_VERSION, pack, unpack
+
+FEATURES = [1, 0.5, 0, 1, 1, 0.5, 0, 0, 1, 0, 25, 1]
+VALUES = [0.8731945024, 0.6123411, 0.55, 0.45]
+PARAMS = {'top_features': ['A9_Score', 'A6_Score'], 'gender': 'm'}
+
+
+def test_round_trip():
+    entry = unpack(pack('behavioral-1', FEATURES, VALUES, PARAMS))
+
+    assert entry.template == 'behavioral-1'
+    np.testing.assert_array_equal(entry.features, FEATURES)
+    # Model outputs are stored as float64, unchanged
+    np.testing.assert_array_equal(entry.values, VALUES)
+    assert entry.params == PARAMS
+    assert entry.lossless
+
+
+def test_features_are_stored_as_float32():
+    features = [647.2391, 380.9, 0.1]
+    entry = unpack(pack('eye_tracking-1', features))
+
+    np.testing.assert_array_equal(entry.features, np.asarray(features, dtype=np.float32).astype(np.float64))
+    assert not entry.lossless
+    assert len(entry.values) == 0 and entry.params == {}
+
+
+def test_zstd_round_trip():
+    pytest.importorskip('zstandard')
+    features = np.tile(FEATURES, 20)
+    blob = pack('behavioral-1', features, VALUES, PARAMS, compression='zstd')
+
+    assert len(blob) < len(pack('behavioral-1', features, VALUES, PARAMS))
+    entry = unpack(blob)
+    np.testing.assert_array_equal(entry.features, features)
+    assert entry.params == PARAMS
+
+
+def test_compressed_entry_without_zstandard(monkeypatch):
+    pytest.importorskip('zstandard')
+    blob = pack('behavioral-1', np.tile(FEATURES, 20), compression='zstd')
+    monkeypatch.setitem(sys.modules, 'zstandard', None)
+
+    assert not document_codec.zstd_available()
+    with pytest.raises(ValueError, match='zstandard'):
+        unpack(blob)
+
+
+def test_rejects_unknown_compression_and_version():
+    with pytest.raises(ValueError):
+        pack('behavioral-1', FEATURES, compression='gzip')
+
+    blob = bytearray(pack('behavioral-1', FEATURES))
+    blob[0] = PACKED_FORMAT_VERSION + 1
+    with pytest.raises(ValueError):
+        unpack(bytes(blob))
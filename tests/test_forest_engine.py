@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from forest_engine import CompactForest, file_fingerprint, forest_path, load_compact_forest
+
+
+@pytest.fixture(scope='module')
+def forest():
+    rng = np.random.RandomState(0)
+    X = rng.normal(size=(400, 12))
+    y = (X[:, 0] + X[:, 3] * X[:, 5] + rng.normal(scale=0.5, size=400) > 0).astype(int)
+    return RandomForestClassifier(n_estimators=25, max_depth=8, random_state=0).fit(X, y), X
+
+
+def test_predict_proba_matches_sklearn_exactly(forest):
+    model, X = forest
+    compact = CompactForest.from_sklearn(model)
+    rows = np.vstack([X, np.random.RandomState(1).normal(scale=3.0, size=(500, 12))])
+    # Questionnaire-style inputs land exactly on split thresholds
+    rows = np.vstack([rows, np.round(rows * 2) / 2])
+
+    np.testing.assert_array_equal(compact.predict_proba(rows), model.predict_proba(rows))
+    np.testing.assert_array_equal(compact.predict(rows), model.predict(rows))
+    np.testing.assert_array_equal(compact.feature_importances_, model.feature_importances_)
+
+
+def test_rejects_wrong_feature_count(forest):
+    compact = CompactForest.from_sklearn(forest[0])
+    with pytest.raises(ValueError):
+        compact.predict_proba(np.zeros((3, 11)))
+
+
+def test_export_round_trip_and_staleness(forest, tmp_path):
+    import joblib
+
+    model, X = forest
+    model_path = str(tmp_path / 'behavioral_rf_model.joblib')
+    joblib.dump(model, model_path)
+    CompactForest.from_sklearn(model, file_fingerprint(model_path)).save(forest_path(model_path))
+
+    loaded = load_compact_forest(model_path)
+    np.testing.assert_array_equal(loaded.predict_proba(X), model.predict_proba(X))
+
+    # A retrained model makes the export stale
+    joblib.dump(RandomForestClassifier(n_estimators=3, random_state=1).fit(X, X[:, 0] > 0), model_path)
+    assert load_compact_forest(model_path) is None
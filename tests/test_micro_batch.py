@@ -0,0 +1,56 @@
+import asyncio
+
+import numpy as np
+
+import metrics
+from micro_batch import MicroBatcher
+
+
+class InlineExecutor:
+    """Runs batch functions on the event loop thread, recording the batch sizes"""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    async def run_with_phases(self, func, rows):
+        self.batch_sizes.append(len(rows))
+        await asyncio.sleep(0.005)
+        return metrics.collect_phases(func, rows)
+
+
+WEIGHTS = np.array([0.5, -1.0, 2.0])
+
+
+def score_rows(rows):
+    probabilities = 1 / (1 + np.exp(-rows @ WEIGHTS))
+    return [{'probability': float(p), 'prediction': int(p > 0.5)} for p in probabilities]
+
+
+def test_batched_results_match_single_row_scoring():
+    rows = np.random.default_rng(0).normal(size=(23, 3))
+    executor = InlineExecutor()
+    batcher = MicroBatcher(score_rows, executor, max_batch_size=8, window_ms=5)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(row) for row in rows))
+
+    results = asyncio.run(run())
+    assert results == [score_rows(row[np.newaxis, :])[0] for row in rows]
+    # The first row goes out alone, the rest in batches of at most max_batch_size
+    assert executor.batch_sizes[0] == 1
+    assert max(executor.batch_sizes) <= 8 and sum(executor.batch_sizes) == len(rows)
+    assert batcher.stats()['batches'] == len(executor.batch_sizes)
+
+
+def test_batch_failure_reaches_every_row():
+    def fail(rows):
+        raise ValueError('bad batch')
+
+    batcher = MicroBatcher(fail, InlineExecutor(), max_batch_size=4, window_ms=5)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit(np.zeros(3)) for _ in range(6)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert batcher.stats()['rows'] == 6
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+
+from svm_engine import PARITY_TOLERANCE, FusedRBFSVM, build_fused_svm
+
+
+@pytest.fixture(scope='module')
+def fitted():
+    rng = np.random.RandomState(0)
+    # Unevenly scaled features, so folding the scaler in matters
+    X = rng.normal(size=(300, 9)) * np.linspace(1, 500, 9) + np.linspace(-50, 800, 9)
+    scaler = StandardScaler().fit(X)
+    Z = scaler.transform(X)
+    y = (Z[:, 0] + Z[:, 4] * Z[:, 7] + rng.normal(scale=0.5, size=300) > 0).astype(int)
+    svm = SVC(kernel='rbf', probability=True, random_state=0).fit(scaler.transform(X), y)
+    return scaler, svm, X
+
+
+def test_predict_proba_matches_sklearn(fitted):
+    scaler, svm, X = fitted
+    fused = FusedRBFSVM.from_sklearn(scaler, svm)
+    rows = np.vstack([X, scaler.inverse_transform(np.random.RandomState(1).normal(scale=3.0, size=(500, 9)))])
+
+    expected = svm.predict_proba(scaler.transform(rows))
+    np.testing.assert_allclose(fused.predict_proba(rows), expected, rtol=0, atol=PARITY_TOLERANCE)
+    np.testing.assert_allclose(fused.decision_values(rows), -svm.decision_function(scaler.transform(rows)),
+                               rtol=1e-9, atol=1e-9)
+
+
+def test_build_fused_svm_checks_parity(fitted):
+    scaler, svm, _ = fitted
+    assert build_fused_svm(scaler, svm).n_features_in_ == 9
+
+
+def test_rejects_unsupported_models(fitted):
+    scaler, _, X = fitted
+    y = (X[:, 0] > np.median(X[:, 0])).astype(int)
+    with pytest.raises(ValueError):
+        FusedRBFSVM.from_sklearn(scaler, SVC(kernel='linear', probability=True).fit(scaler.transform(X), y))
+    with pytest.raises(ValueError):
+        FusedRBFSVM.from_sklearn(scaler, SVC(kernel='rbf').fit(scaler.transform(X), y))
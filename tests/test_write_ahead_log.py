@@ -0,0 +1,153 @@
+import asyncio
+import os
+
+import pytest
+
+from assessment_store import AssessmentRepository
+from write_ahead_log import (CircuitBreaker, CircuitOpenError, GuardedRepository, WriteAheadLog,
+                             WriteAheadLogLocked, claim_write_ahead_log)
+
+
+class FlakyRepository(AssessmentRepository):
+    """Records session updates; fails while down or once fail_after bulk writes have succeeded"""
+
+    name = 'flaky'
+
+    def __init__(self):
+        self.down = True
+        self.fail_after = None
+        self.calls = 0
+        self.updates = []
+
+    async def update_sessions(self, updates):
+        if self.down or (self.fail_after is not None and self.calls >= self.fail_after):
+            raise ConnectionError('database unavailable')
+        self.calls += 1
+        self.updates.extend(updates)
+
+    async def get_session(self, session_id, fields=None):
+        if self.down:
+            raise ConnectionError('database unavailable')
+        return None
+
+
+def guarded(repository, path, replay_batch=500):
+    return GuardedRepository(repository, CircuitBreaker(failure_threshold=1, reset_timeout=0.05),
+                             WriteAheadLog(path, fsync=False), replay_batch=replay_batch)
+
+
+def update(n):
+    return ('session-1', {'n': n})
+
+
+def test_writes_go_to_the_log_while_the_database_is_down(tmp_path):
+    async def run():
+        repository = FlakyRepository()
+        guard = guarded(repository, str(tmp_path / 'assessments.wal'))
+        for n in range(3):
+            await guard.update_sessions([update(n)])
+
+        assert guard.breaker.state == 'open'
+        assert guard.log.has_pending() and guard.logged_writes == 3
+        assert repository.updates == []
+        with pytest.raises(CircuitOpenError):
+            await guard.get_session('session-1')
+
+        # Back up: new writes queue behind the log, the replay keeps their order
+        repository.down = False
+        await asyncio.sleep(0.06)
+        await guard.update_sessions([update(3)])
+        assert await guard.replay()
+
+        assert [u[1]['n'] for u in repository.updates] == [0, 1, 2, 3]
+        assert guard.breaker.state == 'closed'
+        assert not guard.log.has_pending()
+        assert os.listdir(tmp_path) == ['assessments.wal.lock']
+        guard.log.close()
+
+    asyncio.run(run())
+
+
+def test_replay_resumes_from_the_checkpoint(tmp_path):
+    path = str(tmp_path / 'assessments.wal')
+
+    async def log_updates():
+        guard = guarded(FlakyRepository(), path)
+        for n in range(6):
+            await guard.update_sessions([update(n)])
+        guard.log.close()
+
+    async def replay_interrupted():
+        repository = FlakyRepository()
+        repository.down = False
+        # Two bulk writes of two updates succeed, then the database goes away
+        repository.fail_after = 2
+        guard = guarded(repository, path, replay_batch=2)
+        assert not await guard.replay()
+        guard.log.close()
+        return repository.updates
+
+    async def replay_after_restart():
+        repository = FlakyRepository()
+        repository.down = False
+        guard = guarded(repository, path, replay_batch=2)
+        assert guard.log.has_pending()
+        assert await guard.replay()
+        guard.log.close()
+        return repository.updates, guard.log.has_pending()
+
+    asyncio.run(log_updates())
+    first = asyncio.run(replay_interrupted())
+    second, pending = asyncio.run(replay_after_restart())
+
+    assert [u[1]['n'] for u in first] == [0, 1, 2, 3]
+    assert [u[1]['n'] for u in second] == [4, 5]
+    assert not pending
+
+
+def test_reads_replay_the_log_first(tmp_path):
+    async def run():
+        repository = FlakyRepository()
+        guard = guarded(repository, str(tmp_path / 'assessments.wal'))
+        await guard.update_sessions([update(0)])
+        assert guard.log.has_pending()
+
+        # A read must not see the database without the logged write
+        repository.down = False
+        await asyncio.sleep(0.06)
+        assert await guard.get_session('session-1') is None
+        assert [u[1]['n'] for u in repository.updates] == [0]
+        assert not guard.log.has_pending()
+        guard.log.close()
+
+    asyncio.run(run())
+
+
+def test_empty_replay_releases_the_half_open_trial(tmp_path):
+    async def run():
+        guard = guarded(FlakyRepository(), str(tmp_path / 'assessments.wal'))
+        guard.breaker.record_failure()
+        await asyncio.sleep(0.06)
+        # Pending with nothing on disk, as right after a restart that found an empty replay file
+        guard.log.pending = True
+        assert await guard.replay()
+        assert guard.breaker.allow()
+        guard.log.close()
+
+    asyncio.run(run())
+
+
+def test_each_process_claims_its_own_log(tmp_path):
+    path = str(tmp_path / 'assessments.wal')
+    first = claim_write_ahead_log(path, fsync=False)
+    with pytest.raises(WriteAheadLogLocked):
+        WriteAheadLog(path, fsync=False)
+    second = claim_write_ahead_log(path, fsync=False)
+    assert (first.path, second.path) == (path, str(tmp_path / 'assessments.1.wal'))
+
+    # Released on close, so a restarted process picks the log up again
+    first.close()
+    third = claim_write_ahead_log(path, fsync=False)
+    assert third.path == path
+    second.close()
+    third.close()
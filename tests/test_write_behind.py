@@ -0,0 +1,101 @@
+import asyncio
+
+from assessment_store import PartialWriteError
+from write_behind import WriteBehindBuffer
+
+
+class RecordingWriter:
+    """Write method that records batches; fails the next `failures` calls, or rejects some items"""
+
+    def __init__(self):
+        self.batches = []
+        self.failures = 0
+        self.reject = set()
+
+    async def __call__(self, items):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('database unavailable')
+        rejected = [item for item in items if item in self.reject]
+        self.reject.clear()
+        self.batches.append([item for item in items if item not in rejected])
+        if rejected:
+            raise PartialWriteError(f'{len(rejected)} item(s) rejected', rejected)
+
+    @property
+    def written(self):
+        return [item for batch in self.batches for item in batch]
+
+
+def test_failed_writes_are_retried_ahead_of_newer_items():
+    async def run():
+        write = RecordingWriter()
+        buffer = WriteBehindBuffer('test', write, max_batch=3, flush_interval_ms=1000)
+        buffer.start()
+        await buffer.put_many([0, 1, 2])
+        write.failures = 1
+        assert not await buffer._write_batch()
+        await buffer.put_many([3, 4])
+        write.reject = {1}
+        await buffer.flush()
+        await buffer.flush()
+        await buffer.stop()
+        return write, buffer
+
+    write, buffer = asyncio.run(run())
+    # 1 was rejected once and goes out again before the items queued after it
+    assert write.batches == [[0, 2], [1, 3, 4]]
+    assert buffer.failed_flushes == 2 and buffer.written == 5
+
+
+def test_put_blocks_at_max_pending_until_a_flush():
+    async def run():
+        write = RecordingWriter()
+        buffer = WriteBehindBuffer('test', write, max_batch=10, flush_interval_ms=1000, max_pending=2)
+        buffer.start()
+        await buffer.put_many([0, 1])
+        blocked = asyncio.ensure_future(buffer.put(2))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+
+        await buffer.flush()
+        await asyncio.wait_for(blocked, 1)
+        await buffer.stop()
+        return write, buffer
+
+    write, buffer = asyncio.run(run())
+    assert write.batches == [[0, 1], [2]]
+    assert buffer.backpressure_waits == 1
+
+
+def test_flush_key_writes_one_key_ahead_of_the_rest():
+    async def run():
+        write = RecordingWriter()
+        buffer = WriteBehindBuffer('test', write, max_batch=10, flush_interval_ms=1000,
+                                   key=lambda item: item[0])
+        buffer.start()
+        await buffer.put_many([('a', 0), ('b', 0), ('a', 1), ('b', 1)])
+        await buffer.flush_key('a')
+        flushed = list(write.batches)
+        # Nothing buffered for the key: no write
+        await buffer.flush_key('a')
+        await buffer.stop()
+        return flushed, write
+
+    flushed, write = asyncio.run(run())
+    assert flushed == [[('a', 0), ('a', 1)]]
+    assert write.batches == [[('a', 0), ('a', 1)], [('b', 0), ('b', 1)]]
+
+
+def test_stop_drains_the_buffer():
+    async def run():
+        write = RecordingWriter()
+        buffer = WriteBehindBuffer('test', write, max_batch=2, flush_interval_ms=1000)
+        buffer.start()
+        await buffer.put_many(list(range(5)))
+        await buffer.stop()
+        return write, buffer
+
+    write, buffer = asyncio.run(run())
+    assert write.written == list(range(5))
+    assert buffer.stats()['depth'] == 0 and not buffer.stats()['enabled']